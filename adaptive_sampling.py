@@ -0,0 +1,139 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Adaptive sampling controller for trajectories
+
+ After each frame the variance map (enableVarianceMapping) is read back to
+ estimate the relative noise of the image:
+     noise = sqrt(mean(variance) / samples) / mean(signal)     (over lit pixels)
+ variance being the per-sample variance. Whether the map holds it or the
+ variance of the pixel mean is detected at the first frame (see variance_map),
+ which is rendered a first time with a quarter of the samples.
+ The number of samples per pixel of the next frame is scaled by
+ (noise / target)^2, since noise decreases as 1/sqrt(samples).
+ Once the sample count has settled (changes below <tolerance> for
+ <threshold_after> frames), the std-dev threshold of the server
+ (setStdDevThreshold, standard deviation below which a pixel stops being
+ sampled) is set to the target noise times the mean signal, so that pixels
+ reaching the target early stop being sampled, and the sample count is kept
+ as the per-pixel maximum. The estimate then only bounds the noise from below
+ (pixels stopped early received fewer samples than nominal): the threshold is
+ only removed, and the control resumed, when it exceeds the target.
+ The time/noise trade-off of every frame is appended to a CSV log.
+"""
+import csv
+import time
+import numpy as np
+from variance_map import variance_convention, sample_variance
+
+
+class AdaptiveSampler:
+    """
+    Renders frames with client <s>, adjusting setNbSamplesPerPixel and setStdDevThreshold to reach <target_noise>.
+    <getter> is the image getter whose result is returned by render() and used as signal level.
+    <convention> is the convention of the variance map ('sample' or 'mean', see variance_map), None to detect it.
+    <threshold_after> is the number of settled frames before the std-dev threshold is used (None: never).
+    """
+
+    LOG_FIELDS = ('frame', 'samples', 'threshold', 'noise', 'render_time', 'transfer_time')
+
+    def __init__(self, s, target_noise, samples=16, min_samples=4, max_samples=1024, getter='getImageGray32F',
+                 damping=0.5, log_file=None, convention=None, threshold_after=3, tolerance=0.2):
+        self.s = s
+        self.target_noise = target_noise
+        self.samples = samples
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.getter = getter
+        self.damping = damping
+        self.convention = convention
+        self.threshold_after = threshold_after
+        self.tolerance = tolerance
+        self.threshold = 0.0
+        self._settled = 0
+        self.log = []
+        self._log_file = None
+        if log_file:
+            self._log_file = open(log_file, 'w', newline='')
+            self._log_writer = csv.writer(self._log_file)
+            self._log_writer.writerow(self.LOG_FIELDS)
+        s.enableVarianceMapping(True)
+
+    def render(self):
+        """Render a frame with the current settings, update them for the next frame and return the image."""
+        s = self.s
+        t0 = time.perf_counter()
+        s.setStdDevThreshold(self.threshold)
+        probe = None
+        if self.convention is None:
+            # Same scene with fewer samples: the evolution of the map level gives its convention
+            probe = max(1, self.samples // 4)
+            s.setNbSamplesPerPixel(probe)
+            s.render()
+            probe = (probe, float(np.mean(s.getVarianceMap())))
+        s.setNbSamplesPerPixel(self.samples)
+        s.render()
+        t1 = time.perf_counter()
+        image = getattr(s, self.getter)()
+        variance = np.asarray(s.getVarianceMap(), dtype=np.float64)
+        t2 = time.perf_counter()
+        if probe is not None:
+            self.convention = variance_convention(probe[1], float(variance.mean()), probe[0], self.samples)
+
+        signal = np.asarray(image, dtype=np.float64)
+        if signal.ndim == 3:
+            signal = signal[..., :3].mean(axis=2)
+        if variance.ndim == 3:
+            variance = variance[..., :3].mean(axis=2)
+        lit = signal > 0
+        level = signal[lit].mean() if lit.any() else 1.0
+        if self.convention is None:
+            # Undecided (e.g. noise-free image): detected again at the next frame
+            noise = np.nan
+        elif lit.any():
+            noise = np.sqrt(sample_variance(variance[lit], self.convention, self.samples).mean() / self.samples) / level
+        else:
+            noise = 0.0
+
+        row = (len(self.log), self.samples, self.threshold, noise, t1 - t0, t2 - t1)
+        self.log.append(row)
+        if self._log_file:
+            self._log_writer.writerow(['%.6g' % v if isinstance(v, float) else v for v in row])
+            self._log_file.flush()
+
+        if self.threshold:
+            if not noise > self.target_noise * (1 + self.tolerance):
+                # The estimate is a lower bound: the threshold follows the signal level, samples are kept
+                self.threshold = self.target_noise * level
+                return image
+            self.threshold = 0.0
+            self._settled = 0
+
+        # Damped multiplicative update (noise ~ 1/sqrt(samples))
+        if noise > 0:
+            ratio = (noise / self.target_noise) ** 2
+            samples = int(np.clip(round(self.samples * ratio ** (1 - self.damping)), self.min_samples, self.max_samples))
+            self._settled = self._settled + 1 if abs(samples / self.samples - 1) < self.tolerance else 0
+            self.samples = samples
+            if self.threshold_after is not None and self._settled >= self.threshold_after:
+                self.threshold = self.target_noise * level
+        return image
+
+    def close(self):
+        if self._log_file:
+            self._log_file.close()
+            self._log_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def summary(self):
+        """Return (frames, total render time, mean noise) of the rendered frames."""
+        if not self.log:
+            return 0, 0.0, 0.0
+        log = np.array(self.log, dtype=np.float64)
+        return len(log), float(log[:, 4].sum()), float(np.nanmean(log[:, 3]))
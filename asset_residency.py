@@ -0,0 +1,320 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : asset residency across a pool of servers for batches of compiled scenarios
+
+ Every server keeps the objects (bodies, meshes, DEMs) created by the last
+ scenarios it ran. For each server the manager tracks the resident objects and
+ their asset files (meshes, DEMs, textures), the BRDFs and shapes created, and
+ every state key touched by the scenarios since the last reset (initial state
+ and frames). A scenario (scenario_compiler.Program) then only creates what is
+ missing: BRDFs and shapes are named after their definition so that different
+ definitions coexist, objects already created with the same definition are
+ reused, and mesh BRDF bindings are sent again. The server is reset (and every
+ object created again) only when it holds an object the scenario does not have
+ or defines differently, when the settings the resources depend on differ, or
+ when a state key touched before is not set by the scenario (stale state).
+ Scenarios are routed by an estimated cost (frames, plus loading of the asset
+ bytes a server does not hold), so that large batches sharing their assets are
+ split across servers when loading is cheaper than waiting. A server running
+ out of work takes queued scenarios of the most loaded server, and preloads
+ their resources before running them.
+ Usage:
+   python asset_residency.py scenarios/*.json --servers host1:5151,host2:5151 [--getter getImageGray32F --output-dir out]
+"""
+import os
+import sys
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+import scenario_compiler
+from reference_store import feed
+from psf_library import PSFSession
+
+# Client calls reading asset files: method: indexes of the file arguments
+ASSET_ARGUMENTS = {
+    'createMesh': (1,),
+    'createSphericalDEM': (1, 3),
+    'createBody': (3,),
+    'setBackground': (0,),
+}
+DEFINITIONS = ('createBRDF', 'createShape')
+OBJECTS = ('createBody', 'createMesh', 'createSphericalDEM')
+
+
+def _digest(obj):
+    h = hashlib.sha256()
+    feed(h, obj)
+    return h.hexdigest()
+
+
+def call_assets(calls):
+    """Set of the asset files read by <calls>."""
+    assets = set()
+    for name, args in calls:
+        for index in ASSET_ARGUMENTS.get(name, ()):
+            if index < len(args):
+                value = args[index]
+                assets.update(value if isinstance(value, (list, tuple)) else [value])
+    assets.discard('')
+    return assets
+
+
+def program_assets(program):
+    """Set of the asset files read by <program> (resources and star map)."""
+    return call_assets(list(program.resources) + list(program.state))
+
+
+def asset_size(path):
+    """Size of asset <path> when found locally (weight of the routing), 1 otherwise."""
+    return os.path.getsize(path) if os.path.isfile(path) else 1
+
+
+def state_keys(calls):
+    return set(scenario_compiler._state_key(call) for call in calls)
+
+
+def touched_keys(program):
+    """Keys of every setter sent by <program>: settings, initial state and frames."""
+    return state_keys(list(program.settings) + list(program.state) + [call for frame in program.frames for call in frame])
+
+
+class Scene:
+    """
+    Resources of <program>, BRDFs and shapes being named after their definition:
+    definitions {name: call}, objects {name: call}, bindings (setObjectElementBRDF calls).
+    """
+
+    def __init__(self, program):
+        self.settings = _digest([call for call in program.settings if call[0] in scenario_compiler.RESOURCE_SETTINGS])
+        self.definitions = OrderedDict()
+        self.objects = OrderedDict()
+        self.bindings = []
+        names = {}
+        for name, args in program.resources:
+            if name in DEFINITIONS:
+                unique = '%s_%s' % (args[0], _digest([name, args[1:]])[:12])
+                names[(name, args[0])] = unique
+                self.definitions[unique] = (name, (unique,) + tuple(args[1:]))
+            elif name == 'createBody':
+                obj, shape, brdf = args[:3]
+                self.objects[obj] = (name, (obj, names[('createShape', shape)], names[('createBRDF', brdf)]) + tuple(args[3:]))
+            elif name == 'createSphericalDEM':
+                obj, path, brdf = args[:3]
+                self.objects[obj] = (name, (obj, path, names[('createBRDF', brdf)]) + tuple(args[3:]))
+            elif name == 'setObjectElementBRDF':
+                self.bindings.append((name, tuple(args[:2]) + (names[('createBRDF', args[2])],)))
+            else:
+                self.objects[args[0]] = (name, tuple(args))
+        self.object_digests = {obj: _digest(call) for obj, call in self.objects.items()}
+
+
+class ServerState:
+    """What server <endpoint> currently holds."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.clear()
+
+    def clear(self):
+        self.settings = None            # digest of the settings the resources were created with
+        self.definitions = set()
+        self.objects = {}               # name: digest of the creation call
+        self.assets = set()
+        self.state_keys = set()
+        self.preloaded = set()          # objects created by preload() and not used yet
+
+    def compatible(self, scene):
+        """Whether <scene> can be built on top of the resident objects."""
+        return self.settings == scene.settings and all(scene.object_digests.get(obj) == digest for obj, digest in self.objects.items())
+
+
+class ResidencyManager:
+    """
+    Routes compiled scenarios to <endpoints> ((host, port) list) according to the assets they hold.
+    <load_cost> is the estimated cost of loading one megabyte of assets, in rendered frames.
+    """
+
+    def __init__(self, endpoints, load_cost=0.1):
+        self.servers = OrderedDict((endpoint, ServerState(endpoint)) for endpoint in endpoints)
+        self.load_cost = load_cost
+        self.resets = 0
+        self.loads = 0          # creations reading asset files sent
+        self.reused = 0         # creations reading asset files avoided
+        self._lock = threading.Lock()
+
+    def plan(self, programs):
+        """
+        Return {endpoint: [programs]}: each program goes to the server with the lowest estimated finish time
+        (frames plus loading of the missing asset bytes), programs sharing resources being placed together.
+        The assets of a server accumulate along its plan, until a program incompatible with its objects resets it.
+        """
+        groups = OrderedDict()
+        for program in programs:
+            groups.setdefault(program.resource_digest(), []).append(program)
+        plan = OrderedDict((endpoint, []) for endpoint in self.servers)
+        load = dict.fromkeys(self.servers, 0.0)
+        residents = OrderedDict()
+        for endpoint, server in self.servers.items():
+            resident = residents[endpoint] = ServerState(endpoint)
+            resident.settings, resident.objects, resident.assets = server.settings, dict(server.objects), set(server.assets)
+        for group in sorted(groups.values(), key=len, reverse=True):
+            scene = Scene(group[0])
+            needed = program_assets(group[0])
+            for program in group:
+                def cost(endpoint):
+                    held = residents[endpoint].assets if residents[endpoint].compatible(scene) else set()
+                    missing = sum(asset_size(a) for a in needed - held) / 1e6
+                    return load[endpoint] + self.load_cost * missing, missing
+                endpoint = min(self.servers, key=cost)
+                load[endpoint] = cost(endpoint)[0] + max(len(program.frames), 1)
+                resident = residents[endpoint]
+                if not resident.compatible(scene):
+                    resident.clear()
+                resident.settings = scene.settings
+                resident.objects.update(scene.object_digests)
+                resident.assets |= needed
+                plan[endpoint].append(program)
+        return plan
+
+    def resource_calls(self, endpoint, program):
+        """Calls creating the resources of <program> missing on server <endpoint> (reset first if needed)."""
+        server = self.servers[endpoint]
+        scene = Scene(program)
+        stale = not server.state_keys <= state_keys(list(program.settings) + list(program.state))
+        calls = []
+        if stale or not server.compatible(scene):
+            calls.append(('reset', ()))
+            server.clear()
+            with self._lock:
+                self.resets += 1
+        calls += list(program.settings)
+        server.settings = scene.settings
+        for name, call in scene.definitions.items():
+            if name not in server.definitions:
+                calls.append(call)
+                server.definitions.add(name)
+        for obj, call in scene.objects.items():
+            if obj in server.objects:
+                continue
+            calls.append(call)
+            server.objects[obj] = scene.object_digests[obj]
+            server.assets |= call_assets([call])
+            with self._lock:
+                self.loads += bool(call_assets([call]))
+        return calls + scene.bindings
+
+    def setup_calls(self, endpoint, program):
+        """Calls bringing server <endpoint> to the initial state of <program>, and update its residency."""
+        calls = self.resource_calls(endpoint, program)
+        server = self.servers[endpoint]
+        readers = set(args[0] for name, args in program.resources if name in OBJECTS and call_assets([(name, args)]))
+        created = set(args[0] for name, args in calls if name in OBJECTS)
+        with self._lock:
+            self.reused += len(readers - created - server.preloaded)
+        server.state_keys |= touched_keys(program)
+        server.preloaded = set()
+        return calls + list(program.state)
+
+    def preload(self, endpoint, s, program):
+        """Create the resources of <program> on server <endpoint> (client <s>) ahead of its execution."""
+        calls = self.resource_calls(endpoint, program)
+        self.servers[endpoint].preloaded = set(args[0] for name, args in calls if name in OBJECTS)
+        program.execute(s, calls)
+
+    def run(self, programs, clients, on_frame=None):
+        """
+        Run <programs> on the servers, <clients> being {endpoint: connected client}. After each render,
+        on_frame(program, frame index, client) is called (e.g. to retrieve the image).
+        Returns {endpoint: [programs run]}.
+        """
+        queues = OrderedDict((endpoint, deque(queue)) for endpoint, queue in self.plan(programs).items())
+        done = OrderedDict((endpoint, []) for endpoint in self.servers)
+        lock = threading.Lock()
+        errors = []
+
+        def next_program(endpoint, s):
+            with lock:
+                if queues[endpoint]:
+                    return queues[endpoint].popleft()
+                # Out of work: take the last queued group of the most loaded server (half of it if it is its only group)
+                victim = max(queues, key=lambda e: sum(max(len(p.frames), 1) for p in queues[e]))
+                queue = queues[victim]
+                if not queue:
+                    return None
+                digest = queue[-1].resource_digest()
+                tail = 0
+                while tail < len(queue) and queue[-1 - tail].resource_digest() == digest:
+                    tail += 1
+                count = tail if tail < len(queue) else (tail + 1) // 2
+                group = [queue.pop() for _ in range(count)][::-1]
+                queues[endpoint].extend(group[1:])
+            self.preload(endpoint, s, group[0])
+            return group[0]
+
+        def worker(endpoint):
+            s = PSFSession(clients[endpoint])
+            try:
+                while True:
+                    program = next_program(endpoint, s)
+                    if program is None:
+                        return
+                    done[endpoint].append(program)
+                    program.execute(s, self.setup_calls(endpoint, program))
+                    for index, frame in enumerate(program.frames):
+                        program.execute(s, frame + [('render', ())])
+                        if on_frame is not None:
+                            on_frame(program, index, s)
+            except Exception as e:
+                # The programs still queued here are taken by the other servers
+                errors.append((endpoint, e))
+                self.servers[endpoint].clear()
+        threads = [threading.Thread(target=worker, args=(endpoint,)) for endpoint in self.servers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            endpoint, error = errors[0]
+            raise RuntimeError("Server %s:%d failed: %s" % (endpoint[0], endpoint[1], error)) from error
+        return done
+
+
+def main(argv=None):
+    from conftest import parse_servers
+    from surrender.surrender_client import surrender_client
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='+', help='Scenario JSON files')
+    parser.add_argument('--servers', default='127.0.0.1:5151')
+    parser.add_argument('--getter', default=None, help='Image getter called after each render')
+    parser.add_argument('--output-dir', default='.', help='Directory of the retrieved images (.npy)')
+    parser.add_argument('--load-cost', type=float, default=0.1, help='Estimated cost of loading 1 MB of assets, in frames')
+    args = parser.parse_args(argv)
+
+    programs = [scenario_compiler.load(path) for path in args.scenarios]
+    for path, program in zip(args.scenarios, programs):
+        program.name = program.name or os.path.splitext(os.path.basename(path))[0]
+    endpoints = parse_servers(args.servers)
+    clients = {}
+    for host, port in endpoints:
+        clients[(host, port)] = surrender_client()
+        clients[(host, port)].connectToServer(host, port)
+
+    def save(program, index, s):
+        if args.getter:
+            name = ''.join(c if c.isalnum() else '_' for c in program.name)
+            np.save(os.path.join(args.output_dir, '%s_%04d.npy' % (name, index)), getattr(s, args.getter)())
+
+    manager = ResidencyManager(endpoints, args.load_cost)
+    done = manager.run(programs, clients, save)
+    for (host, port), queue in done.items():
+        print('%s:%d: %s' % (host, port, ', '.join(p.name for p in queue) or '-'))
+    print('%d resets, %d asset loads, %d avoided' % (manager.resets, manager.loads, manager.reused))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : render-time benchmark of the user manual scenarios
+
+ Each scenario is run through a timing proxy of surrender_client which splits
+ its wall time into:
+ - setup   : scene and settings calls, and script code before the first image transfer
+ - render  : render() calls
+ - transfer: image retrieval calls (getImage*, getVarianceMap...)
+ - write   : script code following an image transfer (conversion, file writing)
+ Results are stored as JSON with machine and version metadata, and compared to
+ a baseline to flag regressions beyond a relative tolerance.
+ Usage:
+   python benchmark_scenarios.py [--host H] [--port P] [--scenarios sphere,psf] [--output bench.json]
+                                 [--baseline baseline.json] [--tolerance 0.2]
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import importlib
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+from client_proxy import ClientProxy, EndpointProxy, IMAGE_GETTERS, patch_client_factory
+
+PHASES = ('setup', 'render', 'transfer', 'write')
+
+# name: (module, entry point, maximum number of renders or None)
+SCENARIOS = {
+    'sphere': ('test_01_rendering_a_sphere', 'test_render', None),
+    'earth_sun': ('test_02_simple_earth_sun_camera_system', 'test_render', None),
+    'solstice': ('test_03_summer_solstice', 'test_render', None),
+    'raytracing_precision': ('test_04_raytracing_precision', 'test_render', None),
+    'psf': ('test_05_psf', 'test_render', None),
+    'tycho': ('test_06_tycho_background', 'test_render', None),
+    'star_map': ('test_07_stellar_background', 'test_render', None),
+    'itokawa': ('test_08_itokawa_mesh', 'test_render', None),
+    'ceres': ('test_09_ceres_landing', 'test_render', None),
+    'full_moon': ('test_14_demo_fullmoon', 'main', 10),
+}
+
+
+class BenchmarkDone(Exception):
+    """Raised by the timing proxy to stop endless scenarios after a number of renders."""
+
+
+class PhaseTimer(ClientProxy):
+    """Accumulates the wall time of a scenario in PHASES."""
+
+    def __init__(self, client, max_renders=None):
+        ClientProxy.__init__(self, client)
+        self.max_renders = max_renders
+        self.renders = 0
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.start = self.last = time.perf_counter()
+        self.last_phase = 'setup'
+
+    def _gap(self, t):
+        # Script time between two calls is attributed to writing after an image transfer, to setup otherwise
+        self.times['write' if self.last_phase == 'transfer' else 'setup'] += t - self.last
+
+    def _call(self, name, method, args, kwargs):
+        if name == 'render':
+            if self.max_renders is not None and self.renders >= self.max_renders:
+                raise BenchmarkDone()
+            self.renders += 1
+        phase = 'render' if name == 'render' else 'transfer' if name in IMAGE_GETTERS else 'setup'
+        t0 = time.perf_counter()
+        self._gap(t0)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.last = time.perf_counter()
+            self.times[phase] += self.last - t0
+            self.last_phase = phase
+
+    def finish(self):
+        self._gap(time.perf_counter())
+        self.last = time.perf_counter()
+        return dict(self.times, total=self.last - self.start, renders=self.renders)
+
+
+def run_scenario(name, host, port):
+    """Run scenario <name> against <host>:<port> and return its timings and the server version."""
+    module_name, entry, max_renders = SCENARIOS[name]
+    module = importlib.import_module(module_name)
+    timers = []
+
+    def wrap(client):
+        timers.append(PhaseTimer(EndpointProxy(client, host, port), max_renders))
+        return timers[-1]
+    restore = patch_client_factory(module, wrap)
+    try:
+        args = (False, None, None, None) if entry == 'test_render' else ()
+        try:
+            getattr(module, entry)(*args)
+        except BenchmarkDone:
+            pass
+    finally:
+        restore()
+    result = timers[0].finish()
+    result['version'] = timers[0].version()
+    return result
+
+
+def metadata(host, port):
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'client_host': socket.gethostname(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'server': '%s:%d' % (host, port),
+    }
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=0.05):
+    """
+    Return the regressions of <results> with respect to <baseline> as (scenario, phase, baseline, value) tuples:
+    phases slower by more than <tolerance> (relative) and <min_seconds> (absolute).
+    """
+    regressions = []
+    for name, timings in results['scenarios'].items():
+        reference = baseline.get('scenarios', {}).get(name)
+        if reference is None:
+            continue
+        for phase in PHASES + ('total',):
+            ref, value = reference.get(phase), timings.get(phase)
+            if ref is not None and value is not None and value > ref * (1 + tolerance) and value - ref > min_seconds:
+                regressions.append((name, phase, ref, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5151)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenario names (default: all)')
+    parser.add_argument('--output', default='benchmark.json', help='Result file')
+    parser.add_argument('--baseline', default=None, help='Baseline result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown flagged as a regression')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    baseline_file = os.path.abspath(args.baseline) if args.baseline else None
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, script_dir)
+
+    results = {'metadata': metadata(args.host, args.port), 'scenarios': {}}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='surrender_bench_') as workdir:
+        # Scenario outputs are written to a scratch directory
+        os.chdir(workdir)
+        try:
+            for name in args.scenarios.split(','):
+                print("----------------------------------------")
+                print("Benchmark: %s" % name)
+                timings = run_scenario(name, args.host, args.port)
+                results['metadata']['surrender_version'] = timings.pop('version')
+                results['scenarios'][name] = timings
+        finally:
+            os.chdir(cwd)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    print("----------------------------------------")
+    print("%-22s %9s %9s %9s %9s %9s" % (('scenario',) + PHASES + ('total',)))
+    for name, t in results['scenarios'].items():
+        print("%-22s %9.3f %9.3f %9.3f %9.3f %9.3f" % ((name,) + tuple(t[p] for p in PHASES + ('total',))))
+
+    status = 0
+    if baseline_file:
+        with open(baseline_file, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, phase, ref, value in regressions:
+            print("REGRESSION %s/%s: %.3f s -> %.3f s (%+.0f%%)" % (name, phase, ref, value, 100 * (value / ref - 1)))
+        status = 1 if regressions else 0
+    print("----------------------------------------")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
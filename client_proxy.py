@@ -0,0 +1,92 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Transparent proxy around surrender_client
+
+ ClientProxy forwards every attribute to the wrapped client; method calls go
+ through _call(), which subclasses override to observe, time or redirect them.
+ Scripts can be run against a proxy without modification with
+ patch_client_factory(), which replaces the surrender_client name they import,
+ or patch_surrender_module() before they are imported or run.
+"""
+# Methods returning image data from the server
+IMAGE_GETTERS = frozenset((
+    'getImage', 'getImageGray8', 'getImageGray16', 'getImageGray32F', 'getImageRGBA8', 'getImageRGBA16',
+    'getImageRGBA32F', 'getImageSpectrumProjection', 'getVarianceMap', 'getDepthMap', 'getNormalMap',
+))
+
+
+class ClientProxy:
+    """Forwards attributes to <client>; method calls are routed through _call()."""
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def __class__(self):
+        # isinstance(proxy, <client class>) holds, as for the wrapped client
+        return self._client.__class__
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._call(name, attr, args, kwargs)
+        call.__name__ = name
+        return call
+
+    def _call(self, name, method, args, kwargs):
+        return method(*args, **kwargs)
+
+
+class EndpointProxy(ClientProxy):
+    """Redirects connectToServer() to a given <host>/<port>, whatever the script asks for."""
+
+    def __init__(self, client, host, port=5151):
+        ClientProxy.__init__(self, client)
+        self._host = host
+        self._port = port
+
+    def _call(self, name, method, args, kwargs):
+        if name == 'connectToServer':
+            return method(self._host, self._port)
+        return ClientProxy._call(self, name, method, args, kwargs)
+
+
+def patch_client_factory(module, wrap):
+    """
+    Make <module> (a script importing surrender_client) create wrap(surrender_client()) instead of surrender_client().
+    The name stays a subclass of the client class, so that its constants (surrender_client.XYZ) and isinstance()
+    checks of the wrapped clients keep working. Returns a function restoring the original class.
+    """
+    original = module.surrender_client
+
+    class WrappedClientType(type(original)):
+        def __instancecheck__(cls, obj):
+            return isinstance(obj, original)
+
+    class WrappedClient(original, metaclass=WrappedClientType):
+        def __new__(cls, *args, **kwargs):
+            # Not an instance of cls: __init__ is not called again on the proxy
+            return wrap(original(*args, **kwargs))
+    WrappedClient.__name__ = original.__name__
+    WrappedClient.__qualname__ = original.__qualname__
+    WrappedClient.__module__ = original.__module__
+    WrappedClient.__doc__ = original.__doc__
+    module.surrender_client = WrappedClient
+
+    def restore():
+        module.surrender_client = original
+    return restore
+
+
+def patch_surrender_module(wrap):
+    """
+    Make every script importing surrender_client from now on create wrap(surrender_client()).
+    Returns a function restoring the original factory.
+    """
+    import surrender.surrender_client as module
+    return patch_client_factory(module, wrap)
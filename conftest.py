@@ -1,3 +1,7 @@
+import os
+import json
+import pytest
+
 # Needed for pytest to add CLI options to facilitate the production of control values (especially images)
 def pytest_addoption(parser):
     parser.addoption("--gen-ref", action="store_true", help="Don't perform checks, instead generate reference image (override if exists) with 1024 rays per pixel")
@@ -6,3 +10,170 @@ def pytest_addoption(parser):
     parser.addoption("--save", action="store_true", help="In addition of checks, also save all test images and error histograms to ./save/ directory")
     parser.addoption("--host", type=str, default="localhost", help="When using surrender_client_pytest class or s fixture, choose host to connect to")
     parser.addoption("--port", type=int, default=5151, help="When using surrender_client_pytest class or s fixture, choose port to connect to")
+    parser.addoption("--servers", type=str, default=None, help="Comma separated list of host:port servers replacing --host/--port. With --shard (or pytest-xdist workers), each shard uses its own server; otherwise the first one is used")
+    parser.addoption("--shard", type=str, default=None, help="Only run shard i/n of the tests (0 <= i < n), shards being balanced by historical runtime")
+    parser.addoption("--ref-store", type=str, default=".reference_store", help="With --gen-ref, directory of rendered images keyed by command trace and server version: references whose inputs did not change are not rendered again (empty to disable)")
+    parser.addoption("--progressive", type=str, default=None, help="Comma separated sample counts (e.g. 16,64,256): renders are first done at these counts and compared with the reference store, stopping as soon as the result is statistically within tolerance or clearly failing")
+    parser.addoption("--durations-file", type=str, default=".nonreg_durations.json", help="File where test runtimes are recorded and read back to balance shards")
+
+
+#-----------------------------------------------------------------------
+# Sharding across servers
+#-----------------------------------------------------------------------
+def parse_servers(servers):
+    """Return a list of (host, port) from a 'host:port,host:port' string."""
+    endpoints = []
+    for server in servers.split(','):
+        host, _, port = server.strip().rpartition(':')
+        endpoints.append((host or 'localhost', int(port)))
+    return endpoints
+
+
+def parse_shard(shard):
+    index, count = (int(v) for v in shard.split('/'))
+    if not 0 <= index < count:
+        raise pytest.UsageError("--shard must be i/n with 0 <= i < n, got %s" % shard)
+    return index, count
+
+
+def load_durations(path):
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def balance_shards(nodeids, durations, count):
+    """Assign <nodeids> to <count> shards, longest tests first to the least loaded shard. Returns the shard of each test."""
+    default = sum(durations.values()) / len(durations) if durations else 1.0
+    loads = [0.0] * count
+    shard_of = {}
+    for nodeid in sorted(nodeids, key=lambda n: (-durations.get(n, default), n)):
+        shard = loads.index(min(loads))
+        loads[shard] += durations.get(nodeid, default)
+        shard_of[nodeid] = shard
+    return shard_of
+
+
+def _worker_index(config):
+    if config.getoption("shard"):
+        return parse_shard(config.getoption("shard"))[0]
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "")
+    if worker.startswith("gw"):
+        return int(worker[2:])
+    return None
+
+
+def pytest_configure(config):
+    # Each shard (or xdist worker) talks to its own server of the pool
+    servers = config.getoption("servers")
+    index = _worker_index(config)
+    if servers:
+        endpoints = parse_servers(servers)
+        if index is not None:
+            config.option.host, config.option.port = endpoints[index % len(endpoints)]
+        else:
+            config.option.host, config.option.port = endpoints[0]
+            # The pytest-xdist controller runs no test: its workers get their own server
+            if len(endpoints) > 1 and not getattr(config.option, "numprocesses", None):
+                config.issue_config_time_warning(pytest.PytestConfigWarning(
+                    "--servers lists %d servers but neither --shard nor pytest-xdist is used: every test runs on %s:%d"
+                    % (len(endpoints), endpoints[0][0], endpoints[0][1])), stacklevel=2)
+
+    # Client call profiling (see surrender_profiler)
+    from surrender_profiler import Profile, environment_prefix, installed
+    prefix = environment_prefix()
+    if installed() is not None:
+        # Every client is already profiled by the startup hook
+        config._surrender_profile = installed()
+        config._surrender_profile_hooked = True
+    elif prefix:
+        if index is not None:
+            prefix += "_%d" % index
+        config._surrender_profile = Profile()
+        config._surrender_profile.export_at_exit(prefix)
+
+
+def pytest_collection_modifyitems(config, items):
+    shard = config.getoption("shard")
+    if not shard:
+        return
+    index, count = parse_shard(shard)
+    shard_of = balance_shards([item.nodeid for item in items], load_durations(config.getoption("durations_file")), count)
+    deselected = [item for item in items if shard_of[item.nodeid] != index]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = [item for item in items if shard_of[item.nodeid] == index]
+
+
+# Runtimes measured in this session, by test node id
+_measured_durations = {}
+
+
+def pytest_runtest_logreport(report):
+    if report.when == "call" and not report.skipped:
+        _measured_durations[report.nodeid] = report.duration
+
+
+def pytest_sessionfinish(session):
+    # Merge the measured runtimes in the durations file (shards running concurrently update it in turn)
+    if not _measured_durations or hasattr(session.config, "workerinput"):
+        return
+    path = session.config.getoption("durations_file")
+    lock = open(path + ".lock", "w")
+    try:
+        try:
+            import fcntl
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        durations = load_durations(path)
+        durations.update(_measured_durations)
+        with open(path + ".tmp", "w") as f:
+            json.dump(durations, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    finally:
+        lock.close()
+
+
+#-----------------------------------------------------------------------
+# Client wrappers (profiling, reference generation cache)
+#-----------------------------------------------------------------------
+# Samples per pixel of the references rendered with --gen-ref
+GEN_REF_SPP = 1024
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_call(item):
+    config = item.config
+    funcargs = getattr(item, "funcargs", {})
+    if funcargs.get("s") is None:
+        return
+    profile = getattr(config, "_surrender_profile", None)
+    if profile is not None:
+        from surrender_profiler import ProfilingClient
+        profile.mark(item.nodeid)
+        if not getattr(config, "_surrender_profile_hooked", False):
+            funcargs["s"] = ProfilingClient(funcargs["s"], profile)
+    if not config.getoption("ref_store"):
+        return
+    if config.getoption("gen_ref"):
+        # Renders whose command trace is already in the reference store are not performed again
+        from reference_store import ReferenceStore, CachingClient
+        funcargs["s"] = CachingClient(funcargs["s"], ReferenceStore(config.getoption("ref_store")), item.nodeid, GEN_REF_SPP)
+    elif config.getoption("progressive"):
+        # Renders stop at the first sample count giving a conclusive comparison with the reference store
+        from reference_store import ReferenceStore
+        from progressive_render import ProgressiveClient, skip_histogram_checks
+        stages = [int(n) for n in config.getoption("progressive").split(",")]
+        log = []
+        item.user_properties.append(("progressive", log))
+        funcargs["s"] = ProgressiveClient(funcargs["s"], ReferenceStore(config.getoption("ref_store")), stages, item.nodeid, log)
+        item.user_properties.append(("progressive_skipped_checks", funcargs["s"].skipped_checks))
+        item._restore_histogram_checks = skip_histogram_checks(funcargs["s"])
+
+
+def pytest_runtest_teardown(item):
+    restore = getattr(item, "_restore_histogram_checks", None)
+    if restore is not None:
+        restore()
@@ -0,0 +1,103 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : exposure bracketing from a single irradiance render
+
+ The scene is rendered once in irradiance mode (enableIrradianceMode(True),
+ image independent of the integration time), then the whole stack of
+ integration times x gains is synthesized with sensor_model.SensorModel in one
+ vectorized pass and written to a frame store: a directory holding the stack
+ as a memory-mapped .npy array (gains, times, H, W) and its metadata as JSON.
+ Usage:
+   python exposure_bracketing.py irradiance.npy --times 0.01,0.05,0.2,1 [--gains 1,2] [--store exposures]
+                                 [--responsivity 1e12] [--read-noise 5] [--bits 12]
+ (irradiance.npy: e.g. np.save of getImageGray32F in irradiance mode, see render_irradiance())
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from sensor_model import SensorModel
+
+
+class FrameStore:
+    """Directory <root> holding a stack of frames (frames.npy) and their metadata (frames.json)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def write(self, frames, metadata):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, 'frames.npy')
+        stack = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=frames.dtype, shape=frames.shape)
+        stack[...] = frames
+        stack.flush()
+        del stack
+        os.replace(path + '.tmp', path)
+        with open(os.path.join(self.root, 'frames.json'), 'w') as f:
+            json.dump(metadata, f, indent=1)
+
+    def read(self):
+        """Return (frames memory-mapped read-only, metadata)."""
+        with open(os.path.join(self.root, 'frames.json'), 'r') as f:
+            metadata = json.load(f)
+        return np.load(os.path.join(self.root, 'frames.npy'), mmap_mode='r'), metadata
+
+
+def render_irradiance(s, getter='getImageGray32F'):
+    """Render the current scene of client <s> in irradiance mode and return the image of <getter>."""
+    s.enableIrradianceMode(True)
+    s.render()
+    return np.asarray(getattr(s, getter)(), dtype=np.float32)
+
+
+def bracket(irradiance, sensor, integration_times, gains=(1.0,), store=None, rng=None):
+    """
+    Return the exposures (len(gains), len(integration_times), H, W) of <irradiance> through <sensor>,
+    written to FrameStore <store> when given.
+    """
+    integration_times = np.asarray(integration_times, dtype=np.float64)
+    gains = np.asarray(gains, dtype=np.float64)
+    frames = sensor.simulate(irradiance, integration_times, gains, rng=rng)
+    if store is not None:
+        # Pixels clipped by the full well or by the ADC
+        level = sensor.saturation_level(gains).reshape(gains.shape + (1,) * (frames.ndim - gains.ndim))
+        saturated = (frames >= level).mean(axis=(-2, -1))
+        store.write(frames, {
+            'axes': ['gain', 'integration_time', 'y', 'x'],
+            'gains': gains.tolist(),
+            'integration_times': integration_times.tolist(),
+            'saturated_fraction': saturated.tolist(),
+            'sensor': {k: v for k, v in vars(sensor).items() if not k.startswith('_')},
+        })
+    return frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('irradiance', help='Irradiance image (.npy)')
+    parser.add_argument('--times', required=True, help='Comma separated integration times (s)')
+    parser.add_argument('--gains', default='1', help='Comma separated ADC gains (DN/e-)')
+    parser.add_argument('--store', default='exposures', help='Frame store directory')
+    parser.add_argument('--responsivity', type=float, default=1.0, help='Electrons per second per irradiance unit')
+    parser.add_argument('--dark-current', type=float, default=0.0)
+    parser.add_argument('--read-noise', type=float, default=0.0)
+    parser.add_argument('--full-well', type=float, default=None)
+    parser.add_argument('--bits', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    irradiance = np.load(args.irradiance)
+    sensor = SensorModel(responsivity=args.responsivity, dark_current=args.dark_current, read_noise=args.read_noise,
+                         full_well=args.full_well, bits=args.bits, seed=args.seed)
+    times = [float(t) for t in args.times.split(',')]
+    gains = [float(g) for g in args.gains.split(',')]
+    frames = bracket(irradiance, sensor, times, gains, FrameStore(args.store), np.random.default_rng(args.seed))
+    print('%d exposures of %dx%d written to %s' % (len(times) * len(gains), frames.shape[-1], frames.shape[-2], args.store))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Field-varying PSF applied by tiled overlap-add convolution
+
+ setPSF applies one kernel to the whole image. FieldPSF holds a rows x cols
+ grid of kernels, kernel (i,j) being exact at the center of cell (i,j) of the
+ image, and bilinearly blended in between (clamped beyond the outer centers).
+ The image is split in tiles; each tile is convolved (psf_convolution) with
+ the kernels whose blending weight is not zero on it, and the full convolution
+ results of the tiles are added together (overlap-add). Tiles are processed
+ by worker processes, for one image or a whole trajectory of frames.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import psf_library
+from psf_convolution import fft_shape, otf
+
+
+def axis_weights(n, nodes, start, stop):
+    """Bilinear weights (nodes, stop-start) of pixels start..stop-1 of an axis of <n> pixels with <nodes> kernel centers."""
+    u = np.clip((np.arange(start, stop) + 0.5) / n * nodes - 0.5, 0, nodes - 1)
+    i0 = np.minimum(np.floor(u).astype(int), max(nodes - 2, 0))
+    f = u - i0
+    w = np.zeros((nodes, stop - start))
+    w[i0, np.arange(stop - start)] = 1 - f
+    if nodes > 1:
+        w[i0 + 1, np.arange(stop - start)] += f
+    return w
+
+
+class FieldPSF:
+    """Grid <kernels> (list of rows of 2D kernels of the same shape) applied by tiles of <tile> x <tile> pixels."""
+
+    def __init__(self, kernels, tile=256):
+        self.kernels = [[np.asarray(k, dtype=np.float64) for k in row] for row in kernels]
+        self.rows = len(self.kernels)
+        self.cols = len(self.kernels[0])
+        self.kernel_shape = self.kernels[0][0].shape
+        if any(k.shape != self.kernel_shape for row in self.kernels for k in row):
+            raise ValueError("All the kernels of a field PSF must have the same shape")
+        self.tile = tile
+
+    @classmethod
+    def from_files(cls, paths, tile=256):
+        """Grid of measured kernels (e.g. PSF.txt files), <paths> being a list of rows of file names."""
+        return cls([[psf_library.measured(path) for path in row] for row in paths], tile)
+
+    def convolve_tile(self, image, y0, x0, shape):
+        """Full convolution (tile + kernel - 1 pixels per side) of tile <image> at (<y0>, <x0>) of an image of <shape>."""
+        th, tw = image.shape
+        kh, kw = self.kernel_shape
+        wy = axis_weights(shape[0], self.rows, y0, y0 + th)
+        wx = axis_weights(shape[1], self.cols, x0, x0 + tw)
+        fshape = fft_shape(image.shape, self.kernel_shape)
+        spectrum = 0
+        for i in np.nonzero(wy.any(axis=1))[0]:
+            for j in np.nonzero(wx.any(axis=1))[0]:
+                spectrum = spectrum + np.fft.rfft2(image * np.outer(wy[i], wx[j]), fshape) * otf(self.kernels[i][j], fshape)
+        # Kernels are centered on sample 0: outputs before the tile are wrapped at the end
+        full = np.roll(np.fft.irfft2(spectrum, fshape), (kh // 2, kw // 2), axis=(0, 1))
+        return full[:th + kh - 1, :tw + kw - 1]
+
+    def tiles(self, shape):
+        for y0 in range(0, shape[0], self.tile):
+            for x0 in range(0, shape[1], self.tile):
+                yield y0, x0
+
+    def convolve(self, image, workers=None):
+        """Convolve 2D <image> (use one call per channel for RGBA images)."""
+        return next(iter(self.convolve_frames([image], workers)))
+
+    def convolve_frames(self, frames, workers=None):
+        """Yield the convolution of each of 2D <frames>, their tiles being processed by <workers> processes (0: in this process)."""
+        if workers == 0:
+            for frame in frames:
+                frame = np.asarray(frame)
+                yield self._assemble(frame, ((y0, x0, self.convolve_tile(frame[y0:y0 + self.tile, x0:x0 + self.tile], y0, x0, frame.shape))
+                                             for y0, x0 in self.tiles(frame.shape)))
+            return
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(self,)) as pool:
+            for frame in frames:
+                frame = np.asarray(frame)
+                tasks = [(frame[y0:y0 + self.tile, x0:x0 + self.tile], y0, x0, frame.shape) for y0, x0 in self.tiles(frame.shape)]
+                yield self._assemble(frame, pool.map(_convolve_tile, tasks))
+
+    def _assemble(self, frame, blocks):
+        kh, kw = self.kernel_shape
+        h, w = frame.shape
+        out = np.zeros((h + kh - 1, w + kw - 1))
+        for y0, x0, block in blocks:
+            out[y0:y0 + block.shape[0], x0:x0 + block.shape[1]] += block
+        out = out[kh // 2:kh // 2 + h, kw // 2:kw // 2 + w]
+        return out.astype(frame.dtype if np.issubdtype(frame.dtype, np.floating) else np.float32)
+
+
+#-----------------------------------------------------------------------
+# Worker processes
+#-----------------------------------------------------------------------
+_field = None
+
+
+def _init_worker(field):
+    global _field
+    _field = field
+
+
+def _convolve_tile(task):
+    image, y0, x0, shape = task
+    return y0, x0, _field.convolve_tile(image, y0, x0, shape)
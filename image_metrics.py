@@ -0,0 +1,155 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Vectorized image comparison metrics for the regression checks
+
+ compare_images() evaluates in one pass over the error image:
+ - error histogram (absolute error, normalized by the reference dynamic)
+ - L2 (RMS) and maximum error
+ - per-tile maximum error
+ - SSIM (box window, luminance of RGB(A) images)
+ - star centroid shifts (local maxima of the reference)
+ With <early_exit>, the maximum error is first taken over tiles (block maxima,
+ every pixel counted) and the histogram, SSIM and star evaluation are skipped
+ when it is below that threshold.
+ Run this module to benchmark it on 1024x1024 float and RGBA8 images.
+"""
+import time
+import numpy as np
+
+# Default histogram bin edges of the normalized absolute error
+HIST_EDGES = np.concatenate([[0], np.logspace(-6, 0, 25)])
+
+
+def as_float(image, scale=None):
+    """Return <image> as float32 (alpha channel dropped), and the normalization scale used."""
+    image = np.asarray(image)
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = image[..., :3]
+    if scale is None:
+        scale = float(np.iinfo(image.dtype).max) if np.issubdtype(image.dtype, np.integer) else None
+    return image.astype(np.float32, copy=False), scale
+
+
+def luminance(image):
+    return image.mean(axis=2) if image.ndim == 3 else image
+
+
+def box_mean(image, w):
+    """Mean over w x w windows (valid part only) using an integral image."""
+    c = np.pad(image.astype(np.float64), ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (c[w:, w:] - c[:-w, w:] - c[w:, :-w] + c[:-w, :-w]) / (w * w)
+
+
+def ssim(a, b, window=7, c1=0.01 ** 2, c2=0.03 ** 2):
+    """Mean structural similarity of images <a> and <b> normalized to [0,1]."""
+    mu_a, mu_b = box_mean(a, window), box_mean(b, window)
+    var_a = box_mean(a * a, window) - mu_a * mu_a
+    var_b = box_mean(b * b, window) - mu_b * mu_b
+    cov = box_mean(a * b, window) - mu_a * mu_b
+    s = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2))
+    return float(s.mean())
+
+
+def tile_max(err, tile):
+    """Maximum of <err> (H,W) over tile x tile blocks (partial border tiles included)."""
+    h, w = err.shape
+    ph, pw = -h % tile, -w % tile
+    padded = np.pad(err, ((0, ph), (0, pw)))
+    return padded.reshape((h + ph) // tile, tile, (w + pw) // tile, tile).max(axis=(1, 3))
+
+
+def find_stars(image, threshold, radius=2, max_stars=500):
+    """Return the (y,x) integer positions of the local maxima of <image> above <threshold>."""
+    core = image[radius:-radius, radius:-radius]
+    is_max = core > threshold
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dy or dx:
+                is_max &= core >= image[radius + dy:image.shape[0] - radius + dy, radius + dx:image.shape[1] - radius + dx]
+    y, x = np.nonzero(is_max)
+    order = np.argsort(core[y, x])[::-1][:max_stars]
+    return np.stack([y[order] + radius, x[order] + radius], axis=1)
+
+
+def centroids(image, positions, radius=2):
+    """Intensity centroids (N,2) of <image> in windows centered at integer <positions>."""
+    offsets = np.arange(-radius, radius + 1)
+    yy = positions[:, 0, None, None] + offsets[None, :, None]
+    xx = positions[:, 1, None, None] + offsets[None, None, :]
+    w = np.maximum(image[yy, xx], 0)
+    total = np.maximum(w.sum(axis=(1, 2)), 1e-30)
+    return np.stack([(w * yy).sum(axis=(1, 2)) / total, (w * xx).sum(axis=(1, 2)) / total], axis=1)
+
+
+def compare_images(image, reference, scale=None, hist_edges=HIST_EDGES, tile=64, with_ssim=True,
+                   star_threshold=None, early_exit=None):
+    """
+    Compare <image> with <reference> and return a dictionary of metrics.
+    Errors are divided by <scale> (default: maximum integer value, or the reference maximum for floats).
+    <star_threshold> (normalized) enables star centroid shifts; <early_exit> is a maximum error below which
+    only 'l2', 'max' and 'tile_max' are returned (with 'early_exit': True).
+    """
+    a, scale_a = as_float(image, scale)
+    b, _ = as_float(reference, scale)
+    if a.shape != b.shape:
+        raise ValueError("Image shape %s differs from reference shape %s" % (a.shape, b.shape))
+    if scale_a is None:
+        scale_a = float(np.abs(b).max()) or 1.0
+
+    err = np.abs(a - b)
+    err /= scale_a
+    err2d = err.max(axis=2) if err.ndim == 3 else err
+    tiles = tile_max(err2d, tile)
+    l2 = float(np.sqrt(np.mean(err * err)))
+
+    # The tile maxima bound every pixel: no isolated error (e.g. a missing star) can be skipped
+    if early_exit is not None and tiles.max() < early_exit:
+        return {'early_exit': True, 'l2': l2, 'max': float(tiles.max()), 'tile_max': tiles}
+
+    bins = np.clip(np.searchsorted(hist_edges, err.ravel(), side='right') - 1, 0, len(hist_edges) - 2)
+    result = {
+        'early_exit': False,
+        'hist': np.bincount(bins, minlength=len(hist_edges) - 1),
+        'hist_edges': hist_edges,
+        'l2': l2,
+        'max': float(tiles.max()),
+        'tile_max': tiles,
+    }
+    if with_ssim:
+        result['ssim'] = ssim(luminance(a) / scale_a, luminance(b) / scale_a)
+    if star_threshold is not None:
+        lb = luminance(b) / scale_a
+        stars = find_stars(lb, star_threshold)
+        if len(stars):
+            shift = np.linalg.norm(centroids(luminance(a) / scale_a, stars) - centroids(lb, stars), axis=1)
+            result['star_shift_mean'] = float(shift.mean())
+            result['star_shift_max'] = float(shift.max())
+        result['stars'] = len(stars)
+    return result
+
+
+def benchmark(size=1024, repeat=5, seed=0):
+    """Print the time of compare_images on <size>x<size> float32 gray and RGBA8 images."""
+    rng = np.random.default_rng(seed)
+    ref32 = rng.random((size, size), dtype=np.float32)
+    img32 = ref32 + rng.normal(0, 1e-3, ref32.shape).astype(np.float32)
+    ref8 = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    img8 = np.clip(ref8.astype(np.int16) + rng.integers(-1, 2, ref8.shape), 0, 255).astype(np.uint8)
+    cases = [
+        ('float32 full', img32, ref32, {}),
+        ('float32 stars', img32, ref32, {'star_threshold': 0.999}),
+        ('float32 early exit', img32, ref32, {'early_exit': 1e-2}),
+        ('RGBA8 full', img8, ref8, {}),
+        ('RGBA8 early exit', img8, ref8, {'early_exit': 1e-1}),
+    ]
+    for name, image, reference, kwargs in cases:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            compare_images(image, reference, **kwargs)
+        print("%-20s %8.2f ms" % (name, (time.perf_counter() - t0) / repeat * 1000))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,191 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : levels of detail of OBJ meshes (vertex clustering decimation)
+
+ A chain of levels is built from a triangle mesh: level k clusters the vertices
+ on a grid of cell 2^k times the mean edge length of the mesh (vertices of a
+ cell are merged to their mean, degenerate and duplicate triangles are
+ removed). The levels are written as <stem>_lod<k>.obj next to a manifest
+ <stem>_lod.json giving their mean edge length. select_level() returns the
+ coarsest level whose edges project to at most one pixel for a given range,
+ field of view and image size (level 0 is the original mesh); LODMesh applies
+ it to an object of the scene at every frame.
+ Only the geometry is decimated: the levels are written without normals (vn)
+ and texture coordinates (vt), so meshes having them are refused unless
+ --drop-attributes is given (the server then shades the levels with the
+ normals of their faces).
+ The levels must be copied to the resource directory of the server.
+ Usage:
+   python mesh_lod.py itokawa_f3145728.obj [--levels 6] [--min-faces 2000] [--output-dir .] [--drop-attributes]
+   python mesh_lod.py itokawa_f3145728_lod.json --select 10000 --fov 5 --width 768 --scale 1e3
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import numpy as np
+
+
+def read_obj(path, drop_attributes=False):
+    """
+    Return (vertices (N, 3) float64, triangles (M, 3) int64, 0-based) of OBJ file <path>; polygons are fanned.
+    Raises ValueError if the mesh has normals or texture coordinates, unless <drop_attributes> is set.
+    """
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+    attributes = sorted(set(l.split()[0] for l in lines if l.startswith(('vn ', 'vt '))))
+    if attributes and not drop_attributes:
+        raise ValueError("%s has %s attributes, which the levels would not keep (use drop_attributes)" % (path, '/'.join(attributes)))
+    vertex_lines = [l[2:] for l in lines if l.startswith('v ')]
+    vertices = np.array(' '.join(vertex_lines).split(), dtype=np.float64).reshape(len(vertex_lines), -1)[:, :3]
+    face_lines = [re.sub(r'/\S*', '', l[2:]).split() for l in lines if l.startswith('f ')]
+    triangles = []
+    for count in sorted(set(len(f) for f in face_lines)):
+        polygons = np.array([f for f in face_lines if len(f) == count], dtype=np.int64)
+        polygons = np.where(polygons < 0, polygons + len(vertices), polygons - 1)
+        for k in range(1, count - 1):
+            triangles.append(polygons[:, [0, k, k + 1]])
+    triangles = np.concatenate(triangles) if triangles else np.zeros((0, 3), np.int64)
+    return vertices, triangles
+
+
+def write_obj(path, vertices, triangles):
+    with open(path + '.tmp', 'w') as f:
+        f.write('# %d vertices, %d faces\n' % (len(vertices), len(triangles)))
+        np.savetxt(f, vertices, fmt='v %.9g %.9g %.9g')
+        np.savetxt(f, triangles + 1, fmt='f %d %d %d')
+    os.replace(path + '.tmp', path)
+
+
+def mean_edge_length(vertices, triangles):
+    edges = vertices[triangles] - vertices[np.roll(triangles, 1, axis=1)]
+    return float(np.sqrt((edges ** 2).sum(axis=-1)).mean()) if len(triangles) else 0.0
+
+
+def decimate(vertices, triangles, cell):
+    """Cluster <vertices> on a grid of size <cell>. Returns (vertices, triangles) of the simplified mesh."""
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = cells[:, 0] + dims[0] * (cells[:, 1] + dims[1] * cells[:, 2])
+    _, cluster, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    cluster = cluster.ravel()
+    merged = np.stack([np.bincount(cluster, vertices[:, i]) for i in range(3)], axis=1) / counts[:, None]
+
+    triangles = cluster[triangles]
+    keep = (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 2] != triangles[:, 0])
+    triangles = triangles[keep]
+    _, first = np.unique(np.sort(triangles, axis=1), axis=0, return_index=True)
+    triangles = triangles[np.sort(first)]
+
+    # Drop the vertices no longer referenced
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return merged[used], triangles.reshape(-1, 3)
+
+
+def build_levels(path, levels=6, min_faces=2000, output_dir=None, drop_attributes=False):
+    """Write the levels of OBJ file <path> and their manifest; returns the manifest path."""
+    output_dir = output_dir or os.path.dirname(path) or '.'
+    stem = os.path.splitext(os.path.basename(path))[0]
+    vertices, triangles = read_obj(path, drop_attributes)
+    edge = mean_edge_length(vertices, triangles)
+    entries = [{'file': os.path.basename(path), 'vertices': len(vertices), 'faces': len(triangles), 'edge': edge}]
+    for level in range(1, levels):
+        v, t = decimate(vertices, triangles, edge * 2 ** level)
+        if len(t) < min_faces:
+            break
+        name = '%s_lod%d.obj' % (stem, level)
+        write_obj(os.path.join(output_dir, name), v, t)
+        entries.append({'file': name, 'vertices': len(v), 'faces': len(t), 'edge': mean_edge_length(v, t)})
+    manifest = os.path.join(output_dir, stem + '_lod.json')
+    with open(manifest, 'w') as f:
+        json.dump({'source': os.path.basename(path), 'levels': entries}, f, indent=1)
+    return manifest
+
+
+def load_levels(manifest):
+    with open(manifest, 'r') as f:
+        return json.load(f)['levels']
+
+
+def pixel_footprint(distance, fov, width):
+    """Size of a pixel at <distance> for a field of view <fov> (degrees) over <width> pixels."""
+    return distance * 2 * np.tan(np.radians(fov) / 2) / width
+
+
+def select_level(levels, distance, fov, width, scale=1.0, pixels=1.0):
+    """
+    Coarsest of <levels> (manifest entries, finest first) whose mean edge, times the createMesh <scale>,
+    spans at most <pixels> pixels at <distance> (same unit as the scaled mesh).
+    """
+    footprint = pixels * pixel_footprint(distance, fov, width)
+    chosen = levels[0]
+    for level in levels[1:]:
+        if level['edge'] * scale <= footprint:
+            chosen = level
+    return chosen
+
+
+class LODMesh:
+    """
+    Mesh object <name> of client <s> rendered at the level of <levels> (manifest entries) suited to each frame.
+    update(distance) selects the level for the range of the frame and, when it changes, creates the mesh
+    again with createMesh <scale> and binds <brdf> to its <element>; the pose of the object must then be set.
+    """
+
+    def __init__(self, s, name, levels, fov, width, scale=1.0, brdf=None, element=None, pixels=1.0):
+        self.s = s
+        self.name = name
+        self.levels = levels
+        self.fov = fov
+        self.width = width
+        self.scale = scale
+        self.brdf = brdf
+        self.element = element or name
+        self.pixels = pixels
+        self.file = None
+
+    def update(self, distance):
+        """Select the level for <distance>; returns True if the mesh was created again."""
+        level = select_level(self.levels, distance, self.fov, self.width, self.scale, self.pixels)
+        if level['file'] == self.file:
+            return False
+        self.s.createMesh(self.name, level['file'], self.scale)
+        if self.brdf:
+            self.s.setObjectElementBRDF(self.name, self.element, self.brdf)
+        self.file = level['file']
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='OBJ mesh, or LOD manifest with --select')
+    parser.add_argument('--levels', type=int, default=6, help='Maximum number of levels (original included)')
+    parser.add_argument('--min-faces', type=int, default=2000, help='Coarsest level face count lower bound')
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--drop-attributes', action='store_true', help='Decimate meshes having normals or texture coordinates (not kept)')
+    parser.add_argument('--select', type=float, default=None, metavar='DISTANCE', help='Print the level to use at DISTANCE')
+    parser.add_argument('--fov', type=float, default=5.0, help='Field of view (degrees)')
+    parser.add_argument('--width', type=int, default=1024, help='Pixels across the field of view')
+    parser.add_argument('--scale', type=float, default=1.0, help='Scale given to createMesh')
+    args = parser.parse_args(argv)
+
+    if args.select is not None:
+        level = select_level(load_levels(args.path), args.select, args.fov, args.width, args.scale)
+        print(level['file'])
+        return 0
+    try:
+        manifest = build_levels(args.path, args.levels, args.min_faces, args.output_dir, args.drop_attributes)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for level in load_levels(manifest):
+        print('%-36s %10d faces %10d vertices  edge %g' % (level['file'], level['faces'], level['vertices'], level['edge']))
+    print('Manifest written to %s' % manifest)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
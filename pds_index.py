@@ -0,0 +1,115 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Index of PDS3 image labels
+
+ Labels are parsed in parallel into a compact table (file, start time,
+ exposure, filter, target) persisted as a .npy structured array. Updating the
+ index only parses new or modified labels, so selecting and ordering
+ thousands of frames is a query on the table rather than a directory crawl.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Label keywords stored in the index
+LABEL_KEYS = {
+    'start_time': 'START_TIME',
+    'exposure': 'EXPOSURE_DURATION',
+    'filter': 'FILTER_NAME',
+    'target': 'TARGET_NAME',
+}
+
+INDEX_DTYPE = np.dtype([
+    ('file', 'U128'),
+    ('mtime', 'f8'),
+    ('start_time', 'U32'),
+    ('exposure', 'f8'),
+    ('filter', 'U16'),
+    ('target', 'U32'),
+])
+
+
+def parse_label(file, keys=tuple(LABEL_KEYS.values())):
+    """
+    Return a dictionary of the first value of each keyword of <keys> in the PDS3 label <file>.
+    Quotes and units (e.g. <SECOND>) are stripped from the values.
+    """
+    values = {}
+    with open(file, 'r', errors='replace') as f:
+        for line in f:
+            if line.strip() == 'END':
+                break
+            key, sep, value = line.partition('=')
+            key = key.strip()
+            if sep and key in keys and key not in values:
+                values[key] = value.split('<')[0].strip().strip('"').strip()
+                if len(values) == len(keys):
+                    break
+    return values
+
+
+def _label_row(path):
+    values = parse_label(path)
+    if LABEL_KEYS['start_time'] not in values:
+        # Frames are ordered and selected on START_TIME: an empty one would silently sort first
+        raise ValueError("%s: no %s in the label" % (path, LABEL_KEYS['start_time']))
+    try:
+        exposure = float(values.get(LABEL_KEYS['exposure'], 'nan'))
+    except ValueError:
+        exposure = np.nan
+    return (os.path.basename(path), os.path.getmtime(path), values[LABEL_KEYS['start_time']], exposure,
+            values.get(LABEL_KEYS['filter'], ''), values.get(LABEL_KEYS['target'], ''))
+
+
+class LabelIndex:
+    """Persistent table of the PDS3 labels of a directory."""
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        if os.path.isfile(index_file):
+            self.table = np.load(index_file)
+        else:
+            self.table = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.table)
+
+    def update(self, directory, extension='.lbl', workers=8):
+        """
+        Synchronize the index with the labels of <directory>: new and modified labels are parsed (in parallel),
+        deleted ones are dropped. Returns the number of parsed labels.
+        Raises ValueError, leaving the index unchanged, if a label has no START_TIME.
+        """
+        current = {f: os.path.getmtime(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(extension)}
+        known = dict(zip(self.table['file'], self.table['mtime']))
+        keep = np.array([f in current and current[f] == m for f, m in known.items()], dtype=bool)
+        todo = sorted(f for f in current if known.get(f) != current[f])
+        if not todo and keep.all():
+            return 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_label_row, [os.path.join(directory, f) for f in todo]))
+        table = np.concatenate([self.table[keep], np.array(rows, dtype=INDEX_DTYPE)])
+        self.table = table[np.argsort(table['start_time'], kind='stable')]
+        np.save(self.index_file, self.table)
+        return len(todo)
+
+    def select(self, match=None, filter=None, target=None, start=None, stop=None):
+        """
+        Return the rows whose file name contains <match>, with the given <filter> and <target> names
+        and a START_TIME in [<start>, <stop>] (ISO strings), ordered by START_TIME.
+        """
+        mask = np.ones(len(self.table), dtype=bool)
+        if match is not None:
+            mask &= np.char.find(self.table['file'], match) >= 0
+        if filter is not None:
+            mask &= self.table['filter'] == filter
+        if target is not None:
+            mask &= self.table['target'] == target
+        if start is not None:
+            mask &= self.table['start_time'] >= start
+        if stop is not None:
+            mask &= self.table['start_time'] <= stop
+        return self.table[mask]
@@ -0,0 +1,147 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Pose interpolation for high-rate trajectories
+
+ Turns sparse pose samples (e.g. SPICE ephemeris at image epochs) into dense
+ pose streams: cubic Hermite interpolation for positions (with velocities,
+ or finite-difference tangents) and SLERP/SQUAD for attitudes. Everything is
+ evaluated in bulk with NumPy. Quaternions are scalar first (w,x,y,z).
+"""
+import numpy as np
+
+
+def frame_times(t_start, t_stop, frame_rate):
+    """Return the sample times from <t_start> to <t_stop> (included when on the grid) at <frame_rate> frames per time unit."""
+    n = int(np.floor((t_stop - t_start) * frame_rate + 1e-9)) + 1
+    return t_start + np.arange(n) / frame_rate
+
+
+def _segments(t, t_out):
+    """Return the segment index of each <t_out> in the sorted knots <t> and the normalized abscissa in it."""
+    t = np.asarray(t, dtype=np.float64)
+    t_out = np.asarray(t_out, dtype=np.float64)
+    if len(t) < 2 or np.any(np.diff(t) <= 0):
+        raise ValueError("At least two strictly increasing sample times are required")
+    i = np.clip(np.searchsorted(t, t_out, side='right') - 1, 0, len(t) - 2)
+    h = t[i + 1] - t[i]
+    return i, (t_out - t[i]) / h, h
+
+
+#-----------------------------------------------------------------------
+# Positions
+#-----------------------------------------------------------------------
+def finite_difference_velocity(t, p):
+    """Return tangents (N,D) of samples <p> (N,D) at times <t> by finite differences."""
+    return np.gradient(np.asarray(p, dtype=np.float64), np.asarray(t, dtype=np.float64), axis=0)
+
+
+def hermite(t, p, v, t_out):
+    """Cubic Hermite interpolation of positions <p> (N,D) with velocities <v> (N,D) at times <t_out>."""
+    p = np.asarray(p, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    i, u, h = _segments(t, t_out)
+    u = u[:, None]
+    h = h[:, None]
+    u2 = u * u
+    u3 = u2 * u
+    return (2 * u3 - 3 * u2 + 1) * p[i] + (u3 - 2 * u2 + u) * h * v[i] \
+        + (-2 * u3 + 3 * u2) * p[i + 1] + (u3 - u2) * h * v[i + 1]
+
+
+#-----------------------------------------------------------------------
+# Attitudes
+#-----------------------------------------------------------------------
+def qmul(a, b):
+    """Hamilton product of quaternion arrays (...,4)."""
+    aw, ax, ay, az = np.moveaxis(a, -1, 0)
+    bw, bx, by, bz = np.moveaxis(b, -1, 0)
+    return np.stack([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw], axis=-1)
+
+
+def qconj(q):
+    return q * np.array([1., -1., -1., -1.])
+
+
+def qlog(q):
+    """Logarithm of unit quaternions (...,4), returned as pure quaternions."""
+    v = q[..., 1:]
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    angle = np.arctan2(n, q[..., :1])
+    scale = np.where(n > 1e-12, angle / np.maximum(n, 1e-12), 1.0)
+    return np.concatenate([np.zeros_like(n), v * scale], axis=-1)
+
+
+def qexp(q):
+    """Exponential of pure quaternions (...,4)."""
+    v = q[..., 1:]
+    n = np.linalg.norm(v, axis=-1, keepdims=True)
+    scale = np.where(n > 1e-12, np.sin(n) / np.maximum(n, 1e-12), 1.0)
+    return np.concatenate([np.cos(n), v * scale], axis=-1)
+
+
+def continuous_quaternions(q):
+    """Flip signs of <q> (N,4) so that consecutive quaternions lie in the same hemisphere."""
+    q = np.array(q, dtype=np.float64)
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    flips = np.cumsum(np.r_[False, np.einsum('ij,ij->i', q[1:], q[:-1]) < 0]) % 2
+    q[flips == 1] *= -1
+    return q
+
+
+def slerp(q0, q1, u):
+    """Spherical linear interpolation between quaternion arrays <q0> and <q1> (N,4) at fractions <u> (N,)."""
+    u = np.asarray(u, dtype=np.float64)[:, None]
+    dot = np.einsum('ij,ij->i', q0, q1)[:, None]
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1, 1))
+    sin_theta = np.sin(theta)
+    small = sin_theta < 1e-9
+    w0 = np.where(small, 1 - u, np.sin((1 - u) * theta) / np.where(small, 1, sin_theta))
+    w1 = np.where(small, u, np.sin(u * theta) / np.where(small, 1, sin_theta))
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def squad_controls(q):
+    """Return the SQUAD inner control quaternions of the continuous sequence <q> (N,4)."""
+    prev = np.concatenate([q[:1], q[:-1]])
+    nxt = np.concatenate([q[1:], q[-1:]])
+    qi = qconj(q)
+    return qmul(q, qexp(-(qlog(qmul(qi, nxt)) + qlog(qmul(qi, prev))) / 4))
+
+
+def interpolate_attitude(t, q, t_out, method='squad'):
+    """Interpolate unit quaternions <q> (N,4) sampled at <t> at times <t_out> with 'slerp' or 'squad'."""
+    q = continuous_quaternions(q)
+    i, u, _ = _segments(t, t_out)
+    if method == 'slerp':
+        return slerp(q[i], q[i + 1], u)
+    if method != 'squad':
+        raise ValueError("Unknown attitude interpolation method: %s" % method)
+    s = squad_controls(q)
+    return slerp(slerp(q[i], q[i + 1], u), slerp(s[i], s[i + 1], u), 2 * u * (1 - u))
+
+
+#-----------------------------------------------------------------------
+# Ephemeris
+#-----------------------------------------------------------------------
+def interpolate_ephemeris(ephemeris, et, attitude='squad'):
+    """
+    Interpolate an ephemeris table (see spice_ephemeris) at epochs <et>.
+    Camera positions use the sampled velocities, sun positions finite-difference tangents.
+    Returns a dictionary with 'et', 'cam_pos', 'cam_quat' and 'sun_pos'.
+    """
+    t, keep = np.unique(ephemeris['et'], return_index=True)
+    sun = ephemeris['sun_pos'][keep]
+    return {
+        'et': np.asarray(et, dtype=np.float64),
+        'cam_pos': hermite(t, ephemeris['cam_pos'][keep], ephemeris['cam_vel'][keep], et),
+        'cam_quat': interpolate_attitude(t, ephemeris['cam_quat'][keep], et, attitude),
+        'sun_pos': hermite(t, sun, finite_difference_velocity(t, sun), et),
+    }
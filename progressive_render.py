@@ -0,0 +1,205 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Progressive rendering with early-stop regression checks
+
+ Each render() of a test is first performed at increasing sample counts (e.g.
+ 16, 64, 256) and every image getter stored for it in the reference store (see
+ reference_store, filled by --gen-ref, which records the sample count n_ref of
+ the references) is compared with its reference. Using the variance map of the
+ server, the normalized error
+     z = (image - reference) / sqrt(variance / n + variance / n_ref)
+ is evaluated at each stage:
+ - every getter statistically consistent (mean z^2 and fraction of |z| > 4 small)
+   with a noise level low enough to reveal a bias of a few percent: rendering
+   stops, the getters of the test return this render, and the error histogram
+   checks of the test (check_img_error_hist, whose thresholds are calibrated for
+   full sample count images) are skipped for it (see skip_histogram_checks),
+ - a float getter clearly failing (mean z^2 or fraction of outliers large): the test fails,
+ - otherwise the next stage is rendered, and the full sample count last.
+ Integer getters (RGBA8, Gray16, ...) are compared in digital numbers, the
+ variance being scaled by the gain fitted between the image and its float
+ counterpart and the quantization noise added; they can only confirm a pass.
+ Whether the variance map holds the per-sample variance or the variance of the
+ pixel mean is checked from its evolution between two stages (see variance_map),
+ so no verdict is given at the first stage.
+"""
+import time
+import numpy as np
+from reference_store import CachingClient
+from variance_map import variance_convention, sample_variance
+
+# Getters whose results can be compared statistically (float images)
+FLOAT_GETTERS = ('getImageGray32F', 'getImage', 'getImageSpectrumProjection', 'getImageRGBA32F')
+
+# Integer getters: float getter of the same image
+INTEGER_GETTERS = {
+    'getImageGray8': 'getImageGray32F',
+    'getImageGray16': 'getImageGray32F',
+    'getImageRGBA8': 'getImageRGBA32F',
+    'getImageRGBA16': 'getImageRGBA32F',
+}
+
+
+class ProgressiveCheckFailed(AssertionError):
+    pass
+
+
+def consistency(image, reference, variance, n, n_ref, gain=1.0, quantum=0.0):
+    """
+    Return (mean z^2, fraction of |z| > 4, relative noise) of <image> rendered with <n> samples against <reference>
+    (<n_ref> samples), <variance> being the per-sample variance. Integer images are compared with the variance
+    multiplied by <gain>^2 and the quantization noise of a <quantum> step on both images.
+    The relative noise is the RMS standard deviation of the difference over the mean reference level.
+    """
+    image = np.asarray(image, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    variance = np.asarray(variance, dtype=np.float64)
+    if variance.ndim == 3 and variance.shape[:2] == image.shape[:2]:
+        variance = variance[..., :image.shape[2]] if image.ndim == 3 else variance.mean(axis=2)
+    elif variance.ndim == 2 and image.ndim == 3:
+        variance = variance[..., None]
+    sigma2 = gain * gain * (variance / n + variance / n_ref) + quantum * quantum / 6
+    # Noise-free pixels (e.g. empty sky) must match up to float precision
+    floor = (1e-6 * np.abs(reference).max()) ** 2 + 1e-30
+    z2 = (image - reference) ** 2 / (sigma2 + floor)
+    noise = np.sqrt(sigma2.mean()) / max(float(np.abs(reference).mean()), 1e-30)
+    return float(z2.mean()), float(np.mean(z2 > 16)), float(noise)
+
+
+def fit_gain(image, float_image):
+    """Gain from <float_image> to integer <image> over their unsaturated lit pixels (None without such pixels)."""
+    image = np.asarray(image, dtype=np.float64)
+    float_image = np.asarray(float_image, dtype=np.float64)
+    if image.shape != float_image.shape:
+        return None
+    mask = (image > 0) & (image < image.max())
+    f = float_image[mask]
+    if not len(f) or not np.any(f):
+        return None
+    return float((f * image[mask]).sum() / (f * f).sum())
+
+
+class ProgressiveClient(CachingClient):
+    """
+    Client proxy implementing the progressive mode. <stages> are the intermediate sample counts,
+    <log> an optional list receiving one (key, stage, n, chi2, outliers, noise, seconds) tuple per evaluated stage
+    (worst getter, NaN while the variance convention is unknown).
+    """
+    save_results = False
+
+    def __init__(self, client, store, stages=(16, 64, 256), label=None, log=None,
+                 pass_chi2=1.5, pass_outliers=1e-3, pass_noise=0.02, fail_chi2=25.0, fail_outliers=0.05):
+        CachingClient.__init__(self, client, store, label)
+        self._stages = sorted(stages)
+        self._log = log if log is not None else []
+        self._variance_mapping = False
+        self._thresholds = (pass_chi2, pass_outliers, pass_noise, fail_chi2, fail_outliers)
+        self.passed = False         # whether the last render was accepted at an intermediate stage
+        self.skipped_checks = []    # references of the histogram checks skipped (see skip_histogram_checks)
+
+    def _call(self, name, method, args, kwargs):
+        if name == 'enableVarianceMapping':
+            self._variance_mapping = bool(args[0])
+        return CachingClient._call(self, name, method, args, kwargs)
+
+    def _check(self, getters, references, variance, n, n_ref):
+        """Compare the current render with <references>. Returns (verdict, worst (chi2, outliers, noise), getter name)."""
+        pass_chi2, pass_outliers, pass_noise, fail_chi2, fail_outliers = self._thresholds
+        client = self._client
+        passed = True
+        worst = (0.0, 0.0, 0.0)
+        worst_name = None
+        for getter_key, getter in sorted(getters.items()):
+            name = getter['name']
+            image = getattr(client, name)(*getter['args'])
+            if name in FLOAT_GETTERS:
+                stats = consistency(image, references[getter_key], variance, n, n_ref)
+                if stats[0] > fail_chi2 or stats[1] > fail_outliers:
+                    return 'fail', stats, name
+            elif name in INTEGER_GETTERS:
+                gain = fit_gain(image, getattr(client, INTEGER_GETTERS[name])())
+                if gain is None:
+                    return None, worst, worst_name
+                stats = consistency(image, references[getter_key], variance, n, n_ref, gain, 1.0)
+            else:
+                # Not comparable statistically (depth, normals, variance): only the full render can be checked
+                return None, worst, worst_name
+            if stats[0] >= worst[0]:
+                worst, worst_name = stats, name
+            passed &= stats[0] < pass_chi2 and stats[1] < pass_outliers and stats[2] < pass_noise
+        return ('pass' if passed else None), worst, worst_name
+
+    def _render(self, method, args, kwargs):
+        self.passed = False
+        getters = self._store.getters(self._key)
+        n_ref = self._store.info(self._key).get('spp')
+        stages = [n for n in self._stages if self._spp is not None and n < self._spp]
+        if not getters or not stages or not n_ref:
+            method(*args, **kwargs)
+            return True
+
+        references = {getter_key: self._store.load(self._key, getter_key) for getter_key in getters}
+        client = self._client
+        verdict = None
+        previous = None
+        client.enableVarianceMapping(True)
+        try:
+            for stage, n in enumerate(stages):
+                t0 = time.perf_counter()
+                client.setNbSamplesPerPixel(n)
+                method(*args, **kwargs)
+                variance = np.asarray(client.getVarianceMap(), dtype=np.float64)
+                level = float(variance.mean())
+                convention = None if previous is None else variance_convention(previous[1], level, previous[0], n)
+                previous = (n, level)
+                if convention is None:
+                    self._log.append((self._key[:12], stage, n, np.nan, np.nan, np.nan, time.perf_counter() - t0))
+                    continue
+                variance = sample_variance(variance, convention, n)
+                verdict, (chi2, outliers, noise), name = self._check(getters, references, variance, n, n_ref)
+                self._log.append((self._key[:12], stage, n, chi2, outliers, noise, time.perf_counter() - t0))
+                if verdict is not None:
+                    break
+        finally:
+            client.setNbSamplesPerPixel(self._spp)
+            client.enableVarianceMapping(self._variance_mapping)
+
+        if verdict == 'fail':
+            raise ProgressiveCheckFailed("%s differs from the reference at %d samples per pixel: mean z^2 = %.3g, %.3g%% of pixels beyond 4 sigma"
+                                         % (name, n, chi2, 100 * outliers))
+        if verdict == 'pass':
+            # The server holds the image of the last stage, already compared with the reference
+            self.hits += 1
+            self.passed = True
+            return True
+        # Undecided: full render, checked by the test itself
+        self.misses += 1
+        method(*args, **kwargs)
+        return True
+
+
+def skip_histogram_checks(client):
+    """
+    Make surrender_test.check.check_img_error_hist skip the images of the renders of ProgressiveClient <client>
+    accepted at an intermediate stage: its thresholds are calibrated for full sample count images, which a
+    low sample count image would fail although it matches the reference statistically.
+    Returns a function restoring the original check.
+    """
+    try:
+        from surrender_test import check
+    except ImportError:
+        return lambda: None
+    original = check.check_img_error_hist
+
+    def check_img_error_hist(config, image, reference, *args, **kwargs):
+        if client.passed:
+            client.skipped_checks.append(reference)
+            return None
+        return original(config, image, reference, *args, **kwargs)
+
+    def restore():
+        check.check_img_error_hist = original
+    check.check_img_error_hist = check_img_error_hist
+    return restore
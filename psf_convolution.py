@@ -0,0 +1,146 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : FFT convolution of PSF-free renders with PSF kernels
+
+ Images rendered without PSF (or in preview mode) are convolved in Python, so
+ that one render can be evaluated with many optical designs:
+ - convolve(images, kernel)          : same kernel on a batch of images (..., H, W)
+ - convolve_many(image, kernels)     : one image, several kernels (one forward FFT)
+ - convolve_field(images, kernels, weights)
+                                     : field-dependent PSF, sum over k of kernel k applied
+                                       to the image weighted by map k (flux is preserved
+                                       when the weights sum to 1 at each pixel)
+ Convolutions are linear ('same' size, zero outside of the image). The transfer
+ functions of the kernels are cached by (kernel digest, FFT shape), so frames of
+ the same size reuse them; NumPy FFTs have no explicit plans.
+ Oversampled kernels (setPSF(psf, width, width) with psf of width*factor samples)
+ are binned to pixel resolution with pixel_kernel().
+ Usage:
+   python psf_convolution.py image.tif PSF.txt [other_psf.txt ...] [--output convolved_%s.tif]
+"""
+import os
+import sys
+import argparse
+from collections import OrderedDict
+import numpy as np
+from psf_library import kernel_digest
+
+OTF_CACHE_SIZE = 32
+_otf_cache = OrderedDict()
+
+
+def next_fast_len(n):
+    """Smallest 2^a 3^b 5^c >= <n>."""
+    best = 2 * n
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p = p35
+            while p < n:
+                p *= 2
+            best = min(best, p)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def fft_shape(image_shape, kernel_shape):
+    return tuple(next_fast_len(n + k - 1) for n, k in zip(image_shape[-2:], kernel_shape[-2:]))
+
+
+def pixel_kernel(psf, width):
+    """Bin oversampled kernel <psf> (width*factor samples per side) to <width> x <width> pixels, normalized."""
+    psf = np.asarray(psf, dtype=np.float64)
+    factor = psf.shape[0] // width
+    if factor * width != psf.shape[0] or psf.shape[0] != psf.shape[1]:
+        raise ValueError("Kernel of shape %s is not %d pixels oversampled by an integer factor" % (psf.shape, width))
+    binned = psf.reshape(width, factor, width, factor).sum(axis=(1, 3))
+    return binned / binned.sum()
+
+
+def otf(kernel, shape):
+    """Transfer function (rfft2) of <kernel> centered on its central sample, for FFTs of <shape>. Cached."""
+    key = (kernel_digest(kernel), shape)
+    cached = _otf_cache.get(key)
+    if cached is not None:
+        _otf_cache.move_to_end(key)
+        return cached
+    kernel = np.asarray(kernel, dtype=np.float64)
+    kh, kw = kernel.shape
+    padded = np.zeros(shape)
+    padded[:kh, :kw] = kernel
+    result = np.fft.rfft2(np.roll(padded, (-(kh // 2), -(kw // 2)), axis=(0, 1)))
+    _otf_cache[key] = result
+    if len(_otf_cache) > OTF_CACHE_SIZE:
+        _otf_cache.popitem(last=False)
+    return result
+
+
+def _output_dtype(images):
+    return images.dtype if np.issubdtype(images.dtype, np.floating) else np.float32
+
+
+def convolve(images, kernel):
+    """Convolve <images> (..., H, W) with <kernel>."""
+    images = np.asarray(images)
+    h, w = images.shape[-2:]
+    shape = fft_shape(images.shape, np.shape(kernel))
+    spectrum = np.fft.rfft2(images, shape) * otf(kernel, shape)
+    return np.fft.irfft2(spectrum, shape)[..., :h, :w].astype(_output_dtype(images))
+
+
+def convolve_many(image, kernels):
+    """Convolve <image> (..., H, W) with each of <kernels> (same shape). Returns an array (K, ..., H, W)."""
+    image = np.asarray(image)
+    h, w = image.shape[-2:]
+    shape = fft_shape(image.shape, np.shape(kernels[0]))
+    spectrum = np.fft.rfft2(image, shape)
+    otfs = np.stack([otf(k, shape) for k in kernels]).reshape((len(kernels),) + (1,) * (image.ndim - 2) + spectrum.shape[-2:])
+    return np.fft.irfft2(spectrum[None] * otfs, shape)[..., :h, :w].astype(_output_dtype(image))
+
+
+def convolve_field(images, kernels, weights):
+    """
+    Field-dependent convolution of <images> (..., H, W): sum over k of <kernels>[k] applied to images * <weights>[k]
+    (weights of shape (K, H, W)). Kernels must have the same shape.
+    """
+    images = np.asarray(images)
+    weights = np.asarray(weights)
+    h, w = images.shape[-2:]
+    shape = fft_shape(images.shape, np.shape(kernels[0]))
+    spectrum = np.zeros(images.shape[:-2] + (shape[0], shape[1] // 2 + 1), dtype=np.complex128)
+    # The inverse FFT is linear: the weighted spectra are summed before a single inverse transform
+    for kernel, weight in zip(kernels, weights):
+        spectrum += np.fft.rfft2(images * weight, shape) * otf(kernel, shape)
+    return np.fft.irfft2(spectrum, shape)[..., :h, :w].astype(_output_dtype(images))
+
+
+def main(argv=None):
+    from PIL import Image
+    import psf_library
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image', help='PSF-free render (e.g. TIFF of getImageGray32F)')
+    parser.add_argument('kernels', nargs='+', help='PSF text matrices (PSF.txt format)')
+    parser.add_argument('--output', default='convolved_%s.tif', help='Output file pattern, %%s being the kernel file name')
+    args = parser.parse_args(argv)
+
+    image = np.asarray(Image.open(args.image), dtype=np.float32)
+    if image.ndim == 3:
+        image = np.moveaxis(image, 2, 0)
+    kernels = [psf_library.measured(path) for path in args.kernels]
+    shapes = set(k.shape for k in kernels)
+    results = convolve_many(image, kernels) if len(shapes) == 1 else [convolve(image, k) for k in kernels]
+    for path, result in zip(args.kernels, results):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if result.ndim == 3:
+            result = np.moveaxis(result, 0, 2)
+        Image.fromarray(result if result.ndim == 2 else np.clip(result, 0, 255).astype(np.uint8)).save(args.output % name)
+        print(args.output % name)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
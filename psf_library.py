@@ -0,0 +1,234 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : PSF kernels and PSF upload tracking
+
+ Kernels (normalized to a sum of 1, returned read-only and memoized by
+ parameters with an LRU cache):
+ - gaussian(size, sigma)                       : discrete Gaussian sampled at pixel centers
+ - oversampled_gaussian(width, sigma, factor)  : surrender.geometry.gaussian kernel of <width>
+                                                 pixels sampled <factor> times per pixel
+ - airy(size, first_zero, factor)              : Airy pattern, first dark ring at <first_zero> pixels
+ - measured(path)                              : kernel read from a measured PSF file
+ Measured PSFs (text matrix such as PSF.txt, FITS, TIFF or .npy) are prepared
+ for setPSF with prepare(): normalized, resampled to the oversampling factor
+ (flux-conserving) and cached as binary .npy files; prepare_directory() does
+ it for a directory of kernels:
+   python psf_library.py measured_psfs/ --factor 10 --pitch 0.5
+ PSFSession wraps a client and does not send setPSF again when the same kernel
+ (and parameters) is already loaded in the server session.
+"""
+import os
+import sys
+import hashlib
+import argparse
+from functools import lru_cache
+import numpy as np
+from client_proxy import ClientProxy
+from reference_store import PASSIVE_CALLS
+
+CACHE_SIZE = 64
+CACHE_DIR = '.psf_cache'
+KERNEL_EXTENSIONS = ('.txt', '.dat', '.csv', '.fits', '.fit', '.tif', '.tiff', '.npy')
+# First zero of the Bessel function J1
+J1_FIRST_ZERO = 3.8317059702075125
+
+
+def _frozen(kernel):
+    kernel.setflags(write=False)
+    return kernel
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def gaussian(size, sigma=1.0):
+    """<size> x <size> Gaussian of standard deviation <sigma> pixels, centered on the central pixel."""
+    psf = np.array(range(size)) - int(size / 2)
+    psf = np.meshgrid(psf, psf)
+    psf = np.exp(-(psf[0] ** 2 + psf[1] ** 2) / (2. * sigma ** 2))
+    return _frozen(psf / np.sum(psf))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def oversampled_gaussian(width, sigma=1.0, factor=10):
+    """Gaussian of <width> x <width> pixels and <sigma> pixels sampled <factor> times per pixel (as given to setPSF(psf, width, width))."""
+    from surrender.geometry import gaussian as surrender_gaussian
+    return _frozen(np.asarray(surrender_gaussian(width * factor, sigma * factor)))
+
+
+def bessel_j1(x):
+    """Bessel function J1 from its integral form (64 nodes, accurate to float precision for |x| < 40 as the integrand is periodic)."""
+    tau = (np.arange(64) + 0.5) * (np.pi / 64)
+    x = np.asarray(x, dtype=np.float64)
+    return np.cos(tau - x[..., None] * np.sin(tau)).mean(axis=-1)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def airy(size, first_zero, factor=1):
+    """
+    Airy pattern (2 J1(x) / x)^2 of a circular pupil on <size> x <size> pixels, with its first dark ring at
+    <first_zero> pixels, sampled <factor> times per pixel.
+    """
+    n = size * factor
+    r = (np.arange(n) - (n - 1) / 2.) / factor
+    r = np.hypot(r[:, None], r[None, :])
+    x = r * (J1_FIRST_ZERO / first_zero)
+    safe = np.where(x > 0, x, 1.0)
+    psf = np.where(x > 0, (2 * bessel_j1(safe) / safe) ** 2, 1.0)
+    return _frozen(psf / psf.sum())
+
+
+def read_kernel(path):
+    """Read the 2D kernel of file <path>: whitespace/comma separated text matrix, FITS (primary HDU), TIFF or .npy."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.fits', '.fit'):
+        from astropy.io import fits
+        psf = fits.getdata(path, ext=0)
+    elif ext in ('.tif', '.tiff'):
+        from PIL import Image
+        psf = np.asarray(Image.open(path))
+    elif ext == '.npy':
+        psf = np.load(path)
+    else:
+        with open(path, 'r') as f:
+            psf = np.loadtxt(f, dtype=np.float64, ndmin=2, delimiter=',' if ext == '.csv' else None)
+    psf = np.squeeze(np.asarray(psf, dtype=np.float64))
+    if psf.ndim != 2:
+        raise ValueError("%s: a PSF must be a 2D matrix, got shape %s" % (path, psf.shape))
+    return psf
+
+
+def normalize(psf):
+    """Kernel <psf> with negative values (measurement noise) set to 0 and a sum of 1."""
+    psf = np.maximum(np.asarray(psf, dtype=np.float64), 0)
+    total = psf.sum()
+    if total <= 0:
+        raise ValueError("PSF has no positive value")
+    return psf / total
+
+
+def kernel_width(psf, pitch=1.0):
+    """Odd number of pixels covered by <psf> sampled every <pitch> pixels."""
+    width = int(np.ceil(max(psf.shape) * pitch - 1e-9))
+    return width + 1 - width % 2
+
+
+def resample(psf, factor, pitch=1.0):
+    """
+    Resample <psf> (one sample every <pitch> pixels) to <factor> samples per pixel over kernel_width() pixels,
+    as expected by setPSF(psf, width, width). Returns (psf, width).
+    """
+    width = kernel_width(psf, pitch)
+    samples = width * factor
+    result = psf
+    for axis in (0, 1):
+        n = result.shape[axis]
+        edges = (np.arange(n + 1) - n / 2.) * pitch
+        new_edges = (np.arange(samples + 1) - samples / 2.) / factor
+        cumulative = np.concatenate([np.zeros_like(np.take(result, [0], axis)), np.cumsum(result, axis=axis)], axis=axis)
+        result = np.diff(np.apply_along_axis(lambda c: np.interp(new_edges, edges, c), axis, cumulative), axis=axis)
+    return normalize(result), width
+
+
+def prepare(path, factor=1, pitch=1.0, cache_dir=CACHE_DIR):
+    """
+    Return (psf, width) of measured kernel <path> normalized and resampled to <factor> samples per pixel
+    (<pitch>: pixels per sample of the file). The result is cached in <cache_dir> (None: no cache), keyed by the
+    file content and the parameters.
+    """
+    with open(path, 'rb') as f:
+        h = hashlib.sha1(f.read())
+    h.update(b'%d %r' % (factor, float(pitch)))
+    cache_file = os.path.join(cache_dir, h.hexdigest() + '.npy') if cache_dir else None
+    if cache_file and os.path.isfile(cache_file):
+        psf = np.load(cache_file)
+        return _frozen(psf), kernel_width(psf, 1. / factor)
+    psf, width = resample(normalize(read_kernel(path)), factor, pitch)
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_file + '.tmp.npy', psf)
+        os.replace(cache_file + '.tmp.npy', cache_file)
+    return _frozen(psf), width
+
+
+def prepare_directory(directory, factor=1, pitch=1.0, cache_dir=CACHE_DIR):
+    """prepare() every kernel file of <directory>. Returns {file name: (psf, width)}."""
+    return {name: prepare(os.path.join(directory, name), factor, pitch, cache_dir)
+            for name in sorted(os.listdir(directory)) if name.lower().endswith(KERNEL_EXTENSIONS)}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _measured(path, mtime):
+    return _frozen(normalize(read_kernel(path)))
+
+
+def measured(path):
+    """Kernel of measured PSF file <path> (see read_kernel), normalized. The cache is invalidated when the file changes."""
+    path = os.path.abspath(path)
+    return _measured(path, os.path.getmtime(path))
+
+
+def cache_clear():
+    for function in (gaussian, oversampled_gaussian, airy, _measured):
+        function.cache_clear()
+
+
+def kernel_digest(psf, *args):
+    """Digest of kernel <psf> and of the setPSF parameters <args>."""
+    a = np.ascontiguousarray(psf)
+    h = hashlib.sha1(b'%s%s' % (a.dtype.str.encode(), str(a.shape).encode()))
+    h.update(a.tobytes())
+    h.update(repr(args).encode())
+    return h.hexdigest()
+
+
+# Calls known to leave the PSF loaded in the server untouched (any other call may change it)
+PSF_NEUTRAL_CALLS = PASSIVE_CALLS | frozenset((
+    'render', 'isConnected', 'record', 'generateReplay',
+    'setObjectPosition', 'setObjectAttitude', 'setObjectElementBRDF', 'setSunPower', 'setBackground',
+    'createBRDF', 'createShape', 'createBody', 'createMesh', 'createSphericalDEM',
+    'setCameraFOVDeg', 'setImageSize', 'setNbSamplesPerPixel', 'setIntegrationTime', 'enableVarianceMapping',
+    'setShadowMapSize', 'setCubeMapSize',
+))
+
+
+class PSFSession(ClientProxy):
+    """
+    Skips setPSF calls loading the kernel already loaded in the server session.
+    The session state is forgotten on any call not in PSF_NEUTRAL_CALLS (reset(), connectToServer(),
+    setPSFSigma(), enableFastPSFMode(), Lua scripts, ...).
+    """
+
+    def __init__(self, client):
+        ClientProxy.__init__(self, client)
+        self.loaded = None
+        self.skipped = 0
+
+    def _call(self, name, method, args, kwargs):
+        if name == 'setPSF':
+            digest = kernel_digest(args[0], *args[1:], *sorted(kwargs.items()))
+            if digest == self.loaded:
+                self.skipped += 1
+                return None
+            result = method(*args, **kwargs)
+            self.loaded = digest
+            return result
+        if name not in PSF_NEUTRAL_CALLS:
+            self.loaded = None
+        return method(*args, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='Directory of measured PSF files (%s)' % ', '.join(KERNEL_EXTENSIONS))
+    parser.add_argument('--factor', type=int, default=1, help='Samples per pixel of the prepared kernels')
+    parser.add_argument('--pitch', type=float, default=1.0, help='Pixels per sample of the measured kernels')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args(argv)
+    for name, (psf, width) in prepare_directory(args.directory, args.factor, args.pitch, args.cache_dir).items():
+        print('%-32s %3d pixels, %dx%d samples' % (name, width, psf.shape[0], psf.shape[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Reference image store keyed by scenario command trace
+
+ Every render is identified by a hash of the commands sent to the server since
+ the connection (arguments included, arrays by content) and of the server
+ version. The images retrieved after a render are stored under that key, so
+ that a later run issuing the same commands to the same server version can
+ reuse them instead of rendering again (see CachingClient, used by --gen-ref).
+"""
+import os
+import json
+import struct
+import hashlib
+import numpy as np
+from client_proxy import ClientProxy, IMAGE_GETTERS
+
+# Calls that do not change what the server renders
+PASSIVE_CALLS = IMAGE_GETTERS | frozenset((
+    'version', 'getState', 'printState', 'setVerbosityLevel', 'closeViewer', 'setTimeOut', 'setCompressionLevel',
+))
+
+
+def feed(h, obj):
+    """Feed a canonical encoding of <obj> (numbers, strings, containers, NumPy arrays) to hash <h>."""
+    if isinstance(obj, np.ndarray) or isinstance(obj, np.generic):
+        a = np.ascontiguousarray(obj)
+        h.update(b'A%s%s' % (a.dtype.str.encode(), str(a.shape).encode()))
+        h.update(a.tobytes())
+    elif isinstance(obj, bool) or obj is None:
+        h.update(b'K%r' % obj)
+    elif isinstance(obj, int):
+        h.update(b'I%d;' % obj)
+    elif isinstance(obj, float):
+        h.update(b'F' + struct.pack('<d', obj))
+    elif isinstance(obj, str):
+        data = obj.encode()
+        h.update(b'S%d:' % len(data) + data)
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'L%d:' % len(obj))
+        for item in obj:
+            feed(h, item)
+    elif isinstance(obj, dict):
+        h.update(b'D%d:' % len(obj))
+        for key in sorted(obj, key=str):
+            feed(h, str(key))
+            feed(h, obj[key])
+    else:
+        feed(h, repr(obj))
+
+
+def call_key(name, args, kwargs):
+    """Short identifier of a call and its arguments (used to name stored getter results)."""
+    h = hashlib.sha256()
+    feed(h, [args, kwargs])
+    return '%s_%s' % (name, h.hexdigest()[:12])
+
+
+class ReferenceStore:
+    """Directory of getter results, one sub-directory per render key."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key, getter_key):
+        return os.path.join(self.root, key[:2], key, getter_key + '.npy')
+
+    def has(self, key, getter_key=None):
+        if getter_key is None:
+            return os.path.isdir(os.path.join(self.root, key[:2], key))
+        return os.path.isfile(self._path(key, getter_key))
+
+    def load(self, key, getter_key):
+        return np.load(self._path(key, getter_key))
+
+    def info(self, key):
+        """Return the information stored with render <key> (test, server version, sample count, getters)."""
+        path = os.path.join(self.root, key[:2], key, 'info.json')
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def getters(self, key):
+        """Return the stored getter calls of render <key>: {getter_key: {'name': method, 'args': [...]}}."""
+        return self.info(key).get('getters', {})
+
+    def save(self, key, getter_key, array, call=None, info=None):
+        """Store <array> as result of <getter_key> for render <key>. <call> is (method, args) to be able to call it again."""
+        path = self._path(key, getter_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npy'
+        np.save(tmp, np.asarray(array))
+        os.replace(tmp, path)
+        info_file = os.path.join(os.path.dirname(path), 'info.json')
+        content = dict(info or {}, getters=self.getters(key))
+        if call is not None:
+            content['getters'][getter_key] = {'name': call[0], 'args': [np.asarray(a).tolist() for a in call[1]]}
+        with open(info_file + '.tmp', 'w') as f:
+            json.dump(content, f, indent=1)
+        os.replace(info_file + '.tmp', info_file)
+
+
+class CachingClient(ClientProxy):
+    """
+    Forwards every call to the server, except renders whose key is already in <store>: these are skipped
+    and the following image getters are answered from the store. Other renders are performed and their
+    images saved. Scene commands are always forwarded so that the server state stays consistent.
+    <spp> is the sample count actually used by the server for the saved renders when it is forced
+    (e.g. by --gen-ref), otherwise the last setNbSamplesPerPixel is recorded.
+    """
+    save_results = True
+
+    def __init__(self, client, store, label=None, spp=None):
+        ClientProxy.__init__(self, client)
+        self._store = store
+        self._label = label
+        self._forced_spp = spp
+        self._spp = None
+        self._trace = hashlib.sha256()
+        self._version = None
+        self._key = None          # key of the last render
+        self._rendered = True     # whether the last render was actually performed
+        self.hits = 0
+        self.misses = 0
+
+    def render_key(self):
+        """Key of a render issued now (command trace so far and server version)."""
+        if self._version is None:
+            self._version = self._client.version()
+        h = self._trace.copy()
+        feed(h, self._version)
+        return h.hexdigest()
+
+    def _render(self, method, args, kwargs):
+        """Handle render() for the current key. Returns whether the server actually rendered."""
+        if self._store.has(self._key):
+            self.hits += 1
+            return False
+        self.misses += 1
+        method(*args, **kwargs)
+        return True
+
+    def _call(self, name, method, args, kwargs):
+        if name == 'setNbSamplesPerPixel':
+            self._spp = int(args[0])
+        if name == 'render':
+            self._key = self.render_key()
+            feed(self._trace, name)
+            self._rendered = self._render(method, args, kwargs)
+            return None
+
+        if name in IMAGE_GETTERS and self._key is not None:
+            getter_key = call_key(name, args, kwargs)
+            if not self._rendered:
+                if self._store.has(self._key, getter_key):
+                    return self._store.load(self._key, getter_key)
+                # Result not stored for this render: render it for real now
+                self._client.render()
+                self._rendered = True
+            result = method(*args, **kwargs)
+            if self.save_results:
+                self._store.save(self._key, getter_key, result, (name, args),
+                                 {'test': self._label, 'version': self._version, 'spp': self._forced_spp or self._spp})
+            return result
+
+        if name not in PASSIVE_CALLS:
+            feed(self._trace, [name, args, kwargs])
+        return method(*args, **kwargs)
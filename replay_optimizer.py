@@ -0,0 +1,242 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : optimize a replay recorded with s.record() / s.generateReplay()
+
+ The replay is parsed as Python, and calls to the client are simplified:
+ - state setters overwritten before anything observes them (render, getters,
+   Lua code, object creation...) are removed,
+ - state setters restoring the value already set are removed (no-ops),
+ - frame-invariant setters (sent again at every frame with the same value)
+   are only kept at their first occurrence, typically in the static scene
+   setup, as long as no call between them may reset their state (creation of
+   the same object, reset, Lua code...): unlike in the no-op removal, creating
+   other resources and objects does not make them be sent again,
+ so that the static scene setup (everything before the first render) is sent
+ once, and each following frame only contains the state that changes.
+ Statements that are not plain client calls are kept as they are.
+ Usage:
+   python replay_optimizer.py my_record.py [-o my_record_opt.py]
+"""
+import ast
+import sys
+import argparse
+from collections import Counter
+
+# Setters keyed by their first argument(s) (object name...): number of key arguments
+KEYED_SETTERS = {
+    'setObjectPosition': 1,
+    'setObjectAttitude': 1,
+    'setObjectElementBRDF': 2,
+}
+# Setters of a single global state
+GLOBAL_SETTERS = frozenset((
+    'setImageSize', 'setCameraFOVDeg', 'setCameraFOVRad', 'setNbSamplesPerPixel', 'setSunPower', 'setPSF',
+    'setShadowMapSize', 'setCubeMapSize', 'setTimeOut', 'setCompressionLevel', 'setVerbosityLevel',
+    'setIntegrationTime', 'setStdDevThreshold', 'setBackground', 'setFSAA', 'setPSFSigma',
+    'setSelfVisibilitySamplingStep', 'setPhotonMapSamplingStep',
+))
+# Resource creations: creating again the same resource is a no-op
+RESOURCE_CREATORS = frozenset(('createBRDF', 'createShape'))
+# Object creations: only reset the state of the object created (first argument)
+OBJECT_CREATORS = frozenset(('createBody', 'createMesh', 'createSphericalDEM'))
+# Calls that read the state without modifying it
+OBSERVERS = frozenset(('render', 'version', 'getState', 'printState'))
+# Names whose value cannot change within a replay
+CONSTANT_NAMES = frozenset(('np', 'numpy', 'math'))
+
+
+def is_setter(name):
+    return name in KEYED_SETTERS or name in GLOBAL_SETTERS or (name.startswith('enable') and name != 'enable')
+
+
+class Item:
+    """A top-level statement of a replay, possibly a call <name> to the client."""
+
+    def __init__(self, node, client):
+        self.node = node
+        self.name = None
+        self.uses_client = any(isinstance(n, ast.Name) and n.id == client for n in ast.walk(node))
+        call = node.value if isinstance(node, (ast.Expr, ast.Assign)) else None
+        if isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) \
+                and isinstance(call.func.value, ast.Name) and call.func.value.id == client:
+            self.name = call.func.attr
+            self.args = call.args
+            self.value = ast.dump(ast.Tuple(elts=call.args + [kw.value for kw in call.keywords], ctx=ast.Load())) \
+                + repr([kw.arg for kw in call.keywords])
+            # Arguments referring to variables may change value between two identical-looking calls
+            self.comparable = all(n.id in CONSTANT_NAMES or n.id == client
+                                  for arg in call.args + [kw.value for kw in call.keywords]
+                                  for n in ast.walk(arg) if isinstance(n, ast.Name))
+
+    @property
+    def setter(self):
+        return isinstance(self.node, ast.Expr) and self.name is not None and is_setter(self.name)
+
+    @property
+    def key(self):
+        n = KEYED_SETTERS.get(self.name, 0)
+        return (self.name,) + tuple(ast.dump(a) for a in self.args[:n])
+
+    @property
+    def constant_key(self):
+        """Whether the key arguments are literals (a key computed from variables may designate any object)."""
+        n = KEYED_SETTERS.get(self.name, 0)
+        return not any(isinstance(node, ast.Name) and node.id not in CONSTANT_NAMES
+                       for arg in self.args[:n] for node in ast.walk(arg))
+
+    @property
+    def observer(self):
+        return self.name is not None and (self.name in OBSERVERS or self.name.startswith('get'))
+
+
+def detect_client(tree):
+    """Return the name of the client variable: the most frequent receiver of top-level method calls."""
+    receivers = Counter(n.value.func.value.id for n in tree.body
+                        if isinstance(n, ast.Expr) and isinstance(n.value, ast.Call)
+                        and isinstance(n.value.func, ast.Attribute) and isinstance(n.value.func.value, ast.Name))
+    return receivers.most_common(1)[0][0] if receivers else 's'
+
+
+def parse_replay(source, client=None):
+    """Return (client name, list of Item) of replay <source>."""
+    tree = ast.parse(source)
+    client = client or detect_client(tree)
+    return client, [Item(node, client) for node in tree.body]
+
+
+def remove_overwritten(items):
+    """
+    Drop setters overwritten by a later setter of the same key with no other client call in between.
+    Setters whose key is computed from variables are kept and overwrite nothing.
+    """
+    kept = []
+    pending = set()
+    for item in reversed(items):
+        if item.setter:
+            if not item.constant_key:
+                kept.append(item)
+                continue
+            if item.key in pending:
+                continue
+            pending.add(item.key)
+        elif item.uses_client:
+            pending.clear()
+        kept.append(item)
+    kept.reverse()
+    return kept
+
+
+def update_state(state, item):
+    """Record setter <item> in <state> {key: value}; returns False if it sets the value already in place."""
+    if not item.constant_key:
+        # Any object may be designated: every key of this setter is forgotten
+        for key in [key for key in state if key[0] == item.name]:
+            del state[key]
+        return True
+    if item.comparable and state.get(item.key) == item.value:
+        return False
+    state[item.key] = item.value if item.comparable else None
+    return True
+
+
+def remove_noops(items):
+    """
+    Drop setters setting the value already in place, and identical resource re-creations.
+    State is forgotten at calls that may modify it (reset, Lua code, object creation...).
+    """
+    kept = []
+    state = {}
+    resources = set()
+    for item in items:
+        if item.setter:
+            if not update_state(state, item):
+                continue
+        elif item.name in RESOURCE_CREATORS and isinstance(item.node, ast.Expr) and item.comparable:
+            if (item.name, item.value) in resources:
+                continue
+            resources.add((item.name, item.value))
+        elif item.uses_client and not item.observer:
+            state.clear()
+            resources.clear()
+        kept.append(item)
+    return kept
+
+
+def may_reset(item, key):
+    """Whether <item> may change the state set by setters of <key> (other than by a setter of <key>)."""
+    if not item.uses_client or item.observer or item.setter or item.name in RESOURCE_CREATORS:
+        return False
+    if item.name in OBJECT_CREATORS and isinstance(item.node, ast.Expr) and item.args:
+        # Object names computed at run time may be any object
+        return key[0] in KEYED_SETTERS and (not isinstance(item.args[0], ast.Constant) or ast.dump(item.args[0]) == key[1])
+    return True
+
+
+def hoist_invariant(items):
+    """
+    Drop setters repeating the value set by a previous setter of the same key (e.g. sent again at every frame),
+    their state being only forgotten at the calls that may reset this key (see may_reset).
+    """
+    kept = []
+    state = {}
+    for item in items:
+        if item.setter:
+            if not update_state(state, item):
+                continue
+        elif item.uses_client:
+            for key in [key for key in state if may_reset(item, key)]:
+                del state[key]
+        kept.append(item)
+    return kept
+
+
+def optimize(items):
+    return hoist_invariant(remove_noops(remove_overwritten(items)))
+
+
+def unparse(items, header=None):
+    """Return the Python source of <items>, with section comments for the static setup and each frame."""
+    lines = [header] if header else []
+    lines.append('# Static scene setup')
+    frame = 0
+    after_render = False
+    for item in items:
+        # Getters following a render belong to the same frame
+        if after_render and not item.observer:
+            frame += 1
+            lines.append('')
+            lines.append('# Frame %d' % frame)
+            after_render = False
+        lines.append(ast.unparse(item.node))
+        after_render = after_render or item.name == 'render'
+    return '\n'.join(lines) + '\n'
+
+
+def optimize_replay(source, header=None):
+    """Return (optimized source, number of calls before, number of calls after)."""
+    _, items = parse_replay(source)
+    optimized = optimize(items)
+    calls = lambda l: sum(1 for i in l if i.name is not None)
+    return unparse(optimized, header), calls(items), calls(optimized)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('replay', help='Replay file generated by generateReplay()')
+    parser.add_argument('-o', '--output', default=None, help='Optimized replay (default: <replay>_opt.py)')
+    args = parser.parse_args(argv)
+
+    with open(args.replay, 'r') as f:
+        source = f.read()
+    output = args.output or (args.replay[:-3] if args.replay.endswith('.py') else args.replay) + '_opt.py'
+    code, before, after = optimize_replay(source, '# Optimized from %s by replay_optimizer.py' % args.replay)
+    with open(output, 'w') as f:
+        f.write(code)
+    print('%s: %d client calls -> %d (%s)' % (args.replay, before, after, output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
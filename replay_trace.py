@@ -0,0 +1,308 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : binary traces of client sessions (record, convert, play, diff)
+
+ File layout (little endian):
+   header : b'SRTRACE' + version byte, 8 reserved bytes
+   records: type (1 byte), payload length (uint32), payload
+     'N' method name : uint16 method id, name (utf-8)
+     'A' array       : uint16 header length, JSON {"dtype", "shape"}, zero padding, data
+                       (data aligned on 64 bytes in the file, so that it is memory-mapped as is)
+     'C' call        : uint16 method id, JSON [args, kwargs]
+ In call arguments, arrays are replaced by {"$a": index} (identical arrays are stored
+ once) and client constants (s.XYZ_SCALAR_CONVENTION...) by {"$c": name}. Tuples
+ are written as JSON arrays and read back as lists.
+ Usage:
+   python replay_trace.py convert my_record.py my_record.srt [--optimize]
+   python replay_trace.py play my_record.srt [--host 127.0.0.1] [--port 5151]
+   python replay_trace.py diff a.srt b.srt
+   python replay_trace.py dump my_record.srt
+"""
+import os
+import ast
+import sys
+import json
+import mmap
+import struct
+import difflib
+import hashlib
+import argparse
+import numpy as np
+from client_proxy import ClientProxy, IMAGE_GETTERS
+
+MAGIC = b'SRTRACE\x01'
+HEADER_SIZE = 16
+ALIGNMENT = 64
+RECORD = struct.Struct('<BI')
+# Calls not written to traces (they do not change the server state, or concern the session)
+NOT_RECORDED = IMAGE_GETTERS | frozenset(('version', 'getState', 'printState', 'connectToServer', 'record', 'generateReplay'))
+
+
+class ClientConstant(str):
+    """Name of a constant of the client class (e.g. XYZ_SCALAR_CONVENTION), resolved when played."""
+
+
+class TraceWriter:
+    """Writes calls to trace file <path>."""
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + bytes(HEADER_SIZE - len(MAGIC)))
+        self._methods = {}
+        self._arrays = {}
+        self.calls = 0
+
+    def _record(self, kind, payload):
+        self._file.write(RECORD.pack(ord(kind), len(payload)))
+        self._file.write(payload)
+
+    def _array(self, a):
+        a = np.ascontiguousarray(a)
+        digest = hashlib.sha1(b'%s%s' % (a.dtype.str.encode(), str(a.shape).encode()) + a.tobytes()).digest()
+        if digest not in self._arrays:
+            header = json.dumps({'dtype': a.dtype.str, 'shape': a.shape}).encode()
+            data_start = self._file.tell() + RECORD.size + 2 + len(header)
+            padding = -data_start % ALIGNMENT
+            self._record('A', struct.pack('<H', len(header)) + header + bytes(padding) + a.tobytes())
+            self._arrays[digest] = len(self._arrays)
+        return {'$a': self._arrays[digest]}
+
+    def _encode(self, obj):
+        if isinstance(obj, ClientConstant):
+            return {'$c': str(obj)}
+        if isinstance(obj, np.ndarray):
+            return self._array(obj)
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, (list, tuple)):
+            return [self._encode(x) for x in obj]
+        if isinstance(obj, dict):
+            return {str(k): self._encode(v) for k, v in obj.items()}
+        return obj
+
+    def call(self, name, args, kwargs):
+        if name not in self._methods:
+            self._methods[name] = len(self._methods)
+            self._record('N', struct.pack('<H', self._methods[name]) + name.encode())
+        payload = json.dumps([self._encode(list(args)), self._encode(kwargs)], separators=(',', ':')).encode()
+        self._record('C', struct.pack('<H', self._methods[name]) + payload)
+        self.calls += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceReader:
+    """Memory-mapped trace file <path>. Iterating yields (name, args, kwargs) as the file is read."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a SurRender trace (or has an unsupported version)" % path)
+        self.path = path
+        self.arrays = []
+
+    def _decode(self, obj, constant):
+        if isinstance(obj, list):
+            return [self._decode(x, constant) for x in obj]
+        if isinstance(obj, dict):
+            if len(obj) == 1 and '$a' in obj:
+                return self.arrays[obj['$a']]
+            if len(obj) == 1 and '$c' in obj:
+                return constant(obj['$c'])
+            return {k: self._decode(v, constant) for k, v in obj.items()}
+        return obj
+
+    def calls(self, constant=ClientConstant):
+        """Yield the calls of the trace; client constants are returned as constant(name)."""
+        m = self._map
+        methods = {}
+        pos = HEADER_SIZE
+        while pos < len(m):
+            kind, length = RECORD.unpack_from(m, pos)
+            start = pos + RECORD.size
+            pos = start + length
+            if kind == ord('C'):
+                method_id, = struct.unpack_from('<H', m, start)
+                args, kwargs = json.loads(m[start + 2:pos])
+                yield methods[method_id], self._decode(args, constant), self._decode(kwargs, constant)
+            elif kind == ord('N'):
+                method_id, = struct.unpack_from('<H', m, start)
+                methods[method_id] = m[start + 2:pos].decode()
+            elif kind == ord('A'):
+                header_length, = struct.unpack_from('<H', m, start)
+                header = json.loads(m[start + 2:start + 2 + header_length])
+                data_start = start + 2 + header_length
+                data_start += -data_start % ALIGNMENT
+                dtype = np.dtype(header['dtype'])
+                count = int(np.prod(header['shape']))
+                self.arrays.append(np.frombuffer(m, dtype, count, data_start).reshape(header['shape']))
+            else:
+                raise ValueError("%s: unknown record type %r at offset %d" % (self.path, chr(kind), pos - length - RECORD.size))
+
+    __iter__ = calls
+
+
+def load(path):
+    """Return the list of calls (name, args, kwargs) of trace <path>; arrays are read-only views of the mapped file."""
+    return list(TraceReader(path))
+
+
+def play(path, s):
+    """Send the calls of trace <path> to client <s> as they are read. Returns the number of calls."""
+    n = 0
+    for name, args, kwargs in TraceReader(path).calls(lambda c: getattr(s, c)):
+        getattr(s, name)(*args, **kwargs)
+        n += 1
+    return n
+
+
+#-----------------------------------------------------------------------
+# Recording
+#-----------------------------------------------------------------------
+
+class TraceRecorder(ClientProxy):
+    """Client proxy writing the calls changing the server state to <writer> (a TraceWriter)."""
+
+    def __init__(self, client, writer):
+        ClientProxy.__init__(self, client)
+        self._writer = writer
+
+    def _call(self, name, method, args, kwargs):
+        if name not in NOT_RECORDED:
+            self._writer.call(name, args, kwargs)
+        return method(*args, **kwargs)
+
+
+class _Constants:
+    """Stands for the client in replay arguments: s.NAME evaluates to ClientConstant('NAME')."""
+
+    def __getattr__(self, name):
+        return ClientConstant(name)
+
+
+def _creates_client(node, client):
+    """Whether statement <node> only creates the client (e.g. s = surrender_client())."""
+    return isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) \
+        and node.targets[0].id == client and isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name) \
+        and not node.value.args and not node.value.keywords
+
+
+def convert(source, writer, optimize=False):
+    """
+    Write the client calls of Python replay <source> (generateReplay() output) to <writer>.
+    Arguments are evaluated in the namespace of the replay (statements not using the client are
+    executed; surrender imports are skipped). With <optimize>, replay_optimizer is applied first.
+    Raises ValueError on statements using the client other than plain calls (loops, call results
+    assigned...), whose calls could not all be written.
+    """
+    import replay_optimizer
+    client, items = replay_optimizer.parse_replay(source)
+    if optimize:
+        items = replay_optimizer.optimize(items)
+    namespace = {'np': np, client: _Constants()}
+    for item in items:
+        node = item.node
+        if item.name is not None and item.name in NOT_RECORDED:
+            # Getters (e.g. im = s.getImage()): their results are not part of traces
+            continue
+        if item.name is not None and isinstance(node, ast.Expr):
+            call = node.value
+            args = [eval(compile(ast.Expression(a), '<replay>', 'eval'), namespace) for a in call.args]
+            kwargs = {kw.arg: eval(compile(ast.Expression(kw.value), '<replay>', 'eval'), namespace) for kw in call.keywords}
+            writer.call(item.name, args, kwargs)
+        elif not item.uses_client:
+            if isinstance(node, (ast.Import, ast.ImportFrom)) and any(a.name.startswith('surrender') for a in node.names) \
+                    or isinstance(node, ast.ImportFrom) and (node.module or '').startswith('surrender'):
+                continue
+            exec(compile(ast.Module(body=[node], type_ignores=[]), '<replay>', 'exec'), namespace)
+        elif not _creates_client(node, client):
+            # Loops, results of calls used by the replay...: the calls they make cannot be listed
+            raise ValueError("Line %d: statement using the client cannot be written to a trace: %s"
+                             % (node.lineno, ast.unparse(node).splitlines()[0]))
+
+
+#-----------------------------------------------------------------------
+# Diff
+#-----------------------------------------------------------------------
+
+def describe(obj):
+    """Short text of a call argument; arrays are summarized by dtype, shape and content digest."""
+    if isinstance(obj, np.ndarray):
+        return 'array(%s%s #%s)' % (obj.dtype.str, list(obj.shape), hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()[:8])
+    if isinstance(obj, ClientConstant):
+        return 's.' + obj
+    if isinstance(obj, list):
+        return '[%s]' % ', '.join(describe(x) for x in obj)
+    if isinstance(obj, dict):
+        return '{%s}' % ', '.join('%r: %s' % (k, describe(v)) for k, v in obj.items())
+    return repr(obj)
+
+
+def call_lines(path):
+    lines = []
+    for name, args, kwargs in TraceReader(path):
+        params = [describe(a) for a in args] + ['%s=%s' % (k, describe(v)) for k, v in kwargs.items()]
+        lines.append('%s(%s)' % (name, ', '.join(params)))
+    return lines
+
+
+def diff(path_a, path_b, context=3):
+    """Return the unified diff (list of lines) of the calls of two traces."""
+    return list(difflib.unified_diff(call_lines(path_a), call_lines(path_b), path_a, path_b, n=context, lineterm=''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('convert', help='Convert a Python replay to a binary trace')
+    p.add_argument('replay')
+    p.add_argument('trace')
+    p.add_argument('--optimize', action='store_true', help='Remove overwritten and no-op calls (replay_optimizer)')
+    p = commands.add_parser('play', help='Send the calls of a trace to a server')
+    p.add_argument('trace')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=5151)
+    p = commands.add_parser('diff', help='Structural diff of the calls of two traces')
+    p.add_argument('a')
+    p.add_argument('b')
+    p = commands.add_parser('dump', help='Print the calls of a trace')
+    p.add_argument('trace')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        with open(args.replay, 'r') as f:
+            source = f.read()
+        try:
+            with TraceWriter(args.trace) as writer:
+                convert(source, writer, args.optimize)
+        except ValueError as e:
+            os.remove(args.trace)
+            print('%s: %s' % (args.replay, e), file=sys.stderr)
+            return 1
+        print('%s: %d calls written to %s' % (args.replay, writer.calls, args.trace))
+    elif args.command == 'play':
+        from surrender.surrender_client import surrender_client
+        s = surrender_client()
+        s.connectToServer(args.host, args.port)
+        print('%d calls played' % play(args.trace, s))
+    elif args.command == 'diff':
+        lines = diff(args.a, args.b)
+        print('\n'.join(lines))
+        return 1 if lines else 0
+    else:
+        print('\n'.join(call_lines(args.trace)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
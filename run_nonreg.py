@@ -0,0 +1,49 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : run the user manual non-regression tests sharded across several servers
+
+ One pytest process is started per server with --shard i/n; conftest.py balances
+ the shards using the runtimes recorded by previous runs.
+ Usage:
+   python run_nonreg.py --servers host1:5151,host2:5151 [pytest options...]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from conftest import parse_servers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", required=True, help="Comma separated list of host:port servers, one shard per server")
+    parser.add_argument("--log-dir", default="nonreg_logs", help="Directory of the per-shard pytest outputs")
+    args, pytest_args = parser.parse_known_args(argv)
+
+    endpoints = parse_servers(args.servers)
+    os.makedirs(args.log_dir, exist_ok=True)
+    start = time.time()
+    shards = []
+    for index, (host, port) in enumerate(endpoints):
+        cmd = [sys.executable, "-m", "pytest", "--shard", "%d/%d" % (index, len(endpoints)),
+               "--servers", args.servers] + pytest_args
+        log = open(os.path.join(args.log_dir, "shard_%d.txt" % index), "w")
+        shards.append((index, host, port, log, subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)))
+
+    status = 0
+    print("----------------------------------------")
+    for index, host, port, log, process in shards:
+        code = process.wait()
+        log.close()
+        status = status or code
+        print("shard %d (%s:%d): %s" % (index, host, port, "passed" if code == 0 else "exit code %d, see %s" % (code, log.name)))
+    print("Wall time: %.1f s" % (time.time() - start))
+    print("----------------------------------------")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
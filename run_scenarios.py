@@ -0,0 +1,288 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : run the user manual scenarios in parallel on a pool of servers
+
+ Scenarios are described in scenario_jobs.json:
+   "SCR01": {"script": ..., "depends": ["SCR00"], "inputs": [files], "outputs": [glob patterns]}
+ Each scenario runs in its own process on a server of the pool, whatever
+ host/port the script connects to (connectToServer is redirected), once the
+ scenarios it depends on have succeeded. Outputs are cached by the hash of the
+ script, the local modules it imports, its inputs, the server versions of the
+ pool and its dependencies' hashes: unchanged scenarios are restored from the
+ cache instead of being rendered again. Scenarios with "cache": false (the
+ installation check SCR00) always run. Without the server versions (client
+ not installed or server not reachable), nothing is cached.
+ Usage:
+   python run_scenarios.py --servers host1:5151,host2:5151 [--jobs SCR01,SCR05] [--force]
+"""
+import os
+import sys
+import ast
+import glob
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+import threading
+from conftest import parse_servers
+
+JOBS_FILE = 'scenario_jobs.json'
+CACHE_DIR = '.scenario_cache'
+LOG_DIR = 'scenario_logs'
+
+
+def load_jobs(path=JOBS_FILE, selection=None):
+    """Return the jobs of <path>, restricted to <selection> (list of names) and their dependencies."""
+    with open(path, 'r') as f:
+        jobs = json.load(f)
+    for name, job in jobs.items():
+        for dep in job.get('depends', []):
+            if dep not in jobs:
+                raise ValueError("%s depends on unknown scenario %s" % (name, dep))
+    if selection:
+        needed = set()
+        stack = list(selection)
+        while stack:
+            name = stack.pop()
+            if name not in jobs:
+                raise ValueError("Unknown scenario %s" % name)
+            if name not in needed:
+                needed.add(name)
+                stack.extend(jobs[name].get('depends', []))
+        jobs = {name: job for name, job in jobs.items() if name in needed}
+    return jobs
+
+
+def topological_order(jobs):
+    """Return the job names, dependencies first (raises ValueError on cycles)."""
+    order, state = [], {}
+
+    def visit(name):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError("Dependency cycle through %s" % name)
+        state[name] = 'visiting'
+        for dep in jobs[name].get('depends', []):
+            visit(dep)
+        state[name] = 'done'
+        order.append(name)
+    for name in sorted(jobs):
+        visit(name)
+    return order
+
+
+def local_imports(path, root='.'):
+    """Modules of <root> imported by <path>, directly or through other modules of <root> (paths relative to <root>)."""
+    found = set()
+    stack = [path]
+    while stack:
+        with open(os.path.join(root, stack.pop()), 'r') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for module in names:
+                module_path = module.split('.')[0] + '.py'
+                if module_path not in found and os.path.isfile(os.path.join(root, module_path)):
+                    found.add(module_path)
+                    stack.append(module_path)
+    found.discard(path)
+    return sorted(found)
+
+
+def server_versions(endpoints):
+    """Sorted versions of the servers of <endpoints>."""
+    from surrender.surrender_client import surrender_client
+    versions = set()
+    for host, port in endpoints:
+        s = surrender_client()
+        s.connectToServer(host, port)
+        versions.add(str(s.version()))
+    return sorted(versions)
+
+
+def input_hashes(jobs, root='.', versions=()):
+    """Hash of each job: script, local modules imported, input files, server <versions> and hashes of the dependencies."""
+    hashes = {}
+    for name in topological_order(jobs):
+        job = jobs[name]
+        h = hashlib.sha256(name.encode())
+        for version in versions:
+            h.update(b'version\0' + version.encode() + b'\0')
+        for path in [job['script']] + local_imports(job['script'], root) + sorted(job.get('inputs', [])):
+            with open(os.path.join(root, path), 'rb') as f:
+                h.update(path.encode() + b'\0' + hashlib.sha256(f.read()).digest())
+        for dep in sorted(job.get('depends', [])):
+            h.update(hashes[dep].encode())
+        hashes[name] = h.hexdigest()
+    return hashes
+
+
+class OutputCache:
+    """Directory of job outputs, one sub-directory per input hash."""
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+
+    def restore(self, key, directory='.'):
+        """Copy the outputs stored under <key> to <directory>. Returns False if <key> is not cached."""
+        entry = os.path.join(self.root, key)
+        if not os.path.isfile(os.path.join(entry, 'done')):
+            return False
+        for name in os.listdir(entry):
+            if name != 'done':
+                shutil.copy2(os.path.join(entry, name), os.path.join(directory, name))
+        return True
+
+    def store(self, key, files):
+        entry = os.path.join(self.root, key)
+        tmp = entry + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for path in files:
+            shutil.copy2(path, os.path.join(tmp, os.path.basename(path)))
+        open(os.path.join(tmp, 'done'), 'w').close()
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+
+
+def outputs(patterns, since):
+    """Files matching <patterns> modified after <since>."""
+    return sorted(set(path for pattern in patterns for path in glob.glob(pattern)
+                      if os.path.isfile(path) and os.path.getmtime(path) >= since))
+
+
+class Runner:
+    """Runs <jobs> on <endpoints> (one job per server at a time)."""
+
+    def __init__(self, jobs, endpoints, cache=None, force=False, log_dir=LOG_DIR, versions=()):
+        self.jobs = jobs
+        self.endpoints = endpoints
+        self.cache = cache
+        self.force = force
+        self.log_dir = log_dir
+        self.hashes = input_hashes(jobs, versions=versions)
+        self.results = {}           # name: (status, server, seconds)
+        self._lock = threading.Condition()
+
+    def _ready(self, name):
+        return all(self.results.get(dep, ('',))[0] in ('passed', 'cached') for dep in self.jobs[name].get('depends', []))
+
+    def _blocked(self, name):
+        return any(self.results.get(dep, ('',))[0] in ('failed', 'skipped') for dep in self.jobs[name].get('depends', []))
+
+    def run_job(self, name, host, port):
+        job = self.jobs[name]
+        key = self.hashes[name]
+        cache = self.cache if job.get('cache', True) else None
+        start = time.time()
+        if cache and not self.force and cache.restore(key):
+            return 'cached', time.time() - start
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', '%s:%d' % (host, port), job['script']]
+        with open(os.path.join(self.log_dir, name + '.txt'), 'w') as log:
+            code = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+        if code != 0:
+            return 'failed', time.time() - start
+        if cache:
+            cache.store(key, outputs(job.get('outputs', []), start))
+        return 'passed', time.time() - start
+
+    def _worker(self, host, port, pending):
+        while True:
+            with self._lock:
+                while True:
+                    for name in list(pending):
+                        if self._blocked(name):
+                            pending.remove(name)
+                            self.results[name] = ('skipped', None, 0.0)
+                            self._lock.notify_all()
+                    ready = [name for name in pending if self._ready(name)]
+                    if ready or not pending:
+                        break
+                    self._lock.wait()
+                if not pending:
+                    return
+                name = ready[0]
+                pending.remove(name)
+            try:
+                status, seconds = self.run_job(name, host, port)
+            except Exception as e:
+                # Recorded as failed so that the dependent jobs are released
+                print("%-8s error: %s" % (name, e))
+                status, seconds = 'failed', 0.0
+            print("%-8s %-8s %6.1f s  (%s:%d)" % (name, status, seconds, host, port))
+            with self._lock:
+                self.results[name] = (status, '%s:%d' % (host, port), seconds)
+                self._lock.notify_all()
+
+    def run(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        pending = topological_order(self.jobs)
+        threads = [threading.Thread(target=self._worker, args=(host, port, pending)) for host, port in self.endpoints]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results
+
+
+def run_child(endpoint, script):
+    """Run <script> in this process with every client connected to <endpoint>."""
+    import runpy
+    from client_proxy import EndpointProxy, patch_surrender_module
+    host, port = parse_servers(endpoint)[0]
+    patch_surrender_module(lambda client: EndpointProxy(client, host, port))
+    sys.argv = [script]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name='__main__')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', default='127.0.0.1:5151', help='Comma separated list of host:port servers')
+    parser.add_argument('--jobs', default=None, help='Comma separated scenarios to run (and their dependencies)')
+    parser.add_argument('--jobs-file', default=JOBS_FILE)
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Output cache directory (empty to disable)')
+    parser.add_argument('--force', action='store_true', help='Run the scenarios even if their outputs are cached')
+    parser.add_argument('--child', nargs=2, metavar=('ENDPOINT', 'SCRIPT'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        run_child(*args.child)
+        return 0
+
+    jobs = load_jobs(args.jobs_file, args.jobs.split(',') if args.jobs else None)
+    endpoints = parse_servers(args.servers)
+    cache, versions = OutputCache(args.cache_dir) if args.cache_dir else None, ()
+    if cache:
+        try:
+            versions = server_versions(endpoints)
+        except Exception as e:
+            print("Server versions unavailable (%s): output cache disabled" % e)
+            cache = None
+    runner = Runner(jobs, endpoints, cache, args.force, versions=versions)
+    start = time.time()
+    results = runner.run()
+    wall = time.time() - start
+
+    print("----------------------------------------")
+    print("%-8s %-8s %9s  %s" % ('scenario', 'status', 'seconds', 'server'))
+    for name in topological_order(jobs):
+        status, server, seconds = results[name]
+        print("%-8s %-8s %9.1f  %s" % (name, status, seconds, server or '-'))
+    busy = sum(r[2] for r in results.values())
+    print("Wall time: %.1f s for %.1f s of scenarios on %d server(s)" % (wall, busy, len(endpoints)))
+    print("----------------------------------------")
+    return 0 if all(r[0] in ('passed', 'cached') for r in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Script : declarative scenarios compiled to client calls
+
+ A scenario (JSON, see scenarios/) describes:
+   conventions : ["XYZ_SCALAR_CONVENTION", "Z_FRONTWARD"]
+   settings    : {"raytracing": true, "samples": 16, ...}            (see SETTINGS)
+   brdfs       : {name: {"file": "mate.brdf", "params": {}}}
+   shapes      : {name: {"file": "sphere.shp", "params": {"radius": ...}}}
+   bodies      : {name: {"shape", "brdf", "textures": [], "position", "attitude"}}
+   meshes      : {name: {"file": "itokawa.obj", "scale": 1e3, "brdf", "position", "attitude"}}
+   dems        : {name: {"file": "Ceres_Dawn.dem", "brdf", "texture", "position", "attitude"}}
+   sun         : {"radius", "power": [4 values], "position"}         (sun BRDF, shape and body)
+   camera      : {"fov_deg": [x, y], "image_size": [w, h], "position", "attitude"}
+   psf         : {"kernel": "gaussian"|"oversampled_gaussian"|"airy"|"measured", parameters of
+                  psf_library, "distance": d, "regular_sampling": true}
+   star_map    : "starMap_example.txt"
+   trajectory  : [{"objects": {name: {"position", "attitude"}}, "settings": {...}}, ...]
+ compile_scenario() validates it and returns a Program: the global settings
+ (conventions and settings, sent first as in the scripts since resources are
+ created under them), the resource creations (identical BRDFs and shapes
+ declared under several names are created once), the initial state, and per
+ frame only the setters whose value changes. The digest of the resources (and
+ of the settings they depend on) identifies scenes that can share a loaded
+ server, the digest of the whole program identifies its renders.
+ Usage:
+   python scenario_compiler.py scenarios/scr01_rendering_a_sphere.json [--trace scr01.srt] [--run --host H --port P]
+"""
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+from reference_store import feed
+from replay_trace import ClientConstant
+
+# Scenario setting: client method
+SETTINGS = {
+    'raytracing': 'enableRaytracing',
+    'path_tracing': 'enablePathTracing',
+    'double_precision': 'enableDoublePrecisionMode',
+    'preview': 'enablePreviewMode',
+    'irradiance': 'enableIrradianceMode',
+    'fast_psf': 'enableFastPSFMode',
+    'multilateral_filtering': 'enableMultilateralFiltering',
+    'regular_pixel_sampling': 'enableRegularPixelSampling',
+    'samples': 'setNbSamplesPerPixel',
+    'shadow_map_size': 'setShadowMapSize',
+    'cube_map_size': 'setCubeMapSize',
+    'integration_time': 'setIntegrationTime',
+    'timeout': 'setTimeOut',
+}
+SECTIONS = ('name', 'conventions', 'settings', 'brdfs', 'shapes', 'bodies', 'meshes', 'dems', 'sun', 'camera', 'psf',
+            'star_map', 'trajectory')
+POSE_KEYS = ('position', 'attitude')
+# Global settings changing how resources are created (part of the resource digest)
+RESOURCE_SETTINGS = ('setConventions', 'enableDoublePrecisionMode')
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+class Program:
+    """Compiled scenario: lists of (method, args) calls."""
+
+    def __init__(self, name, settings, resources, state, frames):
+        self.name = name
+        self.settings = settings
+        self.resources = resources
+        self.state = state
+        self.frames = frames
+
+    def calls(self):
+        """All the calls in order, a render ending each frame."""
+        result = list(self.settings) + list(self.resources) + list(self.state)
+        for frame in self.frames:
+            result += frame + [('render', ())]
+        return result
+
+    def resource_digest(self):
+        h = hashlib.sha256()
+        feed(h, [call for call in self.settings if call[0] in RESOURCE_SETTINGS])
+        feed(h, self.resources)
+        return h.hexdigest()
+
+    def digest(self):
+        h = hashlib.sha256()
+        feed(h, self.calls())
+        return h.hexdigest()
+
+    def execute(self, s, calls=None):
+        """Send <calls> (default: all) to client <s>."""
+        for name, args in self.calls() if calls is None else calls:
+            args = [getattr(s, a) if isinstance(a, ClientConstant) else a for a in args]
+            getattr(s, name)(*args)
+
+
+def _check(condition, message, *args):
+    if not condition:
+        raise ScenarioError(message % args)
+
+
+def _vector(value, n, what):
+    _check(isinstance(value, (list, tuple)) and len(value) == n and all(isinstance(v, (int, float)) for v in value),
+           "%s must be a list of %d numbers, got %r", what, n, value)
+    return tuple(float(v) for v in value)
+
+
+def _pose_calls(name, spec, what):
+    calls = []
+    if 'position' in spec:
+        calls.append(('setObjectPosition', (name, _vector(spec['position'], 3, what + ' position'))))
+    if 'attitude' in spec:
+        calls.append(('setObjectAttitude', (name, _vector(spec['attitude'], 4, what + ' attitude'))))
+    return calls
+
+
+def _setting_calls(settings, what):
+    _check(isinstance(settings, dict), "%s must be an object", what)
+    calls = []
+    for key, value in settings.items():
+        _check(key in SETTINGS, "Unknown setting %r in %s (known: %s)", key, what, ', '.join(sorted(SETTINGS)))
+        calls.append((SETTINGS[key], (value,)))
+    return calls
+
+
+def _psf_calls(spec):
+    import psf_library
+    spec = dict(spec)
+    kernel = spec.pop('kernel', 'gaussian')
+    distance = spec.pop('distance', None)
+    regular = spec.pop('regular_sampling', True)
+    if kernel == 'gaussian':
+        psf = psf_library.gaussian(int(spec.get('size', 3)), float(spec.get('sigma', 1.0)))
+        width = psf.shape[0]
+    elif kernel == 'oversampled_gaussian':
+        width = int(spec['width'])
+        psf = psf_library.oversampled_gaussian(width, float(spec.get('sigma', 1.0)), int(spec.get('factor', 10)))
+    elif kernel == 'airy':
+        width = int(spec['size'])
+        psf = psf_library.airy(width, float(spec['first_zero']), int(spec.get('factor', 1)))
+    elif kernel == 'measured':
+        psf, width = psf_library.prepare(spec['file'], int(spec.get('factor', 1)), float(spec.get('pitch', 1.0)))
+    else:
+        raise ScenarioError("Unknown PSF kernel %r" % kernel)
+    args = (np.asarray(psf), width, width) + ((int(distance),) if distance is not None else ())
+    return [('setPSF', args), ('enableRegularPSFSampling', (bool(regular),))]
+
+
+def compile_scenario(scenario):
+    """Validate <scenario> (dict) and return its Program."""
+    _check(isinstance(scenario, dict), "A scenario must be a JSON object")
+    unknown = set(scenario) - set(SECTIONS)
+    _check(not unknown, "Unknown scenario sections: %s", ', '.join(sorted(unknown)))
+    brdfs = dict(scenario.get('brdfs', {}))
+    shapes = dict(scenario.get('shapes', {}))
+    bodies = dict(scenario.get('bodies', {}))
+    sun = scenario.get('sun')
+    if sun is not None:
+        brdfs.setdefault('sun', {'file': 'sun.brdf'})
+        shapes.setdefault('sun_shape', {'file': 'sphere.shp', 'params': {'radius': sun['radius']}})
+        bodies['sun'] = {'shape': 'sun_shape', 'brdf': 'sun', 'textures': [], **{k: sun[k] for k in POSE_KEYS if k in sun}}
+    meshes = scenario.get('meshes', {})
+    dems = scenario.get('dems', {})
+
+    # Resources: identical definitions under several names are created once
+    resources, alias = [], {}
+    for kind, method, table in (('brdf', 'createBRDF', brdfs), ('shape', 'createShape', shapes)):
+        created = {}
+        for name, spec in table.items():
+            _check('file' in spec, "%s %r has no file", kind, name)
+            key = json.dumps([spec['file'], spec.get('params', {})], sort_keys=True)
+            if key in created:
+                alias[(kind, name)] = created[key]
+                continue
+            created[key] = name
+            alias[(kind, name)] = name
+            resources.append((method, (name, spec['file'], spec.get('params', {}))))
+    objects = ['camera']
+    for name, spec in bodies.items():
+        _check(('shape', spec.get('shape')) in alias, "Body %r refers to unknown shape %r", name, spec.get('shape'))
+        _check(('brdf', spec.get('brdf')) in alias, "Body %r refers to unknown BRDF %r", name, spec.get('brdf'))
+        resources.append(('createBody', (name, alias[('shape', spec['shape'])], alias[('brdf', spec['brdf'])], list(spec.get('textures', [])))))
+        objects.append(name)
+    for name, spec in meshes.items():
+        _check('file' in spec, "Mesh %r has no file", name)
+        resources.append(('createMesh', (name, spec['file'], float(spec.get('scale', 1.0)))))
+        if 'brdf' in spec:
+            _check(('brdf', spec['brdf']) in alias, "Mesh %r refers to unknown BRDF %r", name, spec['brdf'])
+            resources.append(('setObjectElementBRDF', (name, name, alias[('brdf', spec['brdf'])])))
+        objects.append(name)
+    for name, spec in dems.items():
+        _check('file' in spec and 'brdf' in spec, "DEM %r needs a file and a BRDF", name)
+        _check(('brdf', spec['brdf']) in alias, "DEM %r refers to unknown BRDF %r", name, spec['brdf'])
+        resources.append(('createSphericalDEM', (name, spec['file'], alias[('brdf', spec['brdf'])], spec.get('texture', ''))))
+        objects.append(name)
+
+    # Global settings, set before the resources are created
+    settings = []
+    if 'conventions' in scenario:
+        settings.append(('setConventions', tuple(ClientConstant(c) for c in scenario['conventions'])))
+    settings += _setting_calls(scenario.get('settings', {}), 'settings')
+
+    # Initial state
+    state = []
+    if sun is not None and 'power' in sun:
+        state.append(('setSunPower', (np.array(_vector(sun['power'], 4, 'sun power')),)))
+    camera = scenario.get('camera', {})
+    if 'fov_deg' in camera:
+        state.append(('setCameraFOVDeg', _vector(camera['fov_deg'], 2, 'camera fov_deg')))
+    if 'image_size' in camera:
+        state.append(('setImageSize', tuple(int(v) for v in camera['image_size'])))
+    if 'psf' in scenario:
+        state += _psf_calls(scenario['psf'])
+    if 'star_map' in scenario:
+        state.append(('setBackground', (scenario['star_map'],)))
+    state += _pose_calls('camera', camera, 'camera')
+    for name in objects[1:]:
+        spec = bodies.get(name) or meshes.get(name) or dems.get(name)
+        state += _pose_calls(name, spec, name)
+
+    # Frames: only the setters changing the current value
+    current = {}
+    for call in settings + state:
+        current[_state_key(call)] = call[1]
+    frames = []
+    for index, frame in enumerate(scenario.get('trajectory', [{}])):
+        calls = _setting_calls(frame.get('settings', {}), 'frame %d settings' % index)
+        for name, spec in frame.get('objects', {}).items():
+            _check(name in objects, "Frame %d moves unknown object %r", index, name)
+            calls += _pose_calls(name, spec, 'frame %d %s' % (index, name))
+        delta = []
+        for call in calls:
+            key = _state_key(call)
+            if key not in current or not _same(current[key], call[1]):
+                current[key] = call[1]
+                delta.append(call)
+        frames.append(delta)
+    return Program(scenario.get('name', ''), settings, resources, state, frames)
+
+
+def _state_key(call):
+    name, args = call
+    return (name, args[0]) if name in ('setObjectPosition', 'setObjectAttitude') else (name,)
+
+
+def _same(a, b):
+    h1, h2 = hashlib.sha256(), hashlib.sha256()
+    feed(h1, a)
+    feed(h2, b)
+    return h1.digest() == h2.digest()
+
+
+def load(path):
+    with open(path, 'r') as f:
+        return compile_scenario(json.load(f))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', help='Scenario JSON file')
+    parser.add_argument('--trace', default=None, help='Write the compiled calls to this binary trace (replay_trace.py)')
+    parser.add_argument('--run', action='store_true', help='Send the compiled calls to a server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5151)
+    args = parser.parse_args(argv)
+
+    program = load(args.scenario)
+    calls = program.calls()
+    print('%s: %d settings, %d resources, %d state calls, %d frames, %d calls'
+          % (program.name or args.scenario, len(program.settings), len(program.resources), len(program.state),
+             len(program.frames), len(calls)))
+    print('resources %s, program %s' % (program.resource_digest()[:16], program.digest()[:16]))
+    if args.trace:
+        from replay_trace import TraceWriter
+        with TraceWriter(args.trace) as writer:
+            for name, call_args in calls:
+                writer.call(name, call_args, {})
+    if args.run:
+        from surrender.surrender_client import surrender_client
+        s = surrender_client()
+        s.connectToServer(args.host, args.port)
+        program.execute(s)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
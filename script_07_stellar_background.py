@@ -9,6 +9,7 @@ import os
 import sys
 from surrender.surrender_client import surrender_client
 import numpy as np
+import psf_library
 from PIL import Image
 import matplotlib.pyplot as plot
 
@@ -79,10 +80,7 @@ if __name__ == "__main__":
 
   #--[PSF definition]---------------------
   PSFsize=3
-  psf = np.array(range(PSFsize))-int(PSFsize/2)
-  psf = np.meshgrid(psf,psf)
-  psf = np.exp(-(psf[0]*psf[0] + psf[1]*psf[1]) / 2.)
-  psf = psf / np.sum(psf)
+  psf = psf_library.gaussian(PSFsize)
   lin,col=psf.shape
   dist=int(max(lin,col)/2)+2
 
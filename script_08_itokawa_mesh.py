@@ -6,8 +6,11 @@
  (C) 2019 Airbus copyright all rights reserved
 """
 from surrender.surrender_client import surrender_client
-from surrender.geometry import vec3, vec4, quat, normalize, QuatToMat, MatToQuat, gaussian
+from surrender.geometry import vec3, vec4, quat, normalize, QuatToMat, MatToQuat
+import os
 import numpy as np
+import psf_library
+import mesh_lod
 import cv2
 
 # Constants:
@@ -22,12 +25,13 @@ pos_target = vec3(0,0,1e4)
 fov=5
 raytracing=True
 N = [768, 1024]
+meshLOD = os.environ.get('MESH_LOD') # LOD manifest of mesh_lod.py (e.g. 'itokawa_f3145728_lod.json'), unset for the full resolution mesh
 
 # set PSF
 surech_PSF=10
 sigma = 1
 wPSF = 5
-PSF = gaussian(wPSF * surech_PSF, sigma * surech_PSF)
+PSF = psf_library.oversampled_gaussian(wPSF, sigma, surech_PSF)
 
 ## Initializing SurRender
 s = surrender_client()
@@ -66,15 +70,22 @@ s.createBody('sun', 'sun', 'sun', [])
 s.setSunPower(8*ua*ua*pi*5.2*5.2*vec4(1,1,1,1))
 
 s.createBRDF('hapke', 'hapke.brdf', {})
-s.createMesh('asteroid', 'itokawa_f3145728.obj', 1e3)
-s.setObjectElementBRDF('asteroid', 'asteroid', 'hapke')
+if meshLOD:
+    # Level chosen at each frame from the range of the asteroid
+    asteroid = mesh_lod.LODMesh(s, 'asteroid', mesh_lod.load_levels(meshLOD), fov, N[0], 1e3, 'hapke')
+else:
+    s.createMesh('asteroid', 'itokawa_f3145728.obj', 1e3)
+    s.setObjectElementBRDF('asteroid', 'asteroid', 'hapke')
 
 s.setCameraFOVDeg(fov, np.arctan(np.tan(fov/360*pi)*N[1]/N[0])*360/pi)
 s.setImageSize(N[0],N[1])
 
 def gen_image(alpha, beta):
     Rcam = np.eye(3)
-    s.setObjectPosition('camera', vec3(0,0,0))
+    pos_camera = vec3(0,0,0)
+    if meshLOD:
+        asteroid.update(np.linalg.norm(pos_target - pos_camera))
+    s.setObjectPosition('camera', pos_camera)
     s.setObjectAttitude('camera', MatToQuat(Rcam))
     s.setObjectPosition('sun', pos_sun)
     s.setObjectPosition('asteroid', pos_target)
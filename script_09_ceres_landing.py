@@ -6,11 +6,13 @@
  (C) 2019 Airbus copyright all rights reserved
 """
 from surrender.surrender_client import surrender_client
-from surrender.geometry import vec3, vec4, quat, normalize, QuatToMat, MatToQuat, gaussian
+from surrender.geometry import vec3, vec4, quat, normalize, QuatToMat, MatToQuat
 import numpy as np
+import psf_library
 import matplotlib.pyplot as plot
 import cv2
 from PIL import Image
+from adaptive_sampling import AdaptiveSampler
 
 # Constants:
 sun_radius = 696342000
@@ -26,12 +28,14 @@ fov=5;
 raytracing=True;
 N = [512,512];
 rays = 16;
+# Target relative noise: when set, the samples per pixel are adapted frame by frame
+adaptiveNoise = None;
 
 # set PSF
 surech_PSF=10;
 sigma = 1;
 wPSF = 5;
-PSF = gaussian(wPSF * surech_PSF, sigma * surech_PSF);
+PSF = psf_library.oversampled_gaussian(wPSF, sigma, surech_PSF);
 
 ## Initializing SurRender
 s = surrender_client();
@@ -76,6 +80,9 @@ s.setImageSize(N[0],N[1]);
 
 s.setSunPower(10*ua*ua*pi*5.2*5.2*vec4(1,1,1,1));
 
+if adaptiveNoise:
+    sampler = AdaptiveSampler(s, adaptiveNoise, samples=rays, log_file='images/ceres_sampling.csv');
+
 ## Trajectory
 def gen_image(alpha, dist):
     Rcam = np.eye(3);
@@ -90,8 +97,11 @@ def gen_image(alpha, dist):
     R_ast = QuatToMat(quat(vec3(0,1,0), -alpha-pi/3)) @ R_ast;
     s.setObjectAttitude('asteroid', MatToQuat(R_ast));
    
-    s.render();	
-    im = s.getImageGray32F();
+    if adaptiveNoise:
+        im = sampler.render();
+    else:
+        s.render();	
+        im = s.getImageGray32F();
     
     ## Color
     imageRGBA = s.getImageRGBA8()
@@ -108,10 +118,17 @@ def gen_image(alpha, dist):
     plot.pause(0.01)   
 
 
-for it in range(0,359,1):
-    angle = it / 360 * pi; # 1 degr steps
-    dist = Rceres*(40-it/360*39);
-    gen_image(angle, dist)
-    print(str(round(it/360*100))+'%: '+ ' #'+str(it)+' -> '+str(round(dist/1000))+' km')
+try:
+    for it in range(0,359,1):
+        angle = it / 360 * pi; # 1 degr steps
+        dist = Rceres*(40-it/360*39);
+        gen_image(angle, dist)
+        print(str(round(it/360*100))+'%: '+ ' #'+str(it)+' -> '+str(round(dist/1000))+' km')
+finally:
+    if adaptiveNoise:
+        sampler.close()
 
+if adaptiveNoise:
+    frames, renderTime, meanNoise = sampler.summary()
+    print('%d frames rendered in %.1f s, mean relative noise %.3g' % (frames, renderTime, meanNoise))
 print(' End of simulation')
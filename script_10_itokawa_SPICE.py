@@ -5,30 +5,22 @@
  Script : SCR_10 Simulate Itokawa images taken from the PDS with SPICE data
 """
 from surrender.surrender_client import surrender_client
-from surrender.geometry import vec3, vec4, quat, normalize, QuatToMat, MatToQuat, gaussian
+from surrender.geometry import vec3, vec4, quat, normalize, QuatToMat, MatToQuat
 import numpy as np
+import psf_library
 import os
-import spiceypy 
 import cv2
 from PIL import Image
-import matplotlib.pyplot as plot
 import ntpath
 import urllib.request
 from bs4 import BeautifulSoup
 import sys
 import errno
-from astropy.io import fits
-
-def getKernels(p, d, e):
-	base = os.path.join(p, d)
-	return [os.path.join(base, f) for f in os.listdir(base) if f.endswith(e)]
-
-
-def getImageTime(file):
-	with open(file, 'r') as f:
-		lines = f.readlines()
-	startTimeLine = [l for l in lines if l.startswith('START_TIME')][0]
-	return startTimeLine.split('=')[-1].strip()
+from spice_ephemeris import load_or_sample_ephemeris
+from pds_index import LabelIndex
+from amica_compare import ComparisonPool
+from pose_interpolation import frame_times, interpolate_ephemeris
+from spice_cache import KernelCache
     
 def mkdir_p(path):
     try:
@@ -42,10 +34,12 @@ def mkdir_p(path):
 # Directory where to store images and kernels
 imagesDir = "imagesItokawaPDS"
 spiceDir = "dataSPICE"
+cacheDir = "cacheSPICE_PDS"
 outputDir = "imagesItokawaPDS_SurRender"
 pathScript = os.path.dirname(os.path.abspath(__file__))
 imagesDir = os.path.join(pathScript,imagesDir)
 spiceDir = os.path.join(pathScript,spiceDir)
+cacheDir = os.path.join(pathScript,cacheDir)
 outputDir = os.path.join(pathScript,outputDir)
 mkdir_p(imagesDir)
 mkdir_p(spiceDir)
@@ -56,35 +50,43 @@ URL_images ='https://sbnarchive.psi.edu/pds3/hayabusa/HAY_A_AMICA_3_HAYAMICA_V1_
 source = 'naif.jpl.nasa.gov/pub/naif/pds/data/hay-a-spice-6-v1.0/haysp_1000/data/'
 URL_dataSPICE = 'ftp://' + source
 
-# Download SPICE data with wget. This command requires 10 minutes comment it if you have already the SPICE kernels 
-cmdToExecute = 'wget -r --no-parent --reject "index.html*" ' + URL_dataSPICE +' -P ' + spiceDir
-os.system(cmdToExecute)
+# Set offline to True to run without network: kernels and images are then taken from the local cache
+# (an existing local copy of the SPICE archive in spiceDir is ingested on first use)
+offline = False
+cache = KernelCache(cacheDir, offline)
 
-# Download PDS data
+# Download SPICE data with wget into the cache. This command requires 10 minutes and is only run when the cache is empty
+cache.mirror(URL_dataSPICE, spiceDir)
+
+# Download PDS data (products already in the cache are not downloaded again)
 # We decided to plot only "v" (green) images (see Ishiguro, Masateru, et al. 
 # "The hayabusa spacecraft asteroid multi-band imaging camera (AMICA)." Icarus 207.2 (2010): 714-731. 
 # for nomenclature)
-urlpath =urllib.request.urlopen(URL_images)
-soup = BeautifulSoup(urlpath.read(), "lxml")
 filterAMICA = "_v"
-for element in soup.findAll('a'):
-	if filterAMICA in element.get('href'):
-		urllib.request.urlretrieve(URL_images+element.get('href'), os.path.join(imagesDir,element.get('href')))
-		print("Downloaded: " + element.get('href'))
-
-spiceDir = os.path.join(spiceDir, source)
-
-kFiles = getKernels(spiceDir, 'ck', '.bc')
-kFiles += getKernels(spiceDir, 'fk', '.tf')
-kFiles += getKernels(spiceDir, 'ik', '.ti')
-kFiles += getKernels(spiceDir, 'lsk', '.tls')
-kFiles += getKernels(spiceDir, 'pck', '.tpc')
-kFiles += getKernels(spiceDir, 'lsk', '.tls')
-kFiles += getKernels(spiceDir, 'sclk', '.tsc')
-kFiles += getKernels(spiceDir, 'spk', '.bsp')
-spiceypy.furnsh(kFiles)
-
-iFiles = [os.path.join(imagesDir,f) for f in os.listdir(imagesDir) if f.endswith(filterAMICA + '.lbl')]
+if offline:
+	products = [ntpath.basename(url) for url in cache.cached_sources(URL_images)]
+else:
+	urlpath =urllib.request.urlopen(URL_images)
+	soup = BeautifulSoup(urlpath.read(), "lxml")
+	products = [element.get('href') for element in soup.findAll('a')]
+for product in products:
+	if filterAMICA in product:
+		cache.fetch(URL_images+product, os.path.join(imagesDir,product))
+		print("Available: " + product)
+
+# Index of the PDS labels (only new or modified labels are parsed), images are processed in chronological order
+index = LabelIndex(os.path.join(imagesDir, 'index.npy'))
+index.update(imagesDir)
+frames = index.select(match=filterAMICA + '.lbl')
+iFiles = [os.path.join(imagesDir,f) for f in frames['file']]
+iTimes = frames['start_time']
+
+# Only the kernels covering the image epochs are furnished
+cache.furnish(iTimes)
+
+# Ephemeris of all images, evaluated once and cached (camera and sun positions in m, SurRender camera attitude)
+ephemeris = load_or_sample_ephemeris(os.path.join(outputDir, 'ephemeris.npz'), iFiles, iTimes,
+                                     observer='HAYABUSA', center='ITOKAWA', frame='ITOKAWA_FIXED', camera_frame='HAYABUSA_AMICA')
 
 # Constants:
 sun_radius = 696342000
@@ -96,12 +98,14 @@ pi = np.pi
 fov=5.8
 raytracing=True
 ImageSize = [1024 , 1024]
+# Frames per second of mission time of an additional sequence interpolated between the image epochs (None: disabled)
+videoFrameRate = None
 
 # set PSF
 surech_PSF=10
 sigma = 1
 wPSF = 5
-PSF = gaussian(wPSF * surech_PSF, sigma * surech_PSF)
+PSF = psf_library.oversampled_gaussian(wPSF, sigma, surech_PSF)
 
 ## Initializing SurRender
 s = surrender_client()
@@ -148,45 +152,31 @@ s.setCameraFOVDeg(fov, np.arctan(np.tan(fov/360*pi)*ImageSize[1]/ImageSize[0])*3
 s.setImageSize(ImageSize[0],ImageSize[1])
 
 
-fig=plot.figure()
-for p in iFiles:
-	
-	# getting positions and quaternion in the camera frame
-	et1Str = getImageTime(p)
-	target = 'HAYABUSA'
-	et1 = spiceypy.utc2et(et1Str)
-	frame = 'ITOKAWA_FIXED'
-	center = 'ITOKAWA'
-	state1 = spiceypy.spkezr(target, spiceypy.utc2et(et1Str), frame, 'none', center)[0]
-	stateSun = spiceypy.spkezr('SUN', spiceypy.utc2et(et1Str), frame, 'none', center)[0]
-	frame2 = 'HAYABUSA_AMICA'
-	frame1 = 'ITOKAWA_FIXED'
-	rot1 = spiceypy.pxform(frame1, frame2, et1)
-	quat1 = spiceypy.m2q(rot1)
-
-	# SPICE data are in km
-	s.setObjectPosition('camera', vec3(state1[0]*1000,state1[1]*1000,state1[2]*1000));
-
-	# opposite convetion is used between SurRender and JPL
-	s.setObjectAttitude('camera', vec4(quat1[0],-quat1[1],-quat1[2],-quat1[3]));
-
-	# SPICE data are in km
-	s.setObjectPosition('sun', vec3(stateSun[0]*1000,stateSun[1]*1000,stateSun[2]*1000));
-	s.setObjectPosition('asteroid', vec3(0,0,0));
+# Simulated images are compared to the real ones in worker processes while rendering goes on
+comparison = ComparisonPool(os.path.join(outputDir, 'comparison.csv'))
+s.setObjectPosition('asteroid', vec3(0,0,0));
+for i, p in enumerate(iFiles):
+	s.setObjectPosition('camera', ephemeris['cam_pos'][i]);
+	s.setObjectAttitude('camera', ephemeris['cam_quat'][i]);
+	s.setObjectPosition('sun', ephemeris['sun_pos'][i]);
 	s.printState(s.getState())
 	s.render();	
 	im = s.getImageGray32F();
 	imgName = os.path.splitext(ntpath.basename(p))[0] + '.png'
 	cv2.imwrite(os.path.join(outputDir,imgName),np.array(np.clip(im * (255 / np.max(im)), 0, 255), dtype=np.uint8))
-	
-	image_file = os.path.splitext(p)[0] + '.fit'
-	image_data = fits.getdata(image_file, ext=0)
-	
-	fig.add_subplot(1, 2, 1)
-	plot.imshow(im, aspect='equal', interpolation='none', cmap='gray');
-	fig.add_subplot(1, 2, 2)
-	plot.imshow(image_data,  aspect='equal', interpolation='none', cmap='gray');
-	plot.draw()
-	plot.pause(0.5)   
-	
+	comparison.submit(ntpath.basename(p), im, os.path.splitext(p)[0] + '.fit')
+
+for row in comparison.close():
+	print('%s: NCC %.3f, limb offset %.1f px, brightness ratio %.3f' % (row['name'], row['ncc'], row['limb_offset'], row['brightness']))
+# Dense sequence from the sparse ephemeris (Hermite positions, SQUAD attitudes), without extra SPICE calls
+if videoFrameRate and len(iFiles) > 1:
+	video = interpolate_ephemeris(ephemeris, frame_times(ephemeris['et'][0], ephemeris['et'][-1], videoFrameRate))
+	for i in range(len(video['et'])):
+		s.setObjectPosition('camera', video['cam_pos'][i]);
+		s.setObjectAttitude('camera', video['cam_quat'][i]);
+		s.setObjectPosition('sun', video['sun_pos'][i]);
+		s.render();
+		im = s.getImageGray32F();
+		cv2.imwrite(os.path.join(outputDir,'video_%06d.png' % i),np.array(np.clip(im * (255 / np.max(im)), 0, 255), dtype=np.uint8))
+
 print(' End of simulation')
@@ -0,0 +1,104 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Vectorized image sensor model
+
+ Float images of the server (e.g. getImageSpectrumProjection, or any getter in
+ irradiance mode) are converted to digital numbers on the client side, so that
+ one render feeds any number of sensor configurations:
+     e-   = Poisson((signal * responsivity * PRNU + dark current * DSNU) * t) + N(0, read noise)
+     DN   = clip(round(min(e-, full well) * gain + offset), 0, 2^bits - 1)
+ PRNU and DSNU are fixed patterns (relative standard deviations) drawn once per
+ image shape from <seed>. simulate() broadcasts over gains, integration times
+ and frames: the result has shape gain.shape + integration_time.shape + image.shape.
+ Example:
+   sensor = SensorModel(responsivity=2e12, read_noise=5, bits=12)
+   dn = sensor.simulate(s.getImageSpectrumProjection(), integration_time=0.2, gain=[0.5, 1, 2])
+"""
+import numpy as np
+
+
+class SensorModel:
+    """
+    <responsivity>: electrons per second per unit of the image, <dark_current>: e-/s, <read_noise>: e- RMS,
+    <prnu>, <dsnu>: relative standard deviations of the photo-response and dark current, <gain>: DN per e-,
+    <offset>: DN, <full_well>: e- (None: no saturation), <bits>: ADC resolution.
+    """
+
+    def __init__(self, responsivity=1.0, dark_current=0.0, read_noise=0.0, prnu=0.0, dsnu=0.0, gain=1.0, offset=0.0,
+                 full_well=None, bits=12, integration_time=1.0, seed=0):
+        self.responsivity = responsivity
+        self.dark_current = dark_current
+        self.read_noise = read_noise
+        self.prnu = prnu
+        self.dsnu = dsnu
+        self.gain = gain
+        self.offset = offset
+        self.full_well = full_well
+        self.bits = bits
+        self.integration_time = integration_time
+        self.seed = seed
+        self._patterns = {}
+
+    def fixed_pattern(self, shape):
+        """(PRNU, DSNU) multiplicative maps of image <shape>, identical for every frame."""
+        patterns = self._patterns.get(shape)
+        if patterns is None:
+            rng = np.random.default_rng(self.seed)
+            prnu = 1 + self.prnu * rng.standard_normal(shape) if self.prnu else np.ones(shape)
+            dsnu = np.maximum(1 + self.dsnu * rng.standard_normal(shape), 0) if self.dsnu else np.ones(shape)
+            patterns = self._patterns[shape] = (prnu, dsnu)
+        return patterns
+
+    def mean_electrons(self, image, integration_time=None):
+        """Expected electrons of <image> (..., H, W) for <integration_time> (broadcast in front of the image axes)."""
+        image = np.asarray(image, dtype=np.float64)
+        t = _outer(self.integration_time if integration_time is None else integration_time, image.ndim)
+        prnu, dsnu = self.fixed_pattern(image.shape[-2:])
+        return (image * (self.responsivity * prnu) + self.dark_current * dsnu) * t
+
+    def simulate(self, image, integration_time=None, gain=None, noise=True, rng=None):
+        """
+        Digital numbers (uint8/uint16) of <image> for each <gain> and <integration_time> (scalars or arrays).
+        Without <noise>, the expected values are returned as float (no shot or read noise, no quantization).
+        """
+        image = np.asarray(image, dtype=np.float64)
+        electrons = self.mean_electrons(image, integration_time)
+        gain = np.asarray(self.gain if gain is None else gain, dtype=np.float64)
+        gain = gain.reshape(gain.shape + (1,) * electrons.ndim)
+        if not noise:
+            if self.full_well is not None:
+                electrons = np.minimum(electrons, self.full_well)
+            return np.clip(electrons * gain + self.offset, 0, 2 ** self.bits - 1)
+
+        rng = rng if rng is not None else np.random.default_rng()
+        # Each gain setting is an independent exposure: noise is drawn for the broadcast shape
+        shape = gain.shape[:gain.ndim - electrons.ndim] + electrons.shape
+        electrons = rng.poisson(np.broadcast_to(np.maximum(electrons, 0), shape)).astype(np.float64)
+        if self.read_noise:
+            electrons += rng.normal(0.0, self.read_noise, shape)
+        if self.full_well is not None:
+            np.minimum(electrons, self.full_well, out=electrons)
+        dn = np.rint(electrons * gain + self.offset)
+        np.clip(dn, 0, 2 ** self.bits - 1, out=dn)
+        return dn.astype(np.uint8 if self.bits <= 8 else np.uint16 if self.bits <= 16 else np.uint32)
+
+    def saturation_level(self, gain=None):
+        """Digital number of a saturated pixel (full well or ADC range, the lowest) for each <gain>."""
+        gain = np.asarray(self.gain if gain is None else gain, dtype=np.float64)
+        level = np.full(gain.shape, 2 ** self.bits - 1, dtype=np.float64)
+        if self.full_well is not None:
+            level = np.minimum(level, np.clip(np.rint(self.full_well * gain + self.offset), 0, 2 ** self.bits - 1))
+        return level
+
+    def snr(self, image, integration_time=None):
+        """Expected signal to noise ratio per pixel (shot, dark and read noise)."""
+        signal = self.mean_electrons(image, integration_time) - self.mean_electrons(np.zeros_like(image), integration_time)
+        return signal / np.sqrt(self.mean_electrons(image, integration_time) + self.read_noise ** 2)
+
+
+def _outer(value, ndim):
+    """<value> as an array with <ndim> trailing singleton axes, to broadcast in front of images of <ndim> dimensions."""
+    value = np.asarray(value, dtype=np.float64)
+    return value.reshape(value.shape + (1,) * ndim)
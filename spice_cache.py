@@ -0,0 +1,213 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Local content-addressed cache for SPICE kernels and PDS products
+
+ Files are stored once under <root>/objects/ by SHA-256 and described in
+ <root>/manifest.json (kernel type, coverage interval in ET seconds, size and
+ the sources they were obtained from). Scripts resolve kernels against the
+ manifest and only furnish the ones covering the requested epochs; the cache
+ also works fully offline once populated, or from an existing local directory.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import urllib.request
+import spiceypy
+
+# Kernel type from file extension
+KERNEL_TYPES = {
+    '.bc': 'ck',
+    '.tf': 'fk',
+    '.ti': 'ik',
+    '.tls': 'lsk',
+    '.tpc': 'pck',
+    '.bpc': 'pck',
+    '.tsc': 'sclk',
+    '.bsp': 'spk',
+}
+# Furnishing order: time conversion kernels first, then frames/instruments, then time-bound data
+FURNISH_ORDER = ('lsk', 'sclk', 'fk', 'ik', 'pck', 'spk', 'ck')
+# Kernel types that carry a coverage interval (others are always furnished)
+TIME_BOUND_TYPES = ('spk', 'ck')
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class KernelCache:
+    """Content-addressed store of SPICE kernels and PDS products, described by a JSON manifest."""
+
+    def __init__(self, root, offline=False):
+        self.root = root
+        self.offline = offline
+        self.manifest_file = os.path.join(root, 'manifest.json')
+        self.objects = {}  # sha256 -> entry
+        self.sources = {}  # url or original path -> sha256
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+            self.objects = manifest['objects']
+            self.sources = manifest['sources']
+
+    def save(self):
+        tmp = self.manifest_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'objects': self.objects, 'sources': self.sources}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_file)
+
+    def object_path(self, sha):
+        entry = self.objects[sha]
+        return os.path.join(self.root, 'objects', sha[:2], sha + entry['ext'])
+
+    def kernels(self, kind=None):
+        """Return the manifest entries of all cached kernels (optionally of a single type)."""
+        return {sha: e for sha, e in self.objects.items() if e['kind'] is not None and (kind is None or e['kind'] == kind)}
+
+    #-----------------------------------------------------------------------
+    # Ingestion
+    #-----------------------------------------------------------------------
+    def add(self, path, source=None, move=False):
+        """Store <path> in the cache and return its hash. <source> (default: <path>) is recorded in the manifest."""
+        ext = os.path.splitext(path)[1].lower()
+        sha = file_sha256(path)
+        if sha not in self.objects:
+            self.objects[sha] = {
+                'name': os.path.basename(path),
+                'ext': ext,
+                'kind': KERNEL_TYPES.get(ext),
+                'size': os.path.getsize(path),
+                'start': None,
+                'stop': None,
+            }
+            dest = self.object_path(sha)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if move:
+                shutil.move(path, dest)
+            else:
+                shutil.copyfile(path, dest)
+        elif move:
+            os.remove(path)
+        self.sources[source or os.path.abspath(path)] = sha
+        return sha
+
+    def add_directory(self, directory, extensions=tuple(KERNEL_TYPES)):
+        """Recursively ingest all files of <directory> with one of <extensions> (SPICE kernels by default)."""
+        added = []
+        for base, _, files in os.walk(directory):
+            for f in sorted(files):
+                if os.path.splitext(f)[1].lower() in extensions:
+                    added.append(self.add(os.path.join(base, f)))
+        self.update_coverage()
+        self.save()
+        return added
+
+    def mirror(self, url, staging_dir):
+        """
+        Populate the cache with the kernels of a remote archive (wget recursive download into <staging_dir>).
+        Nothing is downloaded when the cache already holds kernels, or in offline mode, where <staging_dir>
+        is ingested as a local directory instead.
+        """
+        if not self.kernels():
+            if not self.offline:
+                os.system('wget -r -nc --no-parent --reject "index.html*" ' + url + ' -P ' + staging_dir)
+            if os.path.isdir(staging_dir):
+                self.add_directory(staging_dir)
+        return self.kernels()
+
+    def fetch(self, url, dest=None):
+        """
+        Return the cached path of the product at <url>, downloading it only if it is not cached yet.
+        With <dest>, the product is also materialized there (hard link when possible).
+        """
+        sha = self.sources.get(url)
+        if sha is None or not os.path.isfile(self.object_path(sha)):
+            if self.offline:
+                raise FileNotFoundError("%s is not in the cache (offline mode)" % url)
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=os.path.splitext(url)[1])
+            os.close(fd)
+            urllib.request.urlretrieve(url, tmp)
+            sha = self.add(tmp, source=url, move=True)
+            self.objects[sha]['name'] = os.path.basename(url)
+            self.save()
+        path = self.object_path(sha)
+        if dest is not None and not os.path.isfile(dest):
+            try:
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+        return path
+
+    def cached_sources(self, prefix):
+        """Return the cached sources (e.g. URLs) starting with <prefix>."""
+        return sorted(src for src in self.sources if src.startswith(prefix))
+
+    #-----------------------------------------------------------------------
+    # Coverage and resolution
+    #-----------------------------------------------------------------------
+    def update_coverage(self):
+        """Compute the coverage interval (ET seconds) of SPK and CK kernels that do not have one yet."""
+        pending = [sha for sha, e in self.kernels().items() if e['kind'] in TIME_BOUND_TYPES and e['start'] is None]
+        if not pending:
+            return
+        # CK coverage is expressed in SCLK ticks, conversion to ET needs leapseconds and clock kernels
+        support = [self.object_path(sha) for kind in ('lsk', 'sclk') for sha in self.kernels(kind)]
+        spiceypy.furnsh(support)
+        try:
+            for sha in pending:
+                intervals = self._coverage(self.object_path(sha), self.objects[sha]['kind'])
+                if intervals:
+                    self.objects[sha]['start'] = min(i[0] for i in intervals)
+                    self.objects[sha]['stop'] = max(i[1] for i in intervals)
+        finally:
+            for k in support:
+                spiceypy.unload(k)
+
+    @staticmethod
+    def _coverage(path, kind):
+        intervals = []
+        if kind == 'spk':
+            for obj in spiceypy.spkobj(path):
+                cover = spiceypy.spkcov(path, obj)
+                intervals += [spiceypy.wnfetd(cover, i) for i in range(spiceypy.wncard(cover))]
+        elif kind == 'ck':
+            for obj in spiceypy.ckobj(path):
+                cover = spiceypy.ckcov(path, obj, False, 'INTERVAL', 0.0, 'TDB')
+                intervals += [spiceypy.wnfetd(cover, i) for i in range(spiceypy.wncard(cover))]
+        return intervals
+
+    def resolve(self, et_start, et_stop):
+        """Return the kernel paths needed for epochs in [<et_start>, <et_stop>], in furnishing order."""
+        selected = []
+        for kind in FURNISH_ORDER:
+            for sha, e in sorted(self.kernels(kind).items(), key=lambda item: item[1]['name']):
+                if kind in TIME_BOUND_TYPES:
+                    if e['start'] is None or e['stop'] < et_start or e['start'] > et_stop:
+                        continue
+                selected.append(self.object_path(sha))
+        return selected
+
+    def furnish(self, utc_times):
+        """Furnish the kernels covering all <utc_times> and return the list of furnished files."""
+        lsk = [self.object_path(sha) for sha in self.kernels('lsk')]
+        if not lsk:
+            raise FileNotFoundError("No leapseconds kernel in cache %s" % self.root)
+        spiceypy.furnsh(lsk)
+        utc_times = list(utc_times)
+        if not utc_times:
+            return lsk
+        et = spiceypy.str2et(utc_times)
+        kernels = [k for k in self.resolve(min(et), max(et)) if k not in lsk]
+        spiceypy.furnsh(kernels)
+        return lsk + kernels
@@ -0,0 +1,125 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : SPICE ephemeris precomputation for PDS image sequences
+
+ All epochs of an image sequence are converted and evaluated up front, so that
+ a render loop only has to push poses to the server. Positions are returned in
+ meters and attitudes in the SurRender quaternion convention (scalar first,
+ conjugated with respect to the JPL convention).
+"""
+import os
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import spiceypy
+
+# Fields stored in an ephemeris table (and in its .npz cache)
+EPHEMERIS_FIELDS = ('keys', 'utc', 'et', 'cam_pos', 'cam_vel', 'sun_pos', 'cam_quat')
+
+
+def read_start_time(file):
+    """Return the START_TIME value of a PDS3 label file."""
+    with open(file, 'r') as f:
+        for line in f:
+            if line.startswith('START_TIME'):
+                return line.split('=')[-1].strip()
+    raise ValueError("No START_TIME in label %s" % file)
+
+
+def read_start_times(files, workers=8):
+    """Return the START_TIME of every label of <files> (labels are read concurrently)."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_start_time, files))
+
+
+def loaded_kernels():
+    """Return the list of kernel files currently furnished in the SPICE kernel pool."""
+    return [spiceypy.kdata(i, 'ALL')[0] for i in range(spiceypy.ktotal('ALL'))]
+
+
+def _furnish(kernels):
+    spiceypy.furnsh(kernels)
+
+
+def _attitudes(from_frame, to_frame, et):
+    return np.array([spiceypy.m2q(spiceypy.pxform(from_frame, to_frame, t)) for t in et])
+
+
+def sample_attitudes(from_frame, to_frame, et, workers=1):
+    """
+    Return the SPICE quaternions of the rotation <from_frame> -> <to_frame> at every epoch of <et>.
+    pxform is not vectorized and CSPICE is not thread safe, so with <workers> > 1 the epochs are
+    split across worker processes which furnish the same kernels as the caller.
+    """
+    et = np.asarray(et, dtype=np.float64)
+    if workers <= 1 or len(et) < 2 * workers:
+        return _attitudes(from_frame, to_frame, et).reshape(-1, 4)
+    chunks = np.array_split(et, workers)
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_furnish, initargs=(loaded_kernels(),)) as pool:
+        parts = pool.map(_attitudes, [from_frame] * workers, [to_frame] * workers, chunks)
+        return np.concatenate(list(parts))
+
+
+def sample_ephemeris(keys, utc_times, observer='HAYABUSA', center='ITOKAWA', frame='ITOKAWA_FIXED',
+                     camera_frame='HAYABUSA_AMICA', workers=1):
+    """
+    Evaluate camera state, sun position and camera attitude at all <utc_times>.
+    <keys> identifies each epoch (e.g. the label file name) and is stored alongside the results.
+    Returns a dictionary of arrays indexed like <keys> (see EPHEMERIS_FIELDS).
+    """
+    utc_times = list(utc_times)
+    if len(utc_times) == 0:
+        return empty_ephemeris()
+
+    # spiceypy vectorizes str2et, spkezr and spkpos over iterables of epochs
+    et = np.atleast_1d(np.asarray(spiceypy.str2et(utc_times), dtype=np.float64))
+    states = np.asarray(spiceypy.spkezr(observer, et, frame, 'NONE', center)[0]).reshape(-1, 6)
+    sun = np.asarray(spiceypy.spkpos('SUN', et, frame, 'NONE', center)[0]).reshape(-1, 3)
+    q = sample_attitudes(frame, camera_frame, et, workers)
+
+    # SPICE data are in km, and the opposite quaternion convention is used between SurRender and JPL
+    q[:, 1:] = -q[:, 1:]
+    return {
+        'keys': np.asarray(keys, dtype=str),
+        'utc': np.asarray(utc_times, dtype=str),
+        'et': et,
+        'cam_pos': states[:, :3] * 1000,
+        'cam_vel': states[:, 3:] * 1000,
+        'sun_pos': sun * 1000,
+        'cam_quat': q,
+    }
+
+
+def empty_ephemeris():
+    return {
+        'keys': np.zeros(0, dtype=str),
+        'utc': np.zeros(0, dtype=str),
+        'et': np.zeros(0),
+        'cam_pos': np.zeros((0, 3)),
+        'cam_vel': np.zeros((0, 3)),
+        'sun_pos': np.zeros((0, 3)),
+        'cam_quat': np.zeros((0, 4)),
+    }
+
+
+def load_or_sample_ephemeris(cache_file, keys, utc_times, **kwargs):
+    """
+    Same as sample_ephemeris, but the result is cached to <cache_file> (.npz).
+    The cache is reused as long as the epochs, the sampling parameters and the furnished kernels are unchanged.
+    """
+    keys = np.asarray(keys, dtype=str)
+    utc_times = np.asarray(list(utc_times), dtype=str)
+    signature = np.asarray(sorted(loaded_kernels()) + ['%s=%s' % kv for kv in sorted(kwargs.items()) if kv[0] != 'workers'], dtype=str)
+
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as cache:
+            if np.array_equal(cache['keys'], keys) and np.array_equal(cache['utc'], utc_times) \
+                    and np.array_equal(cache['signature'], signature):
+                return {f: cache[f] for f in EPHEMERIS_FIELDS}
+
+    ephemeris = sample_ephemeris(keys, utc_times, **kwargs)
+    np.savez(cache_file, signature=signature, **ephemeris)
+    return ephemeris
@@ -0,0 +1,244 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : profiling proxy of surrender_client
+
+ Every client call is timed and recorded with:
+ - call count and total time per method,
+ - latency histogram per method (power of 2 bins in microseconds),
+ - payload size (bytes of the arguments sent and of the result received),
+ - script time between two calls (time spent in the Python code of the script).
+ At exit, <prefix>.trace.json (Chrome trace, open with chrome://tracing or
+ Perfetto), <prefix>.json (summary) are written and a text summary is printed.
+ Profiling is enabled by the environment variable SURRENDER_PROFILE=<prefix>
+ ('1' for 'surrender_profile') once the startup hook is installed:
+   python -m surrender_profiler --install-hook [site-packages directory]
+ writes a .pth file (user site-packages by default) making every Python
+ process started with the variable set profile the clients it creates, so
+ that 'SURRENDER_PROFILE=prof python script.py' needs no code change (pytest
+ workers suffix the prefix with their name; --uninstall-hook removes it).
+ Without the hook, the variable is only read by:
+ - the tests: pytest with conftest.py wraps the s fixture when it is set,
+ - a script: python -m surrender_profiler script_01_rendering_a_sphere.py
+   (always profiles, prefix 'surrender_profile' when the variable is not set),
+ - any other code: call install(prefix) before creating the clients.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import runpy
+import threading
+import numpy as np
+from client_proxy import ClientProxy, patch_surrender_module
+
+ENV_VARIABLE = 'SURRENDER_PROFILE'
+HOOK_FILE = 'surrender_profiler.pth'
+HISTOGRAM_BINS = 32         # bin k: [2^k, 2^(k+1)[ microseconds
+SCRIPT = '(script)'         # pseudo-method of the time between calls
+
+
+def payload_size(obj):
+    """Approximate number of bytes of <obj> on the wire (arrays and strings by content)."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_size(x) for x in obj)
+    if isinstance(obj, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in obj.items())
+    return 0 if obj is None else 8
+
+
+class Profile:
+    """Statistics and events of the calls of one or several clients."""
+
+    def __init__(self, max_events=1000000):
+        self.stats = {}         # method: [calls, seconds, bytes sent, bytes received, histogram]
+        self.events = []
+        self.max_events = max_events
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, t0, t1, sent=0, received=0, client=0):
+        seconds = t1 - t0
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, 0, 0, np.zeros(HISTOGRAM_BINS, np.int64)]
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] += sent
+            stat[3] += received
+            stat[4][min(max(int(seconds * 1e6).bit_length() - 1, 0), HISTOGRAM_BINS - 1)] += 1
+            if len(self.events) < self.max_events:
+                self.events.append((name, t0, seconds, sent, received, client))
+
+    def mark(self, label):
+        """Add an instant event (e.g. the start of a test) to the trace."""
+        with self._lock:
+            self.events.append((label, time.perf_counter(), None, 0, 0, 0))
+
+    def summary(self):
+        """Return {method: {calls, seconds, mean_us, p50_us, p95_us, sent, received, histogram}}; percentiles are bin upper bounds."""
+        result = {}
+        for name, (calls, seconds, sent, received, hist) in self.stats.items():
+            cumulative = np.cumsum(hist) / calls
+            result[name] = {
+                'calls': calls, 'seconds': seconds, 'mean_us': seconds / calls * 1e6,
+                'p50_us': float(2 ** (np.searchsorted(cumulative, 0.5) + 1)),
+                'p95_us': float(2 ** (np.searchsorted(cumulative, 0.95) + 1)),
+                'sent': sent, 'received': received, 'histogram': hist.tolist(),
+            }
+        return result
+
+    def text_summary(self):
+        summary = self.summary()
+        total = sum(s['seconds'] for s in summary.values()) or 1.0
+        lines = ['%-28s %7s %10s %6s %10s %10s %10s %12s %12s' % ('method', 'calls', 'total s', '%', 'mean us', 'p50 us', 'p95 us', 'sent B', 'received B')]
+        for name, s in sorted(summary.items(), key=lambda kv: -kv[1]['seconds']):
+            lines.append('%-28s %7d %10.3f %6.1f %10.1f %10.0f %10.0f %12d %12d'
+                         % (name, s['calls'], s['seconds'], 100 * s['seconds'] / total, s['mean_us'], s['p50_us'], s['p95_us'],
+                            s['sent'], s['received']))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        events = []
+        for name, t0, seconds, sent, received, client in self.events:
+            event = {'name': name, 'pid': pid, 'tid': client, 'ts': (t0 - self.origin) * 1e6}
+            if seconds is None:
+                event.update(ph='i', s='g')
+            else:
+                event.update(ph='X', dur=seconds * 1e6, cat='script' if name == SCRIPT else 'client',
+                             args={'sent': sent, 'received': received})
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export(self, prefix):
+        with open(prefix + '.trace.json', 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        with open(prefix + '.json', 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+    def export_at_exit(self, prefix):
+        def export():
+            if self.stats:
+                self.export(prefix)
+                print(self.text_summary(), file=sys.stderr)
+                print('Profile written to %s.trace.json and %s.json' % (prefix, prefix), file=sys.stderr)
+        atexit.register(export)
+
+
+class ProfilingClient(ClientProxy):
+    """Records the calls of <client> in <profile>."""
+
+    _count = 0
+
+    def __init__(self, client, profile):
+        ClientProxy.__init__(self, client)
+        self._profile = profile
+        self._last = None
+        ProfilingClient._count += 1
+        self._id = ProfilingClient._count
+
+    def _call(self, name, method, args, kwargs):
+        t0 = time.perf_counter()
+        if self._last is not None:
+            self._profile.add(SCRIPT, self._last, t0, client=self._id)
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            t1 = time.perf_counter()
+        self._profile.add(name, t0, t1, payload_size(args) + payload_size(kwargs), payload_size(result), self._id)
+        self._last = time.perf_counter()
+        return result
+
+
+def environment_prefix():
+    """Output prefix requested by SURRENDER_PROFILE, or None."""
+    value = os.environ.get(ENV_VARIABLE, '')
+    if value in ('', '0'):
+        return None
+    return 'surrender_profile' if value == '1' else value
+
+
+def installed():
+    """Profile of the clients of this process if install() was called (by the startup hook or an entry point), else None."""
+    return getattr(sys.modules.get('surrender.surrender_client'), '_surrender_profile', None)
+
+
+def install(prefix):
+    """Profile every client created by surrender_client() from now on, and export to <prefix> at exit. Returns the Profile."""
+    profile = installed()
+    if profile is not None:
+        return profile
+    profile = Profile()
+    patch_surrender_module(lambda client: ProfilingClient(client, profile))
+    sys.modules['surrender.surrender_client']._surrender_profile = profile
+    profile.export_at_exit(prefix)
+    return profile
+
+
+def install_from_environment():
+    """Startup hook: install() with the prefix of SURRENDER_PROFILE, if set and the client is installed."""
+    prefix = environment_prefix()
+    if prefix is None:
+        return None
+    worker = os.environ.get('PYTEST_XDIST_WORKER')
+    if worker:
+        prefix += '_' + worker
+    try:
+        return install(prefix)
+    except ImportError:
+        return None
+
+
+def hook_directory():
+    import site
+    import sysconfig
+    return site.getusersitepackages() if site.ENABLE_USER_SITE else sysconfig.get_paths()['purelib']
+
+
+def install_hook(site_dir=None):
+    """Write the .pth startup hook in <site_dir> (user site-packages by default). Returns its path."""
+    site_dir = site_dir or hook_directory()
+    os.makedirs(site_dir, exist_ok=True)
+    path = os.path.join(site_dir, HOOK_FILE)
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(path, 'w') as f:
+        # Lines of .pth files starting with 'import' are executed at startup: nothing is imported unless profiling
+        f.write("import os; os.environ.get(%r, '') in ('', '0') or __import__('sys').path.append(%r) "
+                "or __import__('surrender_profiler').install_from_environment()\n" % (ENV_VARIABLE, here))
+    return path
+
+
+def uninstall_hook(site_dir=None):
+    """Remove the startup hook from <site_dir>. Returns its path if it was installed, else None."""
+    path = os.path.join(site_dir or hook_directory(), HOOK_FILE)
+    if not os.path.isfile(path):
+        return None
+    os.remove(path)
+    return path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: [SURRENDER_PROFILE=prefix] python -m surrender_profiler script.py [args...]\n'
+              '       python -m surrender_profiler --install-hook|--uninstall-hook [site-packages directory]', file=sys.stderr)
+        sys.exit(2)
+    if sys.argv[1] == '--install-hook':
+        print('Startup hook written to %s' % install_hook(sys.argv[2] if len(sys.argv) > 2 else None))
+        sys.exit(0)
+    if sys.argv[1] == '--uninstall-hook':
+        path = uninstall_hook(sys.argv[2] if len(sys.argv) > 2 else None)
+        print('Startup hook %s removed' % path if path else 'No startup hook installed')
+        sys.exit(0)
+    install(environment_prefix() or 'surrender_profile')
+    script = sys.argv[1]
+    sys.argv = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name='__main__')
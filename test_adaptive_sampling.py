@@ -0,0 +1,80 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : adaptive sampling controller on a simulated variance map (no server needed)
+"""
+import numpy as np
+import pytest
+from adaptive_sampling import AdaptiveSampler
+from variance_map import variance_convention, sample_variance
+
+
+class NoisyServer:
+    """Renders a uniform image of level 1 with per-sample variance <variance>, the map being in <convention>."""
+
+    def __init__(self, variance, convention):
+        self.variance = variance
+        self.convention = convention
+        self.samples = None
+        self.threshold = 0.0
+        self.renders = []
+
+    def enableVarianceMapping(self, enabled):
+        pass
+
+    def setNbSamplesPerPixel(self, n):
+        self.samples = n
+
+    def setStdDevThreshold(self, threshold):
+        self.threshold = threshold
+
+    def render(self):
+        self.renders.append(self.samples)
+
+    def getImageGray32F(self):
+        return np.ones((8, 8), np.float32)
+
+    def getVarianceMap(self):
+        level = self.variance / self.samples if self.convention == 'mean' else self.variance
+        return np.full((8, 8), level)
+
+
+def test_variance_convention():
+    assert variance_convention(1.0, 1.1, 16, 64) == 'sample'
+    assert variance_convention(1.0, 0.26, 16, 64) == 'mean'
+    assert variance_convention(1.0, 0.5, 16, 64) is None
+    assert variance_convention(0.0, 0.0, 16, 64) is None
+    assert sample_variance(np.array([0.5]), 'mean', 4)[0] == 2.0
+
+
+@pytest.mark.parametrize('convention', ['sample', 'mean'])
+def test_samples_reach_the_target(convention):
+    # Relative noise sqrt(1 / n): 0.25 at 16 samples, 0.1 (the target) at 100
+    s = NoisyServer(1.0, convention)
+    sampler = AdaptiveSampler(s, 0.1, samples=16, damping=0.0)
+    sampler.render()
+    assert sampler.convention == convention
+    assert s.renders == [4, 16]
+    assert sampler.log[0][3] == pytest.approx(0.25)
+    assert sampler.samples == 100
+    sampler.render()
+    assert s.renders[-1] == 100
+    assert sampler.log[1][3] == pytest.approx(0.1)
+
+
+def test_threshold_once_settled():
+    s = NoisyServer(1.0, 'sample')
+    sampler = AdaptiveSampler(s, 0.1, samples=100, damping=0.0, threshold_after=2)
+    for _ in range(2):
+        sampler.render()
+    assert s.threshold == 0.0
+    sampler.render()
+    assert s.threshold == pytest.approx(0.1)
+    assert s.renders[-1] == 100
+    # A harder scene (noise above the target although some pixels stop early): back to the sample control
+    s.variance = 4.0
+    sampler.render()
+    assert sampler.threshold == 0.0 and sampler.samples == 400
+    sampler.render()
+    assert s.threshold == 0.0 and s.renders[-1] == 400
@@ -0,0 +1,63 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : comparison metrics of simulated and real frames on synthetic silhouettes
+"""
+import csv
+import numpy as np
+import pytest
+import amica_compare as ac
+
+
+def disk(shape=(64, 80), center=(30, 40), radius=12, value=1.0):
+    yy, xx = np.indices(shape)
+    return np.where(np.hypot(yy - center[0], xx - center[1]) <= radius, value, 0.0)
+
+
+def test_resample():
+    image = np.arange(16.0).reshape(4, 4)
+    assert np.array_equal(ac.resample(image, (2, 2)), [[2.5, 4.5], [10.5, 12.5]])
+    assert ac.resample(image, (4, 4)) is image
+    assert ac.resample(image, (3, 3)).shape == (3, 3)
+
+
+def test_identical_frames():
+    sim = np.stack([disk(), disk(radius=8)])
+    metrics = ac.compare_frames(sim, 3 * sim)
+    assert np.allclose(metrics['ncc'], 1) and np.allclose(metrics['brightness'], 1)
+    assert np.all(metrics['shift_x'] == 0) and np.all(metrics['shift_y'] == 0)
+    assert np.allclose(metrics['limb_offset'], 0)
+
+
+def test_shifted_frames():
+    sim = disk()[None]
+    real = disk(center=(25, 47))[None]
+    metrics = ac.compare_frames(sim, real)
+    # Shift aligning the real frame onto the simulated one
+    assert metrics['shift_y'][0] == 5 and metrics['shift_x'][0] == -7
+    assert np.allclose(metrics['ncc'], 1)
+    assert abs(metrics['limb_offset'][0] - np.hypot(5, 7)) < 1e-9
+
+
+def test_brightness_ratio():
+    sim = disk()
+    sim[30, 40] = 2.0
+    # Normalized to their maxima, the simulated silhouette is twice as dark as the real one
+    metrics = ac.compare_frames(sim[None], disk()[None])
+    assert metrics['brightness'][0] == pytest.approx(2.0, rel=0.01)
+
+
+def test_pool_report(tmp_path):
+    fits = pytest.importorskip('astropy.io.fits')
+    with ac.ComparisonPool(str(tmp_path / 'report.csv'), workers=1, batch_size=2) as pool:
+        for i, center in enumerate([(30, 40), (32, 40), (30, 45)]):
+            path = str(tmp_path / ('real_%d.fits' % i))
+            # Real frames at twice the resolution of the simulated ones
+            fits.writeto(path, disk((128, 160), (2 * center[0], 2 * center[1]), 24))
+            pool.submit('frame_%d' % (2 - i), disk(), path)
+    with open(str(tmp_path / 'report.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert [r['name'] for r in rows] == ['frame_0', 'frame_1', 'frame_2']
+    assert [int(r['shift_y']) for r in rows] == [0, -2, 0]
+    assert [int(r['shift_x']) for r in rows] == [-5, 0, 0]
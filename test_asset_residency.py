@@ -0,0 +1,44 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : routing of compiled scenarios by the asset residency manager, without servers
+"""
+import numpy as np
+from scenario_compiler import Program
+from asset_residency import ResidencyManager
+
+E1, E2 = ('host1', 5151), ('host2', 5151)
+
+
+def program(name, meshes, frames=1):
+    resources = [('createMesh', (obj, path, 1.0)) for obj, path in meshes]
+    return Program(name, [('setConventions', (0, 1))], resources, [], [[] for _ in range(frames)])
+
+
+def asset(tmp_path, name, megabytes=1):
+    path = str(tmp_path / name)
+    np.zeros(megabytes * 125000).tofile(path)
+    return path
+
+
+def test_resident_assets_lost_on_reset(tmp_path):
+    rock = asset(tmp_path, 'rock.obj')
+    manager = ResidencyManager([E1, E2], load_cost=100)
+    manager.resource_calls(E1, program('a', [('boulder', rock)]))
+    manager.resource_calls(E2, program('b', [('pebble', rock)]))
+    # Both servers hold rock.obj, but E1 would be reset: it holds an object the scenario does not have
+    plan = manager.plan([program('c', [('pebble', rock)])])
+    assert [p.name for p in plan[E2]] == ['c'] and not plan[E1]
+    assert set(manager.servers[E1].objects) == {'boulder'}
+
+
+def test_assets_accumulate_along_the_plan(tmp_path):
+    rock, ice = asset(tmp_path, 'rock.obj'), asset(tmp_path, 'ice.obj')
+    manager = ResidencyManager([E1, E2], load_cost=100)
+    manager.resource_calls(E1, program('a', [('boulder', rock)]))
+    programs = [program('b', [('boulder', rock), ('floe', ice)], frames=3),
+                program('c', [('boulder', rock), ('floe', ice), ('pebble', rock)])]
+    # c builds on top of b: E1 holds both files once b is planned there
+    plan = manager.plan(programs)
+    assert [p.name for p in plan[E1]] == ['b', 'c']
@@ -0,0 +1,56 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : client proxies and client class patching, on a dummy client class
+"""
+import types
+from client_proxy import ClientProxy, patch_client_factory
+
+
+class DummyClient:
+    SCALAR_XYZ_CONVENTION = 3
+
+    def __init__(self, verbosity=0):
+        self.verbosity = verbosity
+        self.calls = []
+
+    def render(self):
+        self.calls.append('render')
+        return 'rendered'
+
+
+class Counter(ClientProxy):
+    def __init__(self, client):
+        ClientProxy.__init__(self, client)
+        self.count = 0
+
+    def _call(self, name, method, args, kwargs):
+        self.count += 1
+        return method(*args, **kwargs)
+
+
+def test_proxy_forwards_calls():
+    s = Counter(DummyClient())
+    assert s.render() == 'rendered'
+    assert s.count == 1 and s.calls == ['render']
+    assert isinstance(s, DummyClient) and isinstance(s, Counter)
+
+
+def test_patched_name_stays_a_class():
+    module = types.ModuleType('script')
+    module.surrender_client = DummyClient
+    restore = patch_client_factory(module, Counter)
+    s = module.surrender_client(verbosity=2)
+    assert isinstance(s, Counter) and s.verbosity == 2
+    s.render()
+    assert s.count == 1
+    assert isinstance(module.surrender_client, type) and issubclass(module.surrender_client, DummyClient)
+    assert module.surrender_client.SCALAR_XYZ_CONVENTION == 3
+    assert isinstance(s, module.surrender_client) and isinstance(DummyClient(), module.surrender_client)
+    # Patching twice wraps twice
+    restore_twice = patch_client_factory(module, Counter)
+    assert isinstance(module.surrender_client(), module.surrender_client)
+    restore_twice()
+    restore()
+    assert module.surrender_client is DummyClient
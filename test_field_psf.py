@@ -0,0 +1,65 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : field-varying PSF convolution, compared with a single kernel and across tile sizes
+"""
+import numpy as np
+import pytest
+from field_psf import FieldPSF, axis_weights
+from psf_convolution import convolve
+
+
+def kernels(rows, cols, size=5, seed=0):
+    rng = np.random.default_rng(seed)
+    return [[rng.random((size, size)) for _ in range(cols)] for _ in range(rows)]
+
+
+def test_axis_weights():
+    w = axis_weights(100, 4, 0, 100)
+    assert w.shape == (4, 100)
+    assert np.allclose(w.sum(axis=0), 1)
+    # Exact at the cell centers, clamped beyond the outer ones
+    assert w[0, 12] == 1 and w[0, 0] == 1 and w[3, 99] == 1
+    assert np.allclose(axis_weights(100, 4, 30, 60), w[:, 30:60])
+    assert np.all(axis_weights(10, 1, 0, 10) == 1)
+
+
+@pytest.mark.parametrize('tile', [16, 23, 64])
+def test_uniform_field_matches_single_kernel(tile):
+    kernel = kernels(1, 1)[0][0]
+    image = np.random.default_rng(1).random((48, 61))
+    field = FieldPSF([[kernel, kernel], [kernel, kernel]], tile)
+    assert np.allclose(field.convolve(image, workers=0), convolve(image, kernel))
+
+
+def test_tiles_do_not_change_the_result():
+    image = np.random.default_rng(2).random((40, 52)).astype(np.float32)
+    grid = kernels(2, 3)
+    whole = FieldPSF(grid, tile=64).convolve(image, workers=0)
+    tiled = FieldPSF(grid, tile=9).convolve(image, workers=0)
+    assert whole.dtype == np.float32
+    assert np.allclose(whole, tiled, atol=1e-5)
+
+
+def test_kernel_exact_at_cell_center():
+    grid = [[np.eye(3) / 3, np.full((3, 3), 1 / 9)]]
+    # Centers of the cells of a 42 pixels wide image at x = 10 and 31
+    image = np.zeros((20, 42))
+    image[10, 10] = image[10, 31] = 1
+    out = FieldPSF(grid, tile=8).convolve(image, workers=0)
+    assert np.allclose(out[9:12, 9:12], np.eye(3) / 3)
+    assert np.allclose(out[9:12, 30:33], 1 / 9)
+
+
+def test_kernels_of_different_shapes():
+    with pytest.raises(ValueError):
+        FieldPSF([[np.ones((3, 3)), np.ones((5, 5))]])
+
+
+def test_worker_processes():
+    image = np.random.default_rng(3).random((32, 32))
+    field = FieldPSF(kernels(2, 2), tile=16)
+    frames = list(field.convolve_frames([image, 2 * image], workers=2))
+    assert np.allclose(frames[0], field.convolve(image, workers=0))
+    assert np.allclose(frames[1], 2 * frames[0])
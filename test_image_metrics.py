@@ -0,0 +1,65 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : image comparison metrics and their early exit, on random images
+"""
+import numpy as np
+from image_metrics import compare_images, tile_max
+
+
+def star_field(shape=(128, 128), count=40, seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.zeros(shape, np.float32)
+    stars = rng.integers(8, shape[0] - 8, (count, 2))
+    image[stars[:, 0], stars[:, 1]] = 1.0
+    return image, stars
+
+
+def test_identical_images():
+    image, _ = star_field()
+    result = compare_images(image, image, star_threshold=0.5)
+    assert result['l2'] == 0.0 and result['max'] == 0.0
+    assert result['hist'][0] == image.size
+    assert result['star_shift_max'] == 0.0
+
+
+def test_early_exit_does_not_miss_stars():
+    reference, stars = star_field()
+    image = reference.copy()
+    image[stars[::2, 0], stars[::2, 1]] = 0.0
+    result = compare_images(image, reference, early_exit=1e-3)
+    assert not result['early_exit']
+    assert result['max'] == 1.0
+    # Stars all on the pixels skipped by a strided subsample
+    image = reference.copy()
+    image[1::4, 1::4] = 1.0
+    result = compare_images(image, reference, early_exit=1e-3)
+    assert not result['early_exit']
+    assert result['max'] == 1.0
+
+
+def test_early_exit_below_threshold():
+    reference, _ = star_field()
+    image = reference + np.float32(1e-5)
+    result = compare_images(image, reference, early_exit=1e-3)
+    assert result['early_exit']
+    assert result['max'] < 1e-3
+    assert 'hist' not in result
+
+
+def test_tile_max_borders():
+    err = np.zeros((70, 65))
+    err[69, 64] = 2.0
+    tiles = tile_max(err, 32)
+    assert tiles.shape == (3, 3)
+    assert tiles[2, 2] == 2.0 and tiles.sum() == 2.0
+
+
+def test_rgba8_normalization():
+    reference = np.zeros((16, 16, 4), np.uint8)
+    image = reference.copy()
+    image[3, 4, 1] = 255
+    image[..., 3] = 17
+    result = compare_images(image, reference, with_ssim=False)
+    assert result['max'] == 1.0
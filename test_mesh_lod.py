@@ -0,0 +1,82 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : mesh simplification levels and their selection from the pixel footprint
+"""
+import numpy as np
+import pytest
+import mesh_lod
+
+
+def sphere(n=64):
+    """UV sphere of radius 1: (vertices, triangles)."""
+    theta, phi = np.meshgrid(np.linspace(0, np.pi, n + 1)[1:-1], np.linspace(0, 2 * np.pi, 2 * n, endpoint=False), indexing='ij')
+    vertices = np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)], axis=-1).reshape(-1, 3)
+    vertices = np.concatenate([[[0, 0, 1]], vertices, [[0, 0, -1]]])
+    rows, cols = n - 1, 2 * n
+    index = 1 + np.arange(rows * cols).reshape(rows, cols)
+    right = np.roll(index, -1, axis=1)
+    quads = [index[:-1], right[:-1], right[1:], index[1:]]
+    triangles = [np.stack([quads[0], quads[1], quads[2]], -1).reshape(-1, 3), np.stack([quads[0], quads[2], quads[3]], -1).reshape(-1, 3),
+                 np.stack([np.zeros(cols, int), right[0], index[0]], -1),
+                 np.stack([np.full(cols, len(vertices) - 1), index[-1], right[-1]], -1)]
+    return vertices, np.concatenate(triangles)
+
+
+def test_levels_face_counts(tmp_path):
+    vertices, triangles = sphere()
+    path = str(tmp_path / 'ball.obj')
+    mesh_lod.write_obj(path, vertices, triangles)
+    levels = mesh_lod.load_levels(mesh_lod.build_levels(path, levels=4, min_faces=100))
+    assert levels[0]['file'] == 'ball.obj' and levels[0]['faces'] == len(triangles)
+    faces = [level['faces'] for level in levels]
+    edges = [level['edge'] for level in levels]
+    assert len(levels) > 2
+    assert all(a > b for a, b in zip(faces, faces[1:]))
+    assert all(a < b for a, b in zip(edges, edges[1:]))
+    for level in levels[1:]:
+        v, t = mesh_lod.read_obj(str(tmp_path / level['file']))
+        assert (len(v), len(t)) == (level['vertices'], level['faces'])
+        assert np.allclose(np.linalg.norm(v, axis=1), 1, atol=0.2)
+
+
+def test_read_obj_polygons_and_attributes(tmp_path):
+    path = str(tmp_path / 'quad.obj')
+    with open(path, 'w') as f:
+        f.write('v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nvn 0 0 1\nf 1//1 2//1 3//1 4//1\n')
+    with pytest.raises(ValueError):
+        mesh_lod.read_obj(path)
+    vertices, triangles = mesh_lod.read_obj(path, drop_attributes=True)
+    assert vertices.shape == (4, 3)
+    assert triangles.tolist() == [[0, 1, 2], [0, 2, 3]]
+
+
+def test_select_level():
+    levels = [{'file': 'lod0', 'edge': 1.0}, {'file': 'lod1', 'edge': 2.0}, {'file': 'lod2', 'edge': 4.0}]
+    # 1 pixel = 2 * tan(2.5 deg) * distance / 768
+    footprint = mesh_lod.pixel_footprint(1.0, 5, 768)
+    assert mesh_lod.select_level(levels, 0.5 / footprint, 5, 768)['file'] == 'lod0'
+    assert mesh_lod.select_level(levels, 2.5 / footprint, 5, 768)['file'] == 'lod1'
+    assert mesh_lod.select_level(levels, 1e3 / footprint, 5, 768)['file'] == 'lod2'
+    assert mesh_lod.select_level(levels, 2.5 / footprint, 5, 768, scale=10)['file'] == 'lod0'
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+
+def test_lod_mesh_per_frame():
+    levels = [{'file': 'lod0', 'edge': 1.0}, {'file': 'lod1', 'edge': 2.0}]
+    footprint = mesh_lod.pixel_footprint(1.0, 5, 768)
+    s = Recorder()
+    mesh = mesh_lod.LODMesh(s, 'asteroid', levels, 5, 768, 1.0, 'hapke')
+    assert mesh.update(0.5 / footprint)
+    assert not mesh.update(0.6 / footprint)
+    assert mesh.update(3 / footprint)
+    assert s.calls == [('createMesh', 'asteroid', 'lod0', 1.0), ('setObjectElementBRDF', 'asteroid', 'asteroid', 'hapke'),
+                       ('createMesh', 'asteroid', 'lod1', 1.0), ('setObjectElementBRDF', 'asteroid', 'asteroid', 'hapke')]
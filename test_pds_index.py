@@ -0,0 +1,66 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : PDS3 label index built from labels written on the fly
+"""
+import os
+import numpy as np
+import pytest
+from pds_index import LabelIndex, parse_label
+
+
+def write_label(directory, name, start_time, exposure='0.0125 <SECOND>', filter='"v"', target='"ITOKAWA"'):
+    lines = ['PDS_VERSION_ID = PDS3']
+    if start_time is not None:
+        lines.append('START_TIME = %s' % start_time)
+    lines += ['EXPOSURE_DURATION = %s' % exposure, 'FILTER_NAME = %s' % filter, 'TARGET_NAME = %s' % target,
+              'END', 'START_TIME = 1999-01-01T00:00:00']
+    path = os.path.join(str(directory), name)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def test_parse_label(tmp_path):
+    values = parse_label(write_label(tmp_path, 'a.lbl', '2005-09-11T01:20:00.000'))
+    assert values == {'START_TIME': '2005-09-11T01:20:00.000', 'EXPOSURE_DURATION': '0.0125',
+                      'FILTER_NAME': 'v', 'TARGET_NAME': 'ITOKAWA'}
+
+
+def test_update_is_incremental(tmp_path):
+    write_label(tmp_path, 'b.lbl', '2005-09-11T02:00:00')
+    write_label(tmp_path, 'a.lbl', '2005-09-11T03:00:00', exposure='bad')
+    index_file = str(tmp_path / 'index.npy')
+    index = LabelIndex(index_file)
+    assert index.update(str(tmp_path)) == 2
+    assert index.table['file'].tolist() == ['b.lbl', 'a.lbl']
+    assert np.isnan(index.table['exposure'][1]) and index.table['exposure'][0] == 0.0125
+    assert index.update(str(tmp_path)) == 0
+
+    os.remove(str(tmp_path / 'b.lbl'))
+    write_label(tmp_path, 'c.lbl', '2005-09-11T01:00:00')
+    assert index.update(str(tmp_path)) == 1
+    reloaded = LabelIndex(index_file)
+    assert reloaded.table['file'].tolist() == ['c.lbl', 'a.lbl']
+
+
+def test_select(tmp_path):
+    write_label(tmp_path, 'st_1.lbl', '2005-09-11T03:00:00')
+    write_label(tmp_path, 'st_2.lbl', '2005-09-11T01:00:00', filter='"w"')
+    write_label(tmp_path, 'xx_3.lbl', '2005-09-11T02:00:00', target='"SKY"')
+    index = LabelIndex(str(tmp_path / 'index.npy'))
+    index.update(str(tmp_path))
+    assert index.select()['file'].tolist() == ['st_2.lbl', 'xx_3.lbl', 'st_1.lbl']
+    assert index.select(match='st_')['file'].tolist() == ['st_2.lbl', 'st_1.lbl']
+    assert index.select(filter='v', target='ITOKAWA')['file'].tolist() == ['st_1.lbl']
+    assert index.select(start='2005-09-11T01:30:00', stop='2005-09-11T02:30:00')['file'].tolist() == ['xx_3.lbl']
+
+
+def test_missing_start_time(tmp_path):
+    write_label(tmp_path, 'a.lbl', '2005-09-11T03:00:00')
+    write_label(tmp_path, 'nostart.lbl', None)
+    index = LabelIndex(str(tmp_path / 'index.npy'))
+    with pytest.raises(ValueError, match='nostart.lbl'):
+        index.update(str(tmp_path))
+    assert len(index) == 0 and not os.path.exists(str(tmp_path / 'index.npy'))
@@ -0,0 +1,65 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : Hermite position and SLERP/SQUAD attitude interpolation on analytic trajectories
+"""
+import numpy as np
+import pytest
+import pose_interpolation as pi
+
+
+def axis_angle(axis, angle):
+    axis = np.asarray(axis, dtype=np.float64) / np.linalg.norm(axis)
+    return np.r_[np.cos(angle / 2), np.sin(angle / 2) * axis]
+
+
+def test_frame_times():
+    t = pi.frame_times(10.0, 11.0, 4)
+    assert np.allclose(t, [10, 10.25, 10.5, 10.75, 11])
+
+
+def test_hermite_endpoints_and_cubic():
+    t = np.array([0.0, 1.0, 3.0])
+    f = lambda x: np.stack([x ** 3 - x, 2 * x ** 2], axis=-1)
+    df = lambda x: np.stack([3 * x ** 2 - 1, 4 * x], axis=-1)
+    assert np.allclose(pi.hermite(t, f(t), df(t), t), f(t))
+    # Exact for cubics when given the true velocities
+    x = np.linspace(0, 3, 31)
+    assert np.allclose(pi.hermite(t, f(t), df(t), x), f(x))
+
+
+def test_hermite_requires_increasing_times():
+    with pytest.raises(ValueError):
+        pi.hermite([0.0, 0.0], np.zeros((2, 3)), np.zeros((2, 3)), [0.0])
+
+
+def test_slerp_endpoints_and_midpoint():
+    q0 = np.array([axis_angle([0, 0, 1], 0.0)])
+    q1 = np.array([axis_angle([0, 0, 1], 1.0)])
+    assert np.allclose(pi.slerp(q0, q1, [0.0]), q0)
+    assert np.allclose(pi.slerp(q0, q1, [1.0]), q1)
+    assert np.allclose(pi.slerp(q0, q1, [0.5]), axis_angle([0, 0, 1], 0.5))
+    # Opposite signs describe the same attitude: the shortest path is taken
+    assert np.allclose(pi.slerp(q0, -q1, [0.5]), axis_angle([0, 0, 1], 0.5))
+
+
+@pytest.mark.parametrize('method', ['slerp', 'squad'])
+def test_attitude_through_samples(method):
+    t = np.arange(5.0)
+    q = np.array([axis_angle([0, 0, 1], 0.3 * k) for k in range(5)])
+    q[2] *= -1
+    out = pi.interpolate_attitude(t, q, t, method)
+    assert np.allclose(np.abs(np.einsum('ij,ij->i', out, q)), 1)
+    # Constant rate rotation about a fixed axis is reproduced between the samples
+    # (SQUAD duplicates the end samples to build its end controls: interior segments only)
+    x = np.linspace(0, 4, 17) if method == 'slerp' else np.linspace(1, 3, 9)
+    expected = np.array([axis_angle([0, 0, 1], 0.3 * v) for v in x])
+    out = pi.interpolate_attitude(t, q, x, method)
+    assert np.allclose(np.abs(np.einsum('ij,ij->i', out, expected)), 1)
+    assert np.allclose(np.linalg.norm(out, axis=1), 1)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        pi.interpolate_attitude([0.0, 1.0], np.eye(4)[:2], [0.5], 'linear')
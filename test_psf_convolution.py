@@ -0,0 +1,82 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : FFT PSF convolution checked against a direct convolution
+"""
+import numpy as np
+import pytest
+import psf_convolution as pc
+
+
+def direct_convolution(image, kernel):
+    """'same' size convolution, zero outside of the image, kernel centered on its central sample."""
+    kh, kw = kernel.shape
+    h, w = image.shape
+    padded = np.zeros((h + kh - 1, w + kw - 1))
+    padded[kh - 1 - kh // 2:kh - 1 - kh // 2 + h, kw - 1 - kw // 2:kw - 1 - kw // 2 + w] = image
+    out = np.zeros((h, w))
+    for i in range(kh):
+        for j in range(kw):
+            out += kernel[i, j] * padded[kh - 1 - i:kh - 1 - i + h, kw - 1 - j:kw - 1 - j + w]
+    return out
+
+
+def random_case(shape=(37, 50), kernel_shape=(7, 5), seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random(shape), rng.random(kernel_shape)
+
+
+def test_next_fast_len():
+    for n in (1, 7, 97, 121, 1000):
+        m = pc.next_fast_len(n)
+        assert m >= n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        assert m == 1
+    assert pc.next_fast_len(97) == 100
+
+
+@pytest.mark.parametrize('kernel_shape', [(7, 5), (4, 6), (1, 1)])
+def test_fft_matches_direct(kernel_shape):
+    image, kernel = random_case(kernel_shape=kernel_shape)
+    assert np.allclose(pc.convolve(image, kernel), direct_convolution(image, kernel))
+
+
+def test_batch_and_many():
+    image, kernel = random_case()
+    _, other = random_case(seed=1)
+    batch = np.stack([image, 2 * image])
+    out = pc.convolve(batch, kernel)
+    assert out.shape == batch.shape
+    assert np.allclose(out[1], 2 * direct_convolution(image, kernel))
+    many = pc.convolve_many(image, [kernel, other])
+    assert np.allclose(many[0], direct_convolution(image, kernel))
+    assert np.allclose(many[1], direct_convolution(image, other))
+
+
+def test_field_uniform_weights():
+    image, kernel = random_case()
+    _, other = random_case(seed=1)
+    weights = np.stack([np.full(image.shape, 0.25), np.full(image.shape, 0.75)])
+    expected = 0.25 * direct_convolution(image, kernel) + 0.75 * direct_convolution(image, other)
+    assert np.allclose(pc.convolve_field(image, [kernel, other], weights), expected)
+
+
+def test_output_dtype_and_flux():
+    image = np.zeros((32, 32), np.uint16)
+    image[16, 16] = 1000
+    kernel = np.ones((5, 5)) / 25
+    out = pc.convolve(image, kernel)
+    assert out.dtype == np.float32
+    assert abs(out.sum() - 1000) < 1e-2
+    assert pc.convolve(image.astype(np.float64), kernel).dtype == np.float64
+
+
+def test_pixel_kernel():
+    psf = np.ones((9, 9))
+    binned = pc.pixel_kernel(psf, 3)
+    assert binned.shape == (3, 3) and np.allclose(binned, 1 / 9)
+    with pytest.raises(ValueError):
+        pc.pixel_kernel(np.ones((10, 10)), 3)
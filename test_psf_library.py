@@ -0,0 +1,123 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : PSF library kernels and setPSF session tracking, against a recording client
+"""
+import os
+import numpy as np
+import pytest
+import psf_library
+from psf_library import PSFSession
+
+
+class RecordingClient:
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+        return call
+
+
+def hand_built_gaussian(size, sigma=1.0):
+    # Kernel previously built inline by the scripts and the regression tests
+    psf = np.array(range(size)) - int(size / 2)
+    psf = np.meshgrid(psf, psf)
+    psf = np.exp(-(psf[0] ** 2 + psf[1] ** 2) / (2. * sigma ** 2))
+    return psf / np.sum(psf)
+
+
+@pytest.mark.parametrize('size, sigma', [(3, 1.0), (5, 1.0), (11, 0.25)])
+def test_gaussian_matches_hand_built(size, sigma):
+    assert np.array_equal(psf_library.gaussian(size, sigma), hand_built_gaussian(size, sigma))
+
+
+def test_kernels_memoized_and_read_only():
+    psf_library.cache_clear()
+    psf = psf_library.gaussian(5)
+    assert psf_library.gaussian(5) is psf
+    assert psf_library.gaussian(5, 2.0) is not psf
+    with pytest.raises(ValueError):
+        psf[0, 0] = 1
+    assert psf_library.airy(9, 2.0, 3) is psf_library.airy(9, 2.0, 3)
+    psf_library.cache_clear()
+    assert psf_library.gaussian(5) is not psf
+
+
+def test_airy():
+    psf = psf_library.airy(15, 3.0, 2)
+    assert psf.shape == (30, 30) and abs(psf.sum() - 1) < 1e-12
+    assert not psf.flags.writeable
+    # Symmetric, brightest at the center, dark on the first ring
+    assert np.allclose(psf, psf[::-1, ::-1])
+    assert psf[14, 14] == psf.max()
+    assert np.allclose(psf_library.bessel_j1([0.0, psf_library.J1_FIRST_ZERO]), 0, atol=1e-12)
+
+
+def test_measured_reloaded_when_modified(tmp_path):
+    path = str(tmp_path / 'psf.txt')
+    np.savetxt(path, np.ones((3, 3)))
+    psf = psf_library.measured(path)
+    assert np.allclose(psf, 1 / 9) and psf_library.measured(path) is psf
+    np.savetxt(path, np.eye(3))
+    os.utime(path, (0, os.path.getmtime(path) + 10))
+    assert np.allclose(psf_library.measured(path), np.eye(3) / 3)
+
+
+def test_prepare_measured_psf(tmp_path, monkeypatch):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PSF.txt')
+    cache_dir = str(tmp_path / 'cache')
+    psf, width = psf_library.prepare(path, 10, 1.0, cache_dir)
+    assert psf.shape == (130, 130) and width == 13
+    assert abs(psf.sum() - 1) < 1e-12 and not psf.flags.writeable
+    assert len(os.listdir(cache_dir)) == 1
+    # A cache hit does not read the kernel file again and returns the same kernel
+    monkeypatch.setattr(psf_library, 'read_kernel', None)
+    cached, cached_width = psf_library.prepare(path, 10, 1.0, cache_dir)
+    assert np.array_equal(cached, psf) and cached_width == 13 and not cached.flags.writeable
+    # Other parameters: another cache entry
+    monkeypatch.undo()
+    assert psf_library.prepare(path, 2, 0.5, cache_dir)[0].shape == (14, 14)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_resample_conserves_flux():
+    psf = psf_library.normalize(np.random.default_rng(0).random((8, 8)))
+    resampled, width = psf_library.resample(psf, 3, 0.5)
+    assert width == 5 and resampled.shape == (15, 15)
+    assert abs(resampled.sum() - 1) < 1e-12
+    with pytest.raises(ValueError):
+        psf_library.normalize(-np.ones((3, 3)))
+
+
+def test_session_skips_loaded_kernel():
+    client = RecordingClient()
+    s = PSFSession(client)
+    psf = psf_library.gaussian(5)
+    s.setPSF(psf, 5, 5)
+    s.render()
+    s.setPSF(psf.copy(), 5, 5)
+    s.setPSF(psf, 3, 3)
+    s.reset()
+    s.setPSF(psf, 3, 3)
+    assert client.calls == ['setPSF', 'render', 'setPSF', 'reset', 'setPSF']
+    assert s.skipped == 1
+
+
+@pytest.mark.parametrize('call', ['setPSFSigma', 'enableFastPSFMode', 'runLuaScript', 'connectToServer'])
+def test_session_forgets_on_unknown_calls(call):
+    client = RecordingClient()
+    s = PSFSession(client)
+    psf = psf_library.gaussian(5)
+    s.setPSF(psf, 5, 5)
+    # Calls of PSF_NEUTRAL_CALLS leave the loaded kernel alone
+    for name in ('setObjectPosition', 'setImageSize', 'render', 'getImageGray32F'):
+        assert name in psf_library.PSF_NEUTRAL_CALLS
+        getattr(s, name)()
+    s.setPSF(psf, 5, 5)
+    getattr(s, call)()
+    s.setPSF(psf, 5, 5)
+    assert client.calls.count('setPSF') == 2 and s.skipped == 1
@@ -0,0 +1,73 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : removal of overwritten, no-op and frame-invariant calls from replays
+"""
+from replay_optimizer import optimize_replay, parse_replay, optimize
+
+REPLAY = """
+s.setImageSize(64, 64)
+s.setImageSize(128, 128)
+s.createBRDF('mate', 'mate.brdf', {})
+s.createBRDF('mate', 'mate.brdf', {})
+s.setCameraFOVDeg(10, 10)
+s.setObjectPosition('camera', (0, 0, 0))
+s.render()
+im = s.getImageGray32F()
+s.createBody('rock', 'ball', 'mate', [])
+s.setCameraFOVDeg(10, 10)
+s.setObjectPosition('camera', (0, 0, 0))
+s.setObjectPosition('sun', (0, 0, 1))
+s.render()
+s.createMesh('camera', 'camera.obj', 1)
+s.setCameraFOVDeg(10, 10)
+s.setObjectPosition('camera', (0, 0, 0))
+s.setObjectPosition('sun', (0, 0, 2))
+s.render()
+"""
+
+
+def lines(source):
+    return [l for l in optimize_replay(source)[0].splitlines() if l and not l.startswith('#')]
+
+
+def test_overwritten_and_duplicates():
+    kept = lines(REPLAY)
+    assert "s.setImageSize(64, 64)" not in kept
+    assert kept.count("s.setImageSize(128, 128)") == 1
+    assert kept.count("s.createBRDF('mate', 'mate.brdf', {})") == 1
+
+
+def test_frame_invariant_setters_hoisted():
+    kept = lines(REPLAY)
+    # Kept in the static setup only, although object creations happen between the frames
+    assert kept.count('s.setCameraFOVDeg(10, 10)') == 1
+    assert kept.index('s.setCameraFOVDeg(10, 10)') < kept.index('s.render()')
+    # Changing state stays in the frames
+    assert 's.setObjectPosition(\'sun\', (0, 0, 1))' in kept and 's.setObjectPosition(\'sun\', (0, 0, 2))' in kept
+    # The camera object is created again in the last frame: its position must be sent again
+    assert kept.count("s.setObjectPosition('camera', (0, 0, 0))") == 2
+
+
+def test_no_hoisting_across_reset():
+    source = "s.setCameraFOVDeg(10, 10)\ns.render()\ns.reset()\ns.setCameraFOVDeg(10, 10)\ns.render()\n"
+    assert lines(source).count('s.setCameraFOVDeg(10, 10)') == 2
+    source = "s.setObjectPosition('a', (0, 0, 1))\ns.render()\ns.createBody(name, 'ball', 'mate', [])\n" \
+             "s.setObjectPosition('a', (0, 0, 1))\ns.render()\n"
+    assert lines(source).count("s.setObjectPosition('a', (0, 0, 1))") == 2
+
+
+def test_variables_not_compared():
+    source = "s.setObjectPosition('sun', p)\ns.render()\np = (1, 2, 3)\ns.setObjectPosition('sun', p)\ns.render()\n"
+    _, items = parse_replay(source)
+    assert len(optimize(items)) == len(items)
+
+
+def test_keys_from_variables():
+    source = "name = 'a'\ns.setObjectPosition(name, (1, 2, 3))\nname = 'b'\ns.setObjectPosition(name, (4, 5, 6))\ns.render()\n"
+    assert lines(source) == source.splitlines()
+    # The variable may designate object 'a': its position must be sent again
+    source = "s.setObjectPosition('a', (1, 2, 3))\ns.render()\ns.setObjectPosition(name, (0, 0, 0))\n" \
+             "s.render()\ns.setObjectPosition('a', (1, 2, 3))\ns.render()\n"
+    assert lines(source).count("s.setObjectPosition('a', (1, 2, 3))") == 2
@@ -0,0 +1,106 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : trace files, replay script conversion and trace diff, on a fake client
+"""
+import numpy as np
+import pytest
+import replay_trace
+from replay_trace import TraceWriter, TraceReader, TraceRecorder, ClientConstant, ALIGNMENT
+
+
+class FakeClient:
+    XYZ_SCALAR_CONVENTION = 7
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return np.zeros((2, 2)) if name.startswith('get') else None
+        return call
+
+
+def write_trace(path):
+    psf = np.arange(25, dtype=np.float32).reshape(5, 5)
+    with TraceWriter(path) as writer:
+        writer.call('setConventions', (ClientConstant('XYZ_SCALAR_CONVENTION'), 1), {})
+        writer.call('setPSF', (psf, 5, 5), {})
+        writer.call('setObjectPosition', ('camera', np.array([0.0, 1.0, 2.0])), {})
+        writer.call('createShape', ('ball', 'sphere.shp', {'radius': np.float64(2.5)}), {})
+        writer.call('setPSF', (psf.copy(), 5, 5), {'oversampling': 1})
+        writer.call('render', (), {})
+    return psf
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'a.srt')
+    psf = write_trace(path)
+    reader = TraceReader(path)
+    calls = list(reader)
+    assert [c[0] for c in calls] == ['setConventions', 'setPSF', 'setObjectPosition', 'createShape', 'setPSF', 'render']
+    assert isinstance(calls[0][1][0], ClientConstant) and calls[0][1] == ['XYZ_SCALAR_CONVENTION', 1]
+    assert np.array_equal(calls[1][1][0], psf) and calls[1][1][0].dtype == np.float32
+    assert calls[2][1][1].tolist() == [0.0, 1.0, 2.0]
+    assert calls[3][1][2] == {'radius': 2.5}
+    assert calls[4][2] == {'oversampling': 1}
+    # Identical arrays are stored once, memory-mapped on aligned offsets
+    assert len(reader.arrays) == 2
+    for a in reader.arrays:
+        assert not a.flags.writeable
+        assert (a.__array_interface__['data'][0] - reader.arrays[0].__array_interface__['data'][0]) % ALIGNMENT == 0
+
+
+def test_play_resolves_constants(tmp_path):
+    path = str(tmp_path / 'a.srt')
+    write_trace(path)
+    s = FakeClient()
+    assert replay_trace.play(path, s) == 6
+    assert s.calls[0] == ('setConventions', (7, 1), {})
+    assert s.calls[-1] == ('render', (), {})
+
+
+def test_recorder_skips_getters(tmp_path):
+    path = str(tmp_path / 'r.srt')
+    with TraceWriter(path) as writer:
+        s = TraceRecorder(FakeClient(), writer)
+        s.setNbSamplesPerPixel(16)
+        s.render()
+        assert s.getImageGray32F().shape == (2, 2)
+    assert [c[0] for c in replay_trace.load(path)] == ['setNbSamplesPerPixel', 'render']
+
+
+def test_convert_and_diff(tmp_path):
+    source = "from surrender.surrender_client import surrender_client\nimport numpy as np\n" \
+             "s = surrender_client()\nv = 3\ns.setConventions(s.XYZ_SCALAR_CONVENTION, s.Z_FRONTWARD)\n" \
+             "s.setImageSize(64, 64)\ns.setImageSize(v, v)\ns.setPSF(np.ones((3, 3)), 3, 3)\ns.render()\nim = s.getImage()\n"
+    a, b = str(tmp_path / 'a.srt'), str(tmp_path / 'b.srt')
+    with TraceWriter(a) as writer:
+        replay_trace.convert(source, writer)
+    with TraceWriter(b) as writer:
+        replay_trace.convert(source, writer, optimize=True)
+    calls = replay_trace.load(a)
+    assert [c[0] for c in calls] == ['setConventions', 'setImageSize', 'setImageSize', 'setPSF', 'render']
+    assert calls[0][1] == ['XYZ_SCALAR_CONVENTION', 'Z_FRONTWARD']
+    assert calls[-3][1] == [3, 3]
+    assert np.array_equal(calls[-2][1][0], np.ones((3, 3)))
+    lines = replay_trace.diff(a, b)
+    assert '-setImageSize(64, 64)' in lines
+    assert not any(l.startswith('+') and not l.startswith('+++') for l in lines)
+
+
+@pytest.mark.parametrize('statement', ["for i in range(3):\n    s.render()", "body = s.createBody('a', 'ball', 'mate', [])"])
+def test_convert_refuses_hidden_calls(tmp_path, statement):
+    source = "s.setImageSize(64, 64)\n" + statement + "\n"
+    with TraceWriter(str(tmp_path / 'a.srt')) as writer:
+        with pytest.raises(ValueError, match='Line 2'):
+            replay_trace.convert(source, writer)
+
+
+def test_not_a_trace(tmp_path):
+    path = tmp_path / 'x.srt'
+    path.write_bytes(b'not a trace at all')
+    with pytest.raises(ValueError):
+        TraceReader(str(path))
@@ -0,0 +1,68 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : compilation of declarative scenarios into client calls
+"""
+import os
+import pytest
+from scenario_compiler import compile_scenario, load, ScenarioError
+
+SCENARIO = {
+    'name': 'test',
+    'conventions': ['XYZ_SCALAR_CONVENTION', 'Z_FRONTWARD'],
+    'settings': {'double_precision': True, 'samples': 16},
+    'brdfs': {'mate': {'file': 'mate.brdf'}, 'mate2': {'file': 'mate.brdf'}},
+    'shapes': {'ball': {'file': 'sphere.shp', 'params': {'radius': 1.0}}},
+    'bodies': {'a': {'shape': 'ball', 'brdf': 'mate', 'position': [0, 0, 10]},
+               'b': {'shape': 'ball', 'brdf': 'mate2', 'position': [0, 5, 10]}},
+    'camera': {'fov_deg': [10, 10], 'image_size': [64, 64], 'position': [0, 0, 0]},
+    'trajectory': [{'objects': {'a': {'position': [0, 0, 10]}}},
+                   {'objects': {'a': {'position': [0, 0, 20]}}, 'settings': {'samples': 16}}],
+}
+
+
+def test_settings_before_resources():
+    names = [name for name, _ in compile_scenario(SCENARIO).calls()]
+    first_resource = names.index('createBRDF')
+    assert names.index('setConventions') < first_resource
+    assert names.index('enableDoublePrecisionMode') < first_resource
+    assert names.index('setNbSamplesPerPixel') < first_resource
+    assert names.index('setImageSize') > names.index('createBody')
+    assert names[-1] == 'render'
+
+
+def test_duplicate_resources_created_once():
+    program = compile_scenario(SCENARIO)
+    assert [args[0] for name, args in program.resources if name == 'createBRDF'] == ['mate']
+    assert [args[2] for name, args in program.resources if name == 'createBody'] == ['mate', 'mate']
+
+
+def test_frames_only_hold_changes():
+    program = compile_scenario(SCENARIO)
+    assert program.frames[0] == []
+    assert program.frames[1] == [('setObjectPosition', ('a', (0.0, 0.0, 20.0)))]
+
+
+def test_resource_digest():
+    program = compile_scenario(SCENARIO)
+    moved = dict(SCENARIO, camera=dict(SCENARIO['camera'], position=[1, 0, 0]))
+    assert compile_scenario(moved).resource_digest() == program.resource_digest()
+    assert compile_scenario(moved).digest() != program.digest()
+    single = dict(SCENARIO, settings={'double_precision': False})
+    assert compile_scenario(single).resource_digest() != program.resource_digest()
+
+
+def test_errors():
+    with pytest.raises(ScenarioError):
+        compile_scenario(dict(SCENARIO, unknown={}))
+    with pytest.raises(ScenarioError):
+        compile_scenario(dict(SCENARIO, settings={'sample': 4}))
+    with pytest.raises(ScenarioError):
+        compile_scenario(dict(SCENARIO, trajectory=[{'objects': {'c': {'position': [0, 0, 0]}}}]))
+
+
+def test_scenario_files():
+    program = load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios', 'scr05_psf.json'))
+    names = [name for name, _ in program.calls()]
+    assert names.index('setConventions') < names.index('createBRDF') < names.index('setPSF')
@@ -0,0 +1,55 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Test : sensor noise and ADC model on flat images
+"""
+import numpy as np
+from sensor_model import SensorModel
+
+
+def test_broadcast_shapes_and_dtype():
+    sensor = SensorModel(responsivity=100, bits=12)
+    image = np.ones((8, 10))
+    dn = sensor.simulate(image, integration_time=[0.1, 0.2, 0.4], gain=[0.5, 1.0], rng=np.random.default_rng(0))
+    assert dn.shape == (2, 3, 8, 10)
+    assert dn.dtype == np.uint16
+    assert SensorModel(bits=8).simulate(image, rng=np.random.default_rng(0)).dtype == np.uint8
+
+
+def test_noise_free_values():
+    sensor = SensorModel(responsivity=100, dark_current=10, gain=2.0, offset=5, bits=10)
+    image = np.full((4, 4), 3.0)
+    dn = sensor.simulate(image, integration_time=[0.5, 2.0], noise=False)
+    assert np.allclose(dn[0], (3 * 100 + 10) * 0.5 * 2 + 5)
+    assert np.allclose(dn[1], 2 ** 10 - 1)
+
+
+def test_shot_noise_statistics():
+    sensor = SensorModel(responsivity=400, read_noise=3, bits=16)
+    dn = sensor.simulate(np.ones((200, 200)), rng=np.random.default_rng(1)).astype(np.float64)
+    assert abs(dn.mean() - 400) < 1
+    assert abs(dn.var() - (400 + 9)) < 15
+
+
+def test_fixed_pattern_reproducible():
+    a = SensorModel(prnu=0.01, dsnu=0.1, seed=3)
+    b = SensorModel(prnu=0.01, dsnu=0.1, seed=3)
+    assert np.array_equal(a.fixed_pattern((16, 16))[0], b.fixed_pattern((16, 16))[0])
+    assert a.fixed_pattern((16, 16)) is a.fixed_pattern((16, 16))
+    assert np.all(a.fixed_pattern((16, 16))[1] >= 0)
+
+
+def test_saturation_level():
+    sensor = SensorModel(full_well=1000, gain=1.0, offset=10, bits=12)
+    levels = sensor.saturation_level([1.0, 2.0, 8.0])
+    assert levels.tolist() == [1010, 2010, 4095]
+    assert SensorModel(bits=8).saturation_level().tolist() == 255
+    # A pixel beyond full well reaches the saturation level of each gain
+    dn = sensor.simulate(np.full((2, 2), 1e6), gain=[1.0, 2.0, 8.0], rng=np.random.default_rng(0))
+    assert np.array_equal(dn[:, 0, 0], levels)
+
+
+def test_snr():
+    sensor = SensorModel(responsivity=100, read_noise=0)
+    assert np.allclose(sensor.snr(np.ones((2, 2))), 10)
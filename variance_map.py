@@ -0,0 +1,34 @@
+#! python3
+# -*- coding: utf-8 -*-
+"""
+ SurRender
+ Module : Convention of the variance map (enableVarianceMapping)
+
+ getVarianceMap() may hold the variance of the samples of each pixel or the
+ variance of the pixel mean (the former divided by the sample count). The
+ convention is detected from two renders of the same scene at different
+ sample counts: the mean level of the map stays constant with the first, and
+ decreases as 1/samples with the second. progressive_render and
+ adaptive_sampling both rely on it.
+"""
+import numpy as np
+
+
+def variance_convention(previous, current, n_previous, n, tolerance=1.5):
+    """
+    Return 'sample' if the mean variance map level stays constant from <n_previous> to <n> samples (per-sample
+    variance), 'mean' if it decreases as 1/n (variance of the pixel mean), None if neither or both.
+    """
+    if previous <= 0 or current <= 0:
+        return None
+    ratio = current / previous
+    sample = abs(np.log(ratio)) < np.log(tolerance)
+    mean = abs(np.log(ratio * n / n_previous)) < np.log(tolerance)
+    if sample == mean:
+        return None
+    return 'sample' if sample else 'mean'
+
+
+def sample_variance(variance, convention, n):
+    """Per-sample variance from the variance map <variance> of a render with <n> samples in <convention>."""
+    return variance * n if convention == 'mean' else variance